@@ -19,252 +19,756 @@
 """Converts Common Alerting Protocol (CAP) files into KML files suitable for
 use with Diana (http://diana.met.no).
 
-  Usage: cap2kml.py <CAP file> [<KML file for Diana> [<input file for bdiana>]]
+  Usage: cap2kml.py [--precision=<digits>] [--simplify=<tolerance>]
+                    [--timings] [--profile=<file>] <CAP file>
+                    [<KML file for Diana> [<input file for bdiana>]]
+         cap2kml.py [--frames] [--area=<name>] [--precision=<digits>]
+                    [--simplify=<tolerance>] [--timings] [--profile=<file>]
+                    <CAP file> <KML file for Diana> <input file for bdiana>
+         cap2kml.py --bulk=<KML file or directory> [--split] [--workers=<number>]
+                    [--follow-links] [--precision=<digits>] [--simplify=<tolerance>]
+                    <feed or envelope file> ...
 
 Parses and validates the given CAP file. If an output KML file is specified,
 the KML text is written to the file; otherwise it is written to stdout.
 
+In bulk mode, the given files are Atom or RSS feeds, EDXL-DE distributions or
+other XML files that contain embedded CAP alerts. Each alert is extracted as
+the file is parsed, and the alerts are validated and read in parallel by a
+pool of worker processes. The alerts are written to a single KML file, or to
+stdout if the file name is "-". If the --split option is given, the --bulk
+option gives the name of a directory instead, and each alert is written to a
+separate KML file named after its identifier. If the --follow-links option is
+given, CAP files referred to by links in Atom feeds are also fetched.
+
+  Usage: cap2kml.py --store=<alert store file> [--kml=<KML file for Diana>]
+                    [--precision=<digits>] [--simplify=<tolerance>]
+                    [--timings] [--profile=<file>] [<CAP file> ...]
+
+With the --store option, the given CAP files are applied in turn to a store of
+active alerts that is kept in the given file between runs. Update and Cancel
+messages remove the alerts they refer to and expired alerts are removed. The
+KML for all the alerts that remain active is then written to the KML file, or
+to stdout if no file is given.
+
+Coordinates are written with the fewest digits needed to represent them
+unless the number of digits after the decimal point is given with the
+--precision option. If the --simplify option is given, each polygon is
+simplified to within the given tolerance in degrees and the numbers of
+vertices before and after simplification are reported. Each ring is checked
+for edges that cross each other after simplification, but rings are
+simplified separately, so nearby rings may overlap if the tolerance is large
+compared with the distance between them.
+
+Circles are converted to polygons with enough points for each edge to lie
+within 0.1 km of the circle, or within the distance in kilometres given by the
+--circle-error option.
+
 If a bdiana input file is specified, this is created to contain the necessary
 plot commands used to generate image files for each of the times used in the
-original CAP file."""
-
-import math, os, sys
+original CAP file. The images show the Norge area unless another area is given
+with the --area option. If the --frames option is given, a single block of
+plot commands is written for all the times, which python-diana-waiter.py
+plots in one session instead of starting again for each time.
+
+If the --timings option is given, the time spent and the peak memory used in
+each stage of the conversion are reported when it finishes: loading the
+schema, parsing, validation, reading the alerts from the parsed document and
+writing the output files. If the --profile option is given, the stages are
+also profiled and the statistics are written to the given file, which can be
+read with the pstats module. These options cannot be used in bulk mode."""
+
+import collections, getopt, multiprocessing, os, re, sys, urllib2, urlparse
+from array import array
 import datetime, dateutil.parser
-from lxml.etree import Element, ElementTree, SubElement
 from lxml import etree
 
+# The kmlstream module is shared with the other converters.
+sys.path.insert(1, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                os.pardir, "common"))
+import kmlstream, profiling, simplify
+import cap_store, circles
+
 bdiana_template = """
 buffersize=600x800
 colour=COLOUR
 filename=%(image file)s
 output=PNG
 setupfile=/etc/diana/setup/diana.setup-COMMON
-settime=%(warning time)s
+%(time key)s=%(warning time)s
 
 PLOT
 MAP backcolour=white map=Gshhs-Auto contour=on cont.colour=black cont.linewidth=1 cont.linetype=solid cont.zorder=1 land=on land.colour=200:200:200 land.zorder=0 lon=off lat=off frame=off
-AREA name=Norge
+AREA name=%(area)s
 DRAWING file=%(kml file)s
 LABEL data font=BITMAPFONT fontsize=8
 LABEL text="$day $date $auto UTC" tcolour=red bcolour=black fcolour=white:200 polystyle=both halign=left valign=top font=BITMAPFONT fontsize=8
 ENDPLOT
 """
 
+# The map area shown in the images produced by bdiana.
+default_area = "Norge"
+
 # Define some common style properties.
 style_properties = {'type': 'Dangerous weather warning'}
 
-def find_properties(element, names, nsmap):
+# The location of the CAP schema, relative to this file.
+schema_path = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                           "schemas", "CAP-v1.2.xsd")
 
-    """Finds the subelements of the given element that correspond to properties
-    with the specified names, using the namespace map, nsmap, to enable XPath
-    searches with the cap: prefix."""
+cap_namespace = 'urn:oasis:names:tc:emergency:cap:1.2'
+cap_prefix = '{%s}' % cap_namespace
+atom_prefix = '{http://www.w3.org/2005/Atom}'
 
-    properties = {}
+# The types of links in Atom feeds that refer to CAP files.
+cap_link_types = ('application/cap+xml', 'application/common-alerting-protocol+xml')
 
-    for name in names:
-        p = element.find('.//cap:' + name, nsmap)
-        if p is not None:
-            properties[name] = p.text
-    
-    return properties
+# The names of the child elements of alert, info and area elements that are
+# read from CAP files.
+alert_names = ('identifier', 'sender', 'sent', 'status', 'msgType', 'scope',
+               'references')
+info_names = ('category', 'event', 'urgency', 'severity', 'certainty',
+              'effective', 'expires', 'headline', 'description')
+area_names = ('areaDesc', 'altitude', 'ceiling')
 
-def write_extended_data_values(properties, extdata, prefix):
+# The names of the properties of info and area elements that are written to
+# the extended data of each placemark.
+placemark_info_names = ('category', 'severity', 'urgency', 'certainty')
+placemark_area_names = ('altitude', 'ceiling')
 
-    """Writes the contents of the properties dictionary to the XML element,
-    extdata, containing the extended data values, giving each piece of data
-    the specified prefix string."""
+class CAP_Error(Exception):
+    pass
 
-    for key, value in properties.items():
-        if type(value) == dict:
-            write_extended_data_values(value, extdata, prefix + key + ":")
-        else:
-            data = SubElement(extdata, 'Data')
-            data.set('name', prefix + key)
-            SubElement(data, 'value').text = unicode(value)
+def read_polygon(text):
 
-if __name__ == "__main__":
+    """Returns an array of alternate longitudes and latitudes for the points in
+    the text of a CAP polygon element."""
 
-    if not 2 <= len(sys.argv) <= 4:
+    # Coordinates are specified as latitude,longitude pairs in CAP files so
+    # they need to be transposed for KML.
+    points = array('d', map(float, text.replace(',', ' ').split()))
+    points[0::2], points[1::2] = points[1::2], points[0::2]
+    return points
 
-        sys.stderr.write("Usage: %s <CAP file> [<KML file for Diana> [<input file for bdiana>]]\n" % sys.argv[0])
-        sys.exit(1)
-    
-    cap_file = sys.argv[1]
-    
-    if len(sys.argv) >= 3:
-        kml_file = sys.argv[2]
-    else:
-        kml_file = None
+def read_children(element, names, repeated = ()):
+
+    """Reads the children of the given element in a single pass, returning a
+    dictionary that maps each of the specified names to the text of the first
+    child with that name. Children whose names are in the repeated sequence are
+    collected in lists of elements that are also stored in the dictionary."""
+
+    record = {}
+    for name in repeated:
+        record[name] = []
+
+    for child in element:
+
+        # Skip comments and processing instructions, and elements that are not
+        # in the CAP namespace.
+        tag = child.tag
+        if not isinstance(tag, basestring) or not tag.startswith(cap_prefix):
+            continue
+
+        name = tag[len(cap_prefix):]
+
+        if name in repeated:
+            record[name].append(child)
+        elif name in names and name not in record:
+            record[name] = child.text
 
-    if len(sys.argv) == 4:
-        input_file = sys.argv[3]
+    return record
+
+def read_area(area):
+
+    """Returns a dictionary describing the given area element. The text of any
+    polygon and circle elements is stored in lists with those names."""
+
+    record = read_children(area, area_names, ('polygon', 'circle', 'geocode'))
+
+    record['polygon'] = map(lambda element: element.text, record['polygon'])
+    record['circle'] = map(lambda element: element.text, record['circle'])
+
+    # Only the first geocode is used.
+    geocodes = record.pop('geocode')
+    if geocodes:
+        record['geocode'] = read_children(geocodes[0], ('valueName', 'value'))
+
+    return record
+
+def read_info(info):
+
+    """Returns a dictionary describing the given info element, including a
+    list of dictionaries describing its areas."""
+
+    record = read_children(info, info_names, ('area',))
+    record['area'] = map(read_area, record['area'])
+    return record
+
+def read_alert(alert):
+
+    """Returns a dictionary describing the given alert element, including a
+    list of dictionaries describing its info elements."""
+
+    record = read_children(alert, alert_names, ('info',))
+    record['info'] = map(read_info, record['info'])
+    return record
+
+def read_alerts(root):
+
+    """Returns a list of dictionaries describing the alerts in the parsed
+    document, root. This is usually a single alert, but alerts contained in
+    other kinds of document are also found."""
+
+    if hasattr(root, 'getroot'):
+        root = root.getroot()
+
+    if root.tag == cap_prefix + 'alert':
+        return [read_alert(root)]
     else:
-        input_file = None
+        return map(read_alert, root.iter(cap_prefix + 'alert'))
 
-    # Collect the starting times used in the CAP file.
-    times = set()
+def format_time(text):
 
-    # Load the CAP schema.
-    schema_doc = etree.parse(os.path.join("schemas", "CAP-v1.2.xsd"))
-    schema = etree.XMLSchema(schema_doc)
+    return dateutil.parser.parse(text).strftime('%Y-%m-%dT%H:%M:%SZ')
 
-    # Parse and validate the CAP file.
-    root = etree.parse(cap_file)
-    nsmap = {'cap': 'urn:oasis:names:tc:emergency:cap:1.2'}
+def load_schema(path = schema_path):
 
-    if not schema.validate(root):
-        sys.stderr.write("Error: CAP file '%s' is not valid.\n" % cap_file)
-        sys.exit(1)
+    """Loads the CAP schema from the file with the given path, returning an
+    XMLSchema object that can be used to validate any number of CAP files."""
 
-    # Obtain basic information about the alert.
-    basic_info = find_properties(root, ['identifier', 'sender', 'sent',
-        'status', 'msgType', 'scope'], nsmap)
+    return etree.XMLSchema(etree.parse(path))
 
-    kml = Element('kml')
-    kml.set('xmlns', "http://www.opengis.net/kml/2.2")
-    doc = SubElement(kml, 'Document')
-    
-    # Obtain each info element in the file.
-    for info in root.findall('.//cap:info', nsmap):
+def read_file(cap_file, schema, profiler = None):
 
-        # Create a folder for each info element in the KML file.
+    """Parses the CAP file with the given cap_file name and validates it using
+    the schema, returning the parsed document. Raises a CAP_Error exception if
+    the file is not valid. If a profiler is given, the parse and validate
+    stages are recorded by it."""
 
-        folder = SubElement(doc, 'Folder')
-        name = SubElement(folder, 'name')
-        name.text = info.find('.//cap:event', nsmap).text
+    if profiler is None:
+        profiler = profiling.null_profiler
 
-        optional_info = find_properties(info, ['headline', 'description'], nsmap)
+    with profiler.stage("parse"):
+        root = etree.parse(cap_file)
 
-        # Each info element may have effective and expires elements, but they
-        # are optional.
-        effective = info.find('.//cap:effective', nsmap)
-        expires = info.find('.//cap:expires', nsmap)
+    with profiler.stage("validate"):
+        valid = schema.validate(root)
 
-        # We need either effective and expires properties or the time the
-        # message was sent and the expires property.
+    if not valid:
+        raise CAP_Error, "CAP file '%s' is not valid." % cap_file
 
-        if expires is not None:
+    return root
 
-            if effective is not None:
-                fromtime = dateutil.parser.parse(effective.text).strftime('%Y-%m-%dT%H:%M:%SZ')
-            else:
-                fromtime = dateutil.parser.parse(basic_info['sent']).strftime('%Y-%m-%dT%H:%M:%SZ')
+def write_kml(alerts, f, precision = None, simplifier = None,
+              circle_error = circles.default_error):
+
+    """Writes a KML document to the file, f, for the alerts in the given list of
+    dictionaries returned by the read_alerts function, writing coordinates with
+    the given number of decimal places or with the fewest digits needed if
+    precision is None. If a simplifier is given, it is used to simplify each
+    polygon before it is written. Circles are converted to polygons whose edges
+    lie within the given circle_error, in kilometres, of each circle.
+
+    Returns a sorted list of the starting times used in the document."""
+
+    # Collect the starting times used in the CAP file.
+    times = set()
+
+    with kmlstream.writer(f) as kml:
+
+        for alert in alerts:
+
+            # Obtain each info element in the alert.
+            for info in alert['info']:
+
+                # Each info element may have effective and expires elements, but
+                # they are optional. We need either effective and expires
+                # properties or the time the message was sent and the expires
+                # property.
+
+                if 'expires' in info:
+
+                    fromtime = format_time(info.get('effective', alert['sent']))
+                    totime = format_time(info['expires'])
+
+                    # Record the starting time for later use.
+                    times.add(fromtime)
+                else:
+                    fromtime = totime = None
+
+                # Create a folder for each info element in the KML file.
+                with kml.folder(info['event'], fromtime, totime):
+                    write_areas(kml, info, precision, simplifier, circle_error)
+
+    return sorted(times)
 
-            # Record the starting time for later use.
-            times.add(fromtime)
+def write_areas(kml, info, precision, simplifier, circle_error):
 
-            timespan = SubElement(folder, 'TimeSpan')
-            begin = SubElement(timespan, 'begin')
-            begin.text = fromtime
-            end = SubElement(timespan, 'end')
-            end.text = dateutil.parser.parse(expires.text).strftime('%Y-%m-%dT%H:%M:%SZ')
+    """Writes a placemark using the KML writer, kml, for each area in the given
+    info dictionary. Circles are converted to polygons that lie within the
+    given circle_error, in kilometres, of each circle."""
 
-        # Compile a dictionary of properties for attributes in the info
-        # element for inclusion in each Placemark.
-        properties = find_properties(info, ['category', 'severity', 'urgency', 'certainty'], nsmap)
+    # Compile a dictionary of properties for attributes in the info element
+    # for inclusion in each Placemark.
+    properties = {}
+    for name in placemark_info_names:
+        if name in info:
+            properties[name] = info[name]
 
-        # Examine each area element in the info element.
+    # Examine each area element in the info element.
 
-        for area in info.findall('.//cap:area', nsmap):
+    for area in info['area']:
 
-            areaDesc = area.find('.//cap:areaDesc', nsmap)
+        with kml.placemark(info.get('headline', ''), area['areaDesc']):
 
-            placemark = SubElement(folder, 'Placemark')
-            SubElement(placemark, 'name').text = optional_info.get('headline', '')
-            SubElement(placemark, 'description').text = areaDesc.text
-            
-            extdata = SubElement(placemark, 'ExtendedData')
-            data = SubElement(extdata, 'Data')
-            data.set('name', u'met:objectType')
-            SubElement(data, 'value').text = 'PolyLine'
-            
             # Add area-specific properties to the ones common to the info element.
-            area_properties = find_properties(area, ['altitude', 'ceiling'], nsmap)
-            geocode = area.find('.//cap:geocode', nsmap)
-            if geocode is not None:
-                area_properties['geocode:name'] = geocode.find('.//cap:valueName', nsmap).text
-                area_properties['geocode:value'] = geocode.find('.//cap:value', nsmap).text
+            area_properties = {}
+            for name in placemark_area_names:
+                if name in area:
+                    area_properties[name] = area[name]
+
+            if 'geocode' in area:
+                area_properties['geocode:name'] = area['geocode'].get('valueName')
+                area_properties['geocode:value'] = area['geocode'].get('value')
 
             area_properties.update(properties)
 
-            # Write the info properties as extended data values.
-            write_extended_data_values(area_properties, extdata, "met:info:cap:")
-            # Write the common style properties.
-            write_extended_data_values(style_properties, extdata, "met:style:")
+            # Write the info properties as extended data values, followed by
+            # the common style properties.
+            kml.extended_data([(u'met:objectType', 'PolyLine')] +
+                kmlstream.data_values(area_properties, "met:info:cap:") +
+                kmlstream.data_values(style_properties, "met:style:"))
 
             # If the area contains polygons then transfer their coordinates
             # to the KML file.
-            for polygon in area.findall('.//cap:polygon', nsmap):
-
-                kml_polygon = SubElement(placemark, 'Polygon')
-                SubElement(kml_polygon, 'tessellate').text = '1'
+            for polygon in area['polygon']:
 
-                boundary = SubElement(kml_polygon, 'outerBoundaryIs')
-                ring = SubElement(boundary, 'LinearRing')
-                coordinates = SubElement(ring, 'coordinates')
-                coordinates.text = ''
+                # The first and last points should already be the same.
+                points = read_polygon(polygon)
+                if simplifier:
+                    points = simplifier.simplify(points)
 
-                # Coordinates are specified as latitude,longitude in CAP files
-                # so we need to transpose them for KML. The first and last
-                # points should already be the same.
-                for coord in polygon.text.split():
-                    if not coord:
-                        continue
-                    lat, lon = coord.split(',')
-                    coordinates.text += lon + ',' + lat + '\n'
+                kml.polygon(kmlstream.encode_coordinates(points, precision))
 
             # If the area contains circles then transfer their coordinates
             # to the KML file as a polygon.
-            for circle in area.findall('.//cap:circle', nsmap):
-
-                kml_polygon = SubElement(placemark, 'Polygon')
-                SubElement(kml_polygon, 'tessellate').text = '1'
-
-                boundary = SubElement(kml_polygon, 'outerBoundaryIs')
-                ring = SubElement(boundary, 'LinearRing')
-                coordinates = SubElement(ring, 'coordinates')
-                coordinates.text = ''
-
-                # Convert the circle with the given centre and radius to a
-                # polygon with 20 points plus the first point again.
-                centre, radius = circle.text.strip().split()
-                clat, clon = map(float, centre.split(','))
-                radius = float(radius)
-
-                i = 0
-                while i <= 20:
-                    lat = clat + (radius * math.cos((i/20.0) * (math.pi/180)))
-                    lon = clon + (radius * math.sin((i/20.0) * (math.pi/180)))
-                    coordinates.text += '%f,%f\n' % (lon, lat)
-                    i += 1
-    
-    if not kml_file:
-        f = sys.stdout
-    else:
-        f = open(kml_file, 'wb')
+            for circle in area['circle']:
+
+                lat, lon, radius = circles.read_circle(circle)
+                points = circles.circle_ring(lat, lon, radius, circle_error)
+
+                if simplifier:
+                    points = simplifier.simplify(points)
+
+                kml.polygon(kmlstream.encode_coordinates(points, precision))
+
+def write_bdiana_input(input_file, kml_file, times, frames = False,
+                       area = default_area):
+
+    """Writes an input file for bdiana with the given input_file name containing
+    the plot commands used to generate image files for each of the given times
+    from the KML file with the given kml_file name, showing the named area.
+
+    If frames is True, a single block of plot commands is written with all of
+    the times given by a times parameter instead of one block for each time.
+    This is only understood by python-diana-waiter.py, which prepares the plot
+    once and plots each of the times in turn, inserting the index of each
+    frame into the output file name."""
+
+    stem = os.path.splitext(kml_file)[0]
+
+    f = open(input_file, 'w')
+    f.write("# Created by cap2kml.py at %s.\n" % datetime.datetime.utcnow().strftime('%Y-%m-%dT%H:%M:%SZ'))
+
+    # Create an input specification for bdiana and write it to a file.
+    if frames:
+        if times:
+            f.write(bdiana_template % {'image file': '%s.png' % stem,
+                                       'time key': 'times',
+                                       'warning time': ",".join(times),
+                                       'area': area,
+                                       'kml file': kml_file})
+        f.close()
+        return
+
+    i = 0
+
+    for time in times:
+        f.write(bdiana_template % {'image file': '%s-%i.png' % (stem, i),
+                                   'time key': 'settime',
+                                   'warning time': time,
+                                   'area': area,
+                                   'kml file': kml_file})
+        i += 1
 
-    # Write the KML file.
-    ElementTree(kml).write(f, encoding='UTF-8', xml_declaration=True, pretty_print=True)
     f.close()
 
+def convert_file(cap_file, kml_file = None, input_file = None, schema = None,
+                 precision = None, simplifier = None,
+                 circle_error = circles.default_error, frames = False,
+                 area = default_area, profiler = None):
+
+    """Converts the CAP file with the given cap_file name to a KML file with the
+    given kml_file name, or to stdout if kml_file is None, and writes a bdiana
+    input file with the given input_file name if one is given. The file is
+    validated using the given schema, or the CAP schema if none is given.
+    The precision, simplifier and circle_error are passed to the write_kml
+    function, and frames and area are passed to the write_bdiana_input
+    function. If a profiler is given, each stage of the conversion is
+    recorded by it."""
+
+    if profiler is None:
+        profiler = profiling.null_profiler
+
+    if schema is None:
+        with profiler.stage("load schema"):
+            schema = load_schema()
+
+    # Parse and validate the CAP file, then read the alerts it contains.
+    root = read_file(cap_file, schema, profiler)
+
+    with profiler.stage("read"):
+        alerts = read_alerts(root)
+
+    with profiler.stage("write"):
+        if not kml_file:
+            f = sys.stdout
+        else:
+            f = open(kml_file, 'wb')
+
+        times = write_kml(alerts, f, precision, simplifier, circle_error)
+        f.close()
+
     if input_file:
+        with profiler.stage("write input"):
+            write_bdiana_input(input_file, kml_file, times, frames, area)
 
-        stem = os.path.splitext(kml_file)[0]
+def iter_embedded(file_name, follow_links = False):
 
-        f = open(input_file, 'w')
-        f.write("# Created by cap2kml.py at %s.\n" % datetime.datetime.utcnow().strftime('%Y-%m-%dT%H:%M:%SZ'))
+    """Parses the XML file with the given file_name incrementally, yielding a
+    (source, kind, data) tuple for each CAP alert embedded in it. The source
+    describes where the alert was found, kind is 'alert' and data is the text
+    of the alert.
 
-        # Create an input specification for bdiana and write it to a file.
-        times = list(times)
-        times.sort()
-        i = 0
+    If follow_links is True, a tuple is also yielded for each link to a CAP
+    file in an Atom feed, where kind is 'link' and data is the URL of the file.
+    Each element is discarded once it has been read, so the whole file is not
+    held in memory. If the file contains neither, a tuple is yielded with the
+    file name as the source, 'error' as the kind and a description of the
+    namespace of its root element as the data."""
 
-        for time in times:
-            f.write(bdiana_template % {'image file': '%s-%i.png' % (stem, i),
-                                       'warning time': time,
-                                       'kml file': kml_file})
+    tags = [cap_prefix + 'alert']
+    if follow_links:
+        tags.append(atom_prefix + 'link')
+
+    i = 0
+    links = 0
+    parser = etree.iterparse(file_name, events = ('end',), tag = tags)
+
+    for event, element in parser:
+
+        if element.tag == cap_prefix + 'alert':
+            yield "%s alert %i" % (file_name, i), 'alert', etree.tostring(element)
             i += 1
 
-        f.close()
+        elif element.get('type') in cap_link_types:
+            # Links without a scheme refer to files relative to the feed.
+            url = element.get('href', '')
+            if not urlparse.urlparse(url).scheme:
+                url = os.path.join(os.path.dirname(file_name), url)
+            yield url, 'link', url
+            links += 1
+
+        # Discard the element and any preceding siblings.
+        element.clear()
+        while element.getprevious() is not None:
+            del element.getparent()[0]
+
+    if i == 0 and links == 0:
+        # Report files that contain no alerts, such as those using older
+        # versions of CAP, instead of silently producing nothing.
+        namespace = etree.QName(parser.root).namespace
+        if namespace:
+            yield file_name, 'error', "No CAP 1.2 alerts found in namespace '%s'." % namespace
+        else:
+            yield file_name, 'error', "No CAP 1.2 alerts found in an element without a namespace."
+
+# The schema used by each worker process in bulk mode.
+worker_schema = None
+
+def init_worker():
+
+    global worker_schema
+    worker_schema = load_schema()
+
+def read_job(job):
+
+    """Reads the alert described by the (source, kind, data) tuple, job, as
+    yielded by the iter_embedded function, in a worker process. Returns a
+    tuple containing the source, a list of dictionaries describing the alerts
+    read and None if successful, or the source, None and a description of the
+    error if not."""
+
+    source, kind, data = job
+
+    try:
+        if kind == 'link':
+            if urlparse.urlparse(data).scheme:
+                data = urllib2.urlopen(data).read()
+            else:
+                data = open(data, 'rb').read()
+
+        root = etree.fromstring(data)
+        if not worker_schema.validate(root):
+            return source, None, "Alert is not valid."
+
+        return source, read_alerts(root), None
+
+    except Exception, e:
+        return source, None, "%s: %s" % (e.__class__.__name__, e)
+
+def read_bulk(file_names, workers = None, follow_links = False):
+
+    """Reads the CAP alerts embedded in the files with the given file_names
+    using a pool of the specified number of worker processes, yielding the
+    results of the read_job function in the order in which the alerts were
+    found. Files that cannot be parsed are reported in the same way as alerts
+    that cannot be read, with the file name as the source."""
+
+    def jobs():
+        for file_name in file_names:
+            try:
+                for job in iter_embedded(file_name, follow_links):
+                    yield job
+            except Exception, e:
+                yield file_name, 'error', "%s: %s" % (e.__class__.__name__, e)
+
+    pool = multiprocessing.Pool(workers, init_worker)
+
+    # Only parse the input files a limited number of alerts ahead of the
+    # workers, so that the alerts waiting to be read are not all held in
+    # memory.
+    window = (workers or multiprocessing.cpu_count()) * 4
+    pending = collections.deque()
+
+    try:
+        for source, kind, data in jobs():
+
+            if kind == 'error':
+                pending.append((source, None, data))
+            else:
+                pending.append(pool.apply_async(read_job, ((source, kind, data),)))
+
+            while len(pending) >= window:
+                yield bulk_result(pending.popleft())
+
+        while pending:
+            yield bulk_result(pending.popleft())
+    finally:
+        pool.close()
+        pool.join()
+
+def bulk_result(item):
+
+    """Returns the result of a job queued by read_bulk, waiting for it to be
+    read if necessary."""
+
+    if isinstance(item, tuple):
+        return item
+    return item.get()
+
+def alert_file_name(alert):
+
+    """Returns a file name for the KML file containing the given alert."""
+
+    return re.sub(r'[^A-Za-z0-9._-]', '_', alert.get('identifier') or 'alert') + '.kml'
+
+def usage():
+
+    sys.stderr.write("Usage: %s [--precision=<digits>] [--simplify=<tolerance>]\n"
+                     "                  [--timings] [--profile=<file>] <CAP file>\n"
+                     "                  [<KML file for Diana> [<input file for bdiana>]]\n" % sys.argv[0])
+    sys.stderr.write("       %s [--frames] [--area=<name>] [--precision=<digits>]\n"
+                     "                  [--simplify=<tolerance>] [--timings] [--profile=<file>]\n"
+                     "                  <CAP file> <KML file for Diana> <input file for bdiana>\n" % sys.argv[0])
+    sys.stderr.write("       %s --bulk=<KML file or directory> [--split] [--workers=<number>]\n"
+                     "                  [--follow-links] [--precision=<digits>] [--simplify=<tolerance>]\n"
+                     "                  <feed or envelope file> ...\n" % sys.argv[0])
+    sys.stderr.write("       %s --store=<alert store file> [--kml=<KML file for Diana>]\n"
+                     "                  [--precision=<digits>] [--simplify=<tolerance>]\n"
+                     "                  [--timings] [--profile=<file>] [<CAP file> ...]\n" % sys.argv[0])
+    sys.exit(1)
+
+if __name__ == "__main__":
+
+    try:
+        opts, args = getopt.getopt(sys.argv[1:], "", ["precision=", "simplify=",
+            "bulk=", "split", "workers=", "follow-links", "store=", "kml=",
+            "circle-error=", "frames", "area=", "timings", "profile="])
+    except getopt.GetoptError:
+        usage()
+
+    opts = dict(opts)
+
+    if "--precision" in opts:
+        try:
+            precision = int(opts["--precision"])
+        except ValueError:
+            usage()
+        if precision < 0:
+            usage()
+    else:
+        precision = None
+
+    try:
+        tolerance = float(opts.get("--simplify", 0))
+    except ValueError:
+        usage()
+
+    try:
+        circle_error = float(opts.get("--circle-error", circles.default_error))
+    except ValueError:
+        usage()
+
+    if tolerance < 0 or circle_error <= 0:
+        usage()
+    elif tolerance > 0:
+        simplifier = simplify.Simplifier(tolerance)
+    else:
+        simplifier = None
+
+    timed = "--timings" in opts or "--profile" in opts
+    if timed:
+        profiler = profiling.Profiler(opts.get("--profile"))
+    else:
+        profiler = profiling.null_profiler
+
+    if "--bulk" in opts:
+
+        output = opts["--bulk"]
+
+        try:
+            workers = int(opts.get("--workers", multiprocessing.cpu_count()))
+        except ValueError:
+            usage()
+
+        if not args or workers < 1 or timed:
+            usage()
+
+        results = read_bulk(args, workers, "--follow-links" in opts)
+        counts = {'alerts': 0, 'failed': 0}
+
+        def alerts():
+            for source, alerts, error in results:
+                if error:
+                    sys.stderr.write("Error: %s: %s\n" % (source, error))
+                    counts['failed'] += 1
+                else:
+                    counts['alerts'] += len(alerts)
+                    for alert in alerts:
+                        yield alert
+
+        if "--split" in opts:
+            if not os.path.isdir(output):
+                os.makedirs(output)
+            for alert in alerts():
+                f = open(os.path.join(output, alert_file_name(alert)), 'wb')
+                write_kml([alert], f, precision, simplifier, circle_error)
+                f.close()
+        else:
+            if output == "-":
+                f = sys.stdout
+            else:
+                f = open(output, 'wb')
+            write_kml(alerts(), f, precision, simplifier, circle_error)
+            f.close()
+
+        sys.stderr.write("Converted %i alerts, %i failed.\n" % (counts['alerts'], counts['failed']))
+        if simplifier:
+            sys.stderr.write("%s\n" % simplifier.report())
+
+        if counts['failed']:
+            sys.exit(1)
+        sys.exit()
+
+    if "--store" in opts:
+
+        with profiler.stage("load store"):
+            store = cap_store.AlertStore(opts["--store"])
+        with profiler.stage("load schema"):
+            schema = load_schema()
+        failed = 0
+
+        # Apply the new messages to the store in the order given.
+        for cap_file in args:
+            try:
+                root = read_file(cap_file, schema, profiler)
+                with profiler.stage("read"):
+                    for alert in read_alerts(root):
+                        store.apply(alert)
+            except (CAP_Error, etree.XMLSyntaxError), e:
+                sys.stderr.write("Error: %s\n" % e)
+                failed += 1
+
+        with profiler.stage("save store"):
+            store.expire()
+            store.save()
+
+        with profiler.stage("write"):
+            if "--kml" in opts:
+                f = open(opts["--kml"], 'wb')
+            else:
+                f = sys.stdout
+
+            write_kml(store.active(), f, precision, simplifier, circle_error)
+            f.close()
+
+        if simplifier:
+            sys.stderr.write("%s\n" % simplifier.report())
+
+        profiler.report(sys.stderr)
+
+        if failed:
+            sys.exit(1)
+        sys.exit()
+
+    if "--split" in opts or "--workers" in opts or "--follow-links" in opts or \
+        "--kml" in opts:
+        usage()
+
+    if not 1 <= len(args) <= 3:
+        usage()
+
+    # The options for the bdiana input file need an input file to be written.
+    if ("--frames" in opts or "--area" in opts) and len(args) < 3:
+        usage()
+    
+    cap_file = args[0]
+    
+    if len(args) >= 2:
+        kml_file = args[1]
+    else:
+        kml_file = None
+
+    if len(args) == 3:
+        input_file = args[2]
+    else:
+        input_file = None
+
+    try:
+        convert_file(cap_file, kml_file, input_file, precision = precision,
+                     simplifier = simplifier, circle_error = circle_error,
+                     frames = "--frames" in opts,
+                     area = opts.get("--area", default_area),
+                     profiler = profiler)
+    except CAP_Error, e:
+        sys.stderr.write("Error: %s\n" % e)
+        sys.exit(1)
+
+    # Report the simplification on stderr since the KML may be written to stdout.
+    if simplifier:
+        sys.stderr.write("%s: %s\n" % (cap_file, simplifier.report()))
+
+    profiler.report(sys.stderr)
 
     sys.exit()
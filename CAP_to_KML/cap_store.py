@@ -0,0 +1,161 @@
+# Copyright (C) 2015 MET Norway
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+
+"""Provides a persistent store of the CAP alerts that are currently active.
+
+Alerts are stored as the dictionaries returned by the cap2kml.read_alerts
+function, keyed by their identifiers, and are saved in a JSON file between
+runs. Each message applied to the store is handled according to its msgType:
+
+  Alert   adds the alert to the store
+  Update  adds the alert and removes the alerts it references
+  Cancel  removes the alerts it references
+
+Other types of message are ignored. Alerts are removed from the store once
+all of their info elements have expired.
+"""
+
+import json, os
+import datetime, dateutil.parser, dateutil.tz
+
+class AlertStore:
+
+    """Represents the set of active alerts stored in the file with the given
+    path. Identifiers of alerts that have been updated or cancelled are
+    remembered for the given retention period, in seconds, so that messages
+    that arrive out of order are not made active again. The times at which
+    they were superseded are kept as ISO 8601 strings so that they are
+    measured on the same clock as the expiry times of the alerts."""
+
+    def __init__(self, path, retention = 2 * 24 * 3600):
+
+        self.path = path
+        self.retention = retention
+        self.alerts = {}
+        self.superseded = {}
+
+        if os.path.exists(path):
+            data = json.load(open(path, 'rb'))
+            self.alerts = data["alerts"]
+            self.superseded = data["superseded"]
+
+    def save(self):
+
+        """Writes the contents of the store to its file, replacing the previous
+        file only once the new one is complete."""
+
+        temp_path = self.path + ".tmp"
+        f = open(temp_path, 'wb')
+        json.dump({"alerts": self.alerts, "superseded": self.superseded}, f)
+        f.close()
+        os.rename(temp_path, self.path)
+
+    def apply(self, alert, now = None):
+
+        """Applies the message described by the alert dictionary to the store
+        at the given time, which is the current time if not specified."""
+
+        if now is None:
+            now = datetime.datetime.now(dateutil.tz.tzutc())
+
+        identifier = alert.get('identifier')
+        msgType = alert.get('msgType')
+
+        if msgType in ('Update', 'Cancel'):
+            for reference in references(alert):
+                self.alerts.pop(reference, None)
+                self.superseded[reference] = now.isoformat()
+
+        if msgType in ('Alert', 'Update'):
+            if identifier not in self.superseded:
+                self.alerts[identifier] = alert
+
+    def expire(self, now = None):
+
+        """Removes the alerts that have expired at the given time, which is the
+        current time if not specified, and forgets superseded identifiers that
+        are older than the retention period."""
+
+        if now is None:
+            now = datetime.datetime.now(dateutil.tz.tzutc())
+
+        for identifier, alert in self.alerts.items():
+            expires = expiry_time(alert)
+            if expires is not None and expires <= now:
+                del self.alerts[identifier]
+
+        limit = now - datetime.timedelta(seconds = self.retention)
+        for identifier, recorded in self.superseded.items():
+            if isinstance(recorded, (int, float)):
+                # Stores written by earlier versions recorded POSIX times.
+                recorded = datetime.datetime.fromtimestamp(recorded, dateutil.tz.tzutc())
+            else:
+                recorded = parse_time(recorded)
+            if recorded < limit:
+                del self.superseded[identifier]
+
+    def active(self):
+
+        """Returns a list of the active alerts in the order they were sent."""
+
+        alerts = self.alerts.values()
+        alerts.sort(key = lambda alert: parse_time(alert['sent']))
+        return alerts
+
+def references(alert):
+
+    """Returns a list of the identifiers of the messages referenced by the given
+    alert. References are given as sender,identifier,sent triples."""
+
+    identifiers = []
+
+    for reference in (alert.get('references') or '').split():
+        pieces = reference.split(',')
+        if len(pieces) == 3:
+            identifiers.append(pieces[1])
+
+    return identifiers
+
+def parse_time(text):
+
+    """Returns a datetime object for the given time, assuming that times without
+    time zones are given in UTC."""
+
+    t = dateutil.parser.parse(text)
+    if t.tzinfo is None:
+        t = t.replace(tzinfo = dateutil.tz.tzutc())
+    return t
+
+def expiry_time(alert):
+
+    """Returns the time at which the given alert expires, or None if any of its
+    info elements has no expiry time. Alerts without info elements expire as
+    soon as they are sent."""
+
+    if not alert['info']:
+        return parse_time(alert['sent'])
+
+    expires = None
+
+    for info in alert['info']:
+        if 'expires' not in info:
+            return None
+
+        t = parse_time(info['expires'])
+        if expires is None or t > expires:
+            expires = t
+
+    return expires
@@ -0,0 +1,124 @@
+# Copyright (C) 2015 MET Norway
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+
+"""Provides functions for converting the circles in CAP area elements to
+polygons.
+
+Each circle is described by the latitude and longitude of its centre and a
+radius in kilometres. The points on the circle are found by travelling the
+radius from the centre along evenly spaced bearings on a spherical Earth.
+The number of points is chosen so that no edge of the polygon strays further
+from the circle than a maximum error, also in kilometres, so small circles
+are described with few points and large circles with as many as they need.
+
+NumPy is used to calculate all the points of a circle at once if it is
+available; otherwise the points are calculated one at a time.
+"""
+
+import math
+from array import array
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# The mean radius of the Earth in kilometres.
+earth_radius = 6371.0088
+
+# The default maximum distance in kilometres between each edge of a polygon
+# and the circle it describes.
+default_error = 0.1
+
+min_vertices = 8
+max_vertices = 720
+
+def vertex_count(radius, error = default_error):
+
+    """Returns the number of distinct vertices needed to describe a circle with
+    the given radius so that the midpoint of each edge lies within the given
+    error of the circle."""
+
+    if radius <= 0 or error <= 0 or error >= radius:
+        return min_vertices
+
+    # The distance between the midpoint of an edge and the arc it spans is
+    # r (1 - cos(pi/n)) for a circle of radius r with n vertices.
+    n = int(math.ceil(math.pi / math.acos(1 - float(error) / radius)))
+    return max(min_vertices, min(n, max_vertices))
+
+def circle_ring(lat, lon, radius, error = default_error):
+
+    """Returns an array of alternate longitudes and latitudes describing a
+    closed ring around the circle with the centre at the given latitude and
+    longitude and the given radius in kilometres. The ring runs anticlockwise,
+    as KML expects, and its first and last points are the same.
+
+    Longitudes are given relative to the centre so that rings that cross the
+    180 degree meridian remain continuous."""
+
+    n = vertex_count(radius, error)
+
+    phi = math.radians(lat)
+    delta = radius / earth_radius
+    sin_phi, cos_phi = math.sin(phi), math.cos(phi)
+    sin_delta, cos_delta = math.sin(delta), math.cos(delta)
+
+    if numpy is not None:
+        return _numpy_ring(lon, n, sin_phi, cos_phi, sin_delta, cos_delta)
+
+    points = array('d')
+    step = 2 * math.pi / n
+
+    for i in xrange(n):
+
+        # Decreasing bearings give an anticlockwise ring.
+        theta = -i * step
+        sin_phi2 = sin_phi * cos_delta + cos_phi * sin_delta * math.cos(theta)
+        dlon = math.atan2(math.sin(theta) * sin_delta * cos_phi,
+                          cos_delta - sin_phi * sin_phi2)
+
+        points.append(lon + math.degrees(dlon))
+        points.append(math.degrees(math.asin(max(-1, min(sin_phi2, 1)))))
+
+    points.append(points[0])
+    points.append(points[1])
+
+    return points
+
+def _numpy_ring(lon, n, sin_phi, cos_phi, sin_delta, cos_delta):
+
+    theta = -numpy.arange(n + 1) * (2 * math.pi / n)
+    theta[-1] = 0
+
+    sin_phi2 = sin_phi * cos_delta + cos_phi * sin_delta * numpy.cos(theta)
+    dlon = numpy.arctan2(numpy.sin(theta) * sin_delta * cos_phi,
+                         cos_delta - sin_phi * sin_phi2)
+
+    coordinates = numpy.empty(2 * (n + 1))
+    coordinates[0::2] = lon + numpy.degrees(dlon)
+    coordinates[1::2] = numpy.degrees(numpy.arcsin(numpy.clip(sin_phi2, -1, 1)))
+
+    return array('d', coordinates.tostring())
+
+def read_circle(text):
+
+    """Returns the latitude and longitude of the centre and the radius of the
+    circle described by the text of a CAP circle element."""
+
+    centre, radius = text.strip().split()
+    lat, lon = map(float, centre.split(','))
+    return lat, lon, float(radius)
@@ -0,0 +1,69 @@
+"""Tests for the bulk mode of the cap2kml module."""
+
+import os, shutil, sys, tempfile, unittest
+
+this_dir = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(1, os.path.join(this_dir, os.pardir))
+import cap2kml
+
+met_file = os.path.join(this_dir, "files", "MET", "MIfare-20151006T160000.cap")
+cap11_file = os.path.join(this_dir, "files", "google.org", "CAP-1.1-Earthquake.cap")
+
+class BulkTest(unittest.TestCase):
+
+    def setUp(self):
+        self.work_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.work_dir, True)
+
+    def write_file(self, name, text):
+
+        path = os.path.join(self.work_dir, name)
+        f = open(path, "w")
+        f.write(text)
+        f.close()
+        return path
+
+    def test_embedded_alerts(self):
+
+        feed = self.write_file("feed.xml", "<feed>%s%s</feed>" % (
+            open(met_file).read().split("?>", 1)[1],
+            open(met_file).read().split("?>", 1)[1]))
+
+        results = list(cap2kml.read_bulk([feed], 2))
+        self.assertEqual(len(results), 2)
+        for source, alerts, error in results:
+            self.assertEqual(error, None)
+            self.assertEqual(len(alerts), 1)
+
+    def test_unreadable_files_are_reported(self):
+
+        bad = self.write_file("bad.xml", "<feed><broken")
+        missing = os.path.join(self.work_dir, "missing.xml")
+
+        results = list(cap2kml.read_bulk([bad, missing, met_file], 2))
+
+        self.assertEqual(len(results), 3)
+        self.assertEqual(results[0][0], bad)
+        self.assertTrue(results[0][2].startswith("XMLSyntaxError"))
+        self.assertEqual(results[1][0], missing)
+        self.assertTrue(results[1][2].startswith("IOError"))
+        self.assertEqual(results[2][2], None)
+
+    def test_files_without_alerts_are_reported(self):
+
+        empty = self.write_file("empty.xml", "<feed/>")
+        results = list(cap2kml.read_bulk([cap11_file, empty, met_file], 2))
+
+        self.assertEqual(len(results), 3)
+        self.assertEqual(results[0][0], cap11_file)
+        self.assertEqual(results[0][1], None)
+        self.assertEqual(results[0][2], "No CAP 1.2 alerts found in namespace "
+                                        "'urn:oasis:names:tc:emergency:cap:1.1'.")
+        self.assertEqual(results[1][0], empty)
+        self.assertTrue(results[1][2].startswith("No CAP 1.2 alerts found"))
+        self.assertEqual(results[2][2], None)
+
+if __name__ == "__main__":
+    unittest.main()
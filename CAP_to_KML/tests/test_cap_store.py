@@ -0,0 +1,101 @@
+"""Tests for the cap_store module."""
+
+import datetime, os, shutil, sys, tempfile, unittest
+import dateutil.tz
+
+sys.path.insert(1, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+import cap_store
+
+def make_alert(identifier, msgType = 'Alert', references = None,
+               sent = '2015-10-06T16:00:00+00:00', expires = '2015-10-07T16:00:00+00:00'):
+
+    return {'identifier': identifier, 'msgType': msgType, 'sent': sent,
+            'references': references, 'info': [{'expires': expires}]}
+
+def utc(*args):
+    return datetime.datetime(*args, tzinfo = dateutil.tz.tzutc())
+
+class AlertStoreTest(unittest.TestCase):
+
+    def setUp(self):
+
+        self.work_dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.work_dir, "store.json")
+
+    def tearDown(self):
+        shutil.rmtree(self.work_dir, True)
+
+    def identifiers(self, store):
+        return map(lambda alert: alert['identifier'], store.active())
+
+    def test_alert_update_and_cancel(self):
+
+        store = cap_store.AlertStore(self.path)
+        store.apply(make_alert('a', sent = '2015-10-06T12:00:00Z'))
+        store.apply(make_alert('b', sent = '2015-10-06T13:00:00Z'))
+        self.assertEqual(self.identifiers(store), ['a', 'b'])
+
+        store.apply(make_alert('c', 'Update', 'met,a,2015-10-06T12:00:00Z',
+                               sent = '2015-10-06T14:00:00Z'))
+        self.assertEqual(self.identifiers(store), ['b', 'c'])
+
+        store.apply(make_alert('d', 'Cancel', 'met,b,2015-10-06T13:00:00Z'))
+        self.assertEqual(self.identifiers(store), ['c'])
+
+        # Other message types are ignored.
+        store.apply(make_alert('e', 'Ack'))
+        self.assertEqual(self.identifiers(store), ['c'])
+
+    def test_superseded_alerts_are_not_made_active_again(self):
+
+        store = cap_store.AlertStore(self.path)
+        store.apply(make_alert('b', 'Update', 'met,a,2015-10-06T12:00:00Z'))
+        store.apply(make_alert('a'))
+
+        self.assertEqual(self.identifiers(store), ['b'])
+
+    def test_expiry(self):
+
+        store = cap_store.AlertStore(self.path)
+        store.apply(make_alert('a', expires = '2015-10-07T00:00:00Z'))
+        store.apply(make_alert('b', expires = '2015-10-08T00:00:00Z'))
+        no_expiry = make_alert('c')
+        no_expiry['info'].append({})
+        store.apply(no_expiry)
+
+        store.expire(utc(2015, 10, 7, 12))
+        self.assertEqual(sorted(self.identifiers(store)), ['b', 'c'])
+
+        store.expire(utc(2015, 10, 8, 0))
+        self.assertEqual(self.identifiers(store), ['c'])
+
+    def test_superseded_identifiers_use_the_same_clock(self):
+
+        store = cap_store.AlertStore(self.path, retention = 3600)
+        store.apply(make_alert('b', 'Cancel', 'met,a,2015-10-06T12:00:00Z'),
+                    utc(2015, 10, 6, 12))
+
+        store.expire(utc(2015, 10, 6, 12, 30))
+        self.assertTrue('a' in store.superseded)
+
+        store.expire(utc(2015, 10, 6, 13, 30))
+        self.assertFalse('a' in store.superseded)
+
+    def test_save_and_load(self):
+
+        store = cap_store.AlertStore(self.path)
+        store.apply(make_alert('a'))
+        store.apply(make_alert('c', 'Cancel', 'met,b,2015-10-06T12:00:00Z'),
+                    utc(2015, 10, 6, 12))
+        store.save()
+
+        loaded = cap_store.AlertStore(self.path)
+        self.assertEqual(self.identifiers(loaded), ['a'])
+        self.assertEqual(loaded.superseded, store.superseded)
+
+        loaded.expire(utc(2015, 10, 9))
+        self.assertEqual(loaded.alerts, {})
+        self.assertEqual(loaded.superseded, {})
+
+if __name__ == "__main__":
+    unittest.main()
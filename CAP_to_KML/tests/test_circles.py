@@ -0,0 +1,95 @@
+"""Tests for the circles module."""
+
+import math, os, sys, unittest
+
+sys.path.insert(1, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+import circles
+
+def distance(lat1, lon1, lat2, lon2):
+
+    """Returns the great circle distance in kilometres between two points."""
+
+    phi1, phi2 = math.radians(lat1), math.radians(lat2)
+    dphi = phi2 - phi1
+    dlambda = math.radians(lon2 - lon1)
+    a = math.sin(dphi / 2)**2 + math.cos(phi1) * math.cos(phi2) * math.sin(dlambda / 2)**2
+    return 2 * circles.earth_radius * math.asin(math.sqrt(a))
+
+def signed_area(points):
+
+    area = 0
+    for i in range(0, len(points) - 2, 2):
+        area += points[i] * points[i + 3] - points[i + 2] * points[i + 1]
+    return area / 2
+
+class CirclesTest(unittest.TestCase):
+
+    def test_vertex_count(self):
+
+        self.assertEqual(circles.vertex_count(0), circles.min_vertices)
+        self.assertEqual(circles.vertex_count(0.05), circles.min_vertices)
+        self.assertEqual(circles.vertex_count(1e6), circles.max_vertices)
+
+        # Larger circles and smaller errors need more vertices.
+        self.assertTrue(circles.vertex_count(50) < circles.vertex_count(100))
+        self.assertTrue(circles.vertex_count(50, 1) < circles.vertex_count(50, 0.1))
+
+    def test_ring_lies_on_the_circle(self):
+
+        lat, lon, radius = 60.0, 10.0, 25.0
+        points = circles.circle_ring(lat, lon, radius)
+        n = circles.vertex_count(radius)
+
+        self.assertEqual(len(points), 2 * (n + 1))
+        self.assertEqual(points[:2], points[-2:])
+
+        for i in range(0, len(points), 2):
+            self.assertAlmostEqual(distance(lat, lon, points[i + 1], points[i]), radius, 6)
+
+    def test_edges_lie_within_the_error(self):
+
+        lat, lon, radius, error = -30.0, 150.0, 100.0, 0.5
+        points = circles.circle_ring(lat, lon, radius, error)
+
+        for i in range(0, len(points) - 2, 2):
+            mid_lon = (points[i] + points[i + 2]) / 2
+            mid_lat = (points[i + 1] + points[i + 3]) / 2
+            self.assertTrue(radius - distance(lat, lon, mid_lat, mid_lon) <= error * 1.01)
+
+    def test_ring_is_anticlockwise(self):
+
+        self.assertTrue(signed_area(circles.circle_ring(45, 0, 10)) > 0)
+        self.assertTrue(signed_area(circles.circle_ring(-45, 0, 10)) > 0)
+
+    def test_ring_crossing_the_date_line_is_continuous(self):
+
+        points = circles.circle_ring(0, 179.9, 50)
+        longitudes = points[0::2]
+
+        self.assertTrue(max(longitudes) > 180)
+        for a, b in zip(longitudes, longitudes[1:]):
+            self.assertTrue(abs(a - b) < 1)
+
+    def test_numpy_and_python_rings_agree(self):
+
+        if circles.numpy is None:
+            return
+
+        expected = circles.circle_ring(60, 10, 25)
+        numpy = circles.numpy
+        circles.numpy = None
+        try:
+            points = circles.circle_ring(60, 10, 25)
+        finally:
+            circles.numpy = numpy
+
+        self.assertEqual(len(points), len(expected))
+        for a, b in zip(points, expected):
+            self.assertAlmostEqual(a, b, 9)
+
+    def test_read_circle(self):
+
+        self.assertEqual(circles.read_circle(" 60.5,-10.25 12.5 "), (60.5, -10.25, 12.5))
+
+if __name__ == "__main__":
+    unittest.main()
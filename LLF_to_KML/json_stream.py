@@ -0,0 +1,189 @@
+# Copyright (C) 2015 MET Norway
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+
+"""Provides an incremental parser for JSON files whose top level value is an
+object containing large arrays.
+
+The members of the top level object are decoded one at a time while the file
+is read in chunks, so that the items in selected arrays can be processed
+before the rest of the file has been read.
+"""
+
+import json
+
+class JSONStreamError(ValueError):
+    """Indicates that the data in a stream is not valid JSON."""
+    pass
+
+whitespace = " \t\n\r"
+number_chars = "0123456789+-.eE"
+
+class Reader:
+
+    """Reads JSON text from a file in chunks, keeping only the part of the text
+    that has not yet been decoded in memory."""
+
+    def __init__(self, f, chunk_size = 65536):
+
+        self.f = f
+        self.chunk_size = chunk_size
+        self.buffer = ""
+        self.pos = 0
+        self.offset = 0
+        self.eof = False
+        self.decoder = json.JSONDecoder()
+
+    def fill(self, size = None):
+
+        """Reads another chunk of text from the file, discarding text that has
+        already been decoded. If size is specified, that number of bytes is
+        read instead of the default chunk size. Returns False if the end of
+        the file has been reached."""
+
+        if self.eof:
+            return False
+
+        chunk = self.f.read(size or self.chunk_size)
+        if not chunk:
+            self.eof = True
+            return False
+
+        self.offset += self.pos
+        self.buffer = self.buffer[self.pos:] + chunk
+        self.pos = 0
+        return True
+
+    def grow_size(self):
+
+        return max(self.chunk_size, len(self.buffer) - self.pos)
+
+    def peek(self):
+
+        """Returns the next character that is not whitespace without consuming
+        it, or an empty string at the end of the file."""
+
+        while True:
+            while self.pos < len(self.buffer):
+                if self.buffer[self.pos] not in whitespace:
+                    return self.buffer[self.pos]
+                self.pos += 1
+
+            if not self.fill():
+                return ""
+
+    def expect(self, chars):
+
+        """Consumes and returns the next character that is not whitespace,
+        raising a JSONStreamError if it is not one of the given characters."""
+
+        char = self.peek()
+        if not char or char not in chars:
+            raise JSONStreamError, "Expected one of '%s' at offset %i" % (chars, self.offset + self.pos)
+
+        self.pos += 1
+        return char
+
+    def value(self):
+
+        """Decodes and returns the next complete JSON value in the file."""
+
+        self.peek()
+
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buffer, self.pos)
+            except ValueError:
+                # The value may be incomplete, so read more of the file and
+                # try again. The amount read grows with the size of the value
+                # to avoid decoding large values many times.
+                if self.fill(self.grow_size()):
+                    continue
+                raise
+
+            # A number at the end of the buffer may be continued in the next
+            # chunk of the file, even if only part of it could be decoded, as
+            # when a chunk ends after its decimal point.
+            if self.number_continues(end) and self.fill():
+                continue
+
+            self.pos = end
+            return value
+
+    def number_continues(self, end):
+
+        """Returns True if the characters from the given position to the end
+        of the buffer could belong to a number that continues in the next
+        chunk of the file."""
+
+        while end < len(self.buffer):
+            if self.buffer[end] not in number_chars:
+                return False
+            end += 1
+
+        return True
+
+def iter_array(reader):
+
+    """Yields the items in the array at the current position of the reader."""
+
+    reader.expect("[")
+    if reader.peek() == "]":
+        reader.expect("]")
+        return
+
+    while True:
+        yield reader.value()
+        if reader.expect(",]") == "]":
+            break
+
+def iter_members(f, streamed = (), chunk_size = 65536):
+
+    """Parses the JSON object in the file, f, yielding (key, value) pairs for
+    each member of the object in the order in which they occur in the file.
+
+    The values of members whose keys are in the streamed sequence must be
+    arrays. For these, the value yielded is an iterator over the items in the
+    array, which are decoded as the iterator is used. Any items that are not
+    used before the next member is requested are skipped."""
+
+    reader = Reader(f, chunk_size)
+    reader.expect("{")
+
+    if reader.peek() == "}":
+        reader.expect("}")
+        return
+
+    while True:
+
+        key = reader.value()
+        if not isinstance(key, basestring):
+            raise JSONStreamError, "Expected a string key at offset %i" % (reader.offset + reader.pos)
+
+        reader.expect(":")
+
+        if key in streamed:
+            items = iter_array(reader)
+            yield key, items
+            for item in items:
+                pass
+        else:
+            yield key, reader.value()
+
+        if reader.expect(",}") == "}":
+            break
+
+    if reader.peek():
+        raise JSONStreamError, "Unexpected data after the end of the object"
@@ -18,19 +18,54 @@
 
 """Converts LLF GeoJSON files to KML files for use with Diana (http://diana.met.no).
 
-  Usage: %s <LLF GeoJSON file> [KML file for Diana]
+  Usage: %s [--precision=<digits>] [--simplify=<tolerance>]
+                      [--timings] [--profile=<file>]
+                      <LLF GeoJSON file> [KML file for Diana]
+         %s --batch=<output directory> [--workers=<number>]
+                      [--precision=<digits>] [--simplify=<tolerance>]
+                      <LLF GeoJSON file or directory> ...
+
+Coordinates are written with six decimal places unless the number of digits
+after the decimal point is given with the --precision option. If the
+--simplify option is given, each polygon is simplified to within the given
+tolerance in degrees and the numbers of vertices before and after
+simplification are reported. Each ring is checked for edges that cross each
+other after simplification, but rings are simplified separately, so nearby
+rings may overlap if the tolerance is large compared with the distance between
+them.
+
+In batch mode, each of the given files, and each .json file in the given
+directories, is converted to a KML file with the same stem in the output
+directory. Files given more than once are only converted once, and a file with
+the same stem as an earlier one is reported as failed instead of overwriting
+its KML file. The files are converted in parallel by a pool of worker
+processes, defaulting to one for each CPU, and a summary of the results is
+printed when all the files have been processed.
+
+If the --timings option is given, the time spent and the peak memory used in
+each stage of the conversion are reported when it finishes: parsing the JSON,
+validating it against the schema and writing the KML. If the --profile option
+is given, the stages are also profiled and the statistics are written to the
+given file, which can be read with the pstats module. These options cannot be
+used in batch mode.
 
 Note that this performs an incomplete translation of the contents of the LLF
 GeoJSON files since it uses the incomplete specification supplied at the time
 of writing.
 
 This script uses the llf_schema module to perform validation of LLF GeoJSON
-files.
+files. Files are read incrementally using the json_stream module, and the KML
+for each timestep is written by the kmlstream module as soon as the timestep
+has been validated.
 """
 
-import json, pprint, sys
-from lxml.etree import Element, ElementTree, SubElement
-import llf_schema
+import getopt, glob, json, multiprocessing, os, pprint, sys
+import json_stream, llf_schema, schema
+
+# The kmlstream module is shared with the other converters.
+sys.path.insert(1, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                os.pardir, "common"))
+import kmlstream, profiling, simplify
 
 # Define some common style properties.
 style_properties = {"closed": "true"}
@@ -49,111 +84,317 @@ def read_file(file_name):
     
     return llf_schema.File().validate(llf)
 
-def write_extended_data_values(properties, extdata, prefix):
+def read_timesteps(file_name, profiler = None):
 
-    """Writes the contents of the properties dictionary to the XML element,
-    extdata, containing the extended data values, giving each piece of data
-    the specified prefix string."""
-    
-    for key, value in properties.items():
-        if type(value) == dict:
-            write_extended_data_values(value, extdata, prefix + key + ":")
-        else:
-            data = SubElement(extdata, 'Data')
-            data.set('name', prefix + key)
-            SubElement(data, 'value').text = unicode(value)
+    """Reads the GeoJSON file with the given file_name incrementally, validating
+    it and yielding each of its timesteps in turn. Raises an exception if the
+    validation fails, in which case some timesteps may already have been
+    yielded. If a profiler is given, the parse and validate stages are
+    recorded by it."""
 
-if __name__ == "__main__":
+    if profiler is None:
+        profiler = profiling.null_profiler
 
-    if not 2 <= len(sys.argv) <= 3:
+    llf_file = llf_schema.File()
+    found = set()
 
-        sys.stderr.write("Usage: %s <LLF GeoJSON file> [KML file for Diana]\n" % sys.argv[0])
-        sys.exit(1)
-    
-    geojson_file = sys.argv[1]
-    
-    if len(sys.argv) == 3:
-        kml_file = sys.argv[2]
-    else:
-        kml_file = None
+    f = open(file_name, "rb")
+    try:
+        members = json_stream.iter_members(f, ("timesteps",))
+        for key, value in profiler.iterate(members, "parse"):
+        
+            if key == "timesteps":
+                for timestep in profiler.iterate(value, "parse"):
+                    with profiler.stage("validate"):
+                        timestep = llf_file.validate_timestep(timestep)
+                    yield timestep
+            elif key == "header":
+                with profiler.stage("validate"):
+                    llf_file.validate_header(value)
+            
+            found.add(key)
+    finally:
+        f.close()
+
+    for key in llf_schema.File.schema:
+        if key not in found:
+            raise schema.ValidationError, "Missing '%s' entry in schema at ()" % key
+
+def write_folders(timestep, kml, precision = 6, simplifier = None):
 
-    llf = read_file(geojson_file)
+    """Writes a KML folder using the KML writer, kml, for each unique polygon
+    in the given timestep, writing coordinates with the given number of
+    decimal places. If a simplifier is given, it is used to simplify each
+    polygon before it is written."""
 
-    kml = Element('kml')
-    kml.set('xmlns', "http://www.opengis.net/kml/2.2")
-    doc = SubElement(kml, 'Document')
+    # Collect all the polygons for the timestep. Each polygon is stored as an
+    # array of coordinates whose contents are used as a key to identify
+    # polygons that are shared between features.
+    output_polygons = {}
+    valid = timestep['valid']
     
-    # Obtain information about each timestep in the file.
-    for timestep in llf:
+    for feature in timestep['forecast']:
     
-        # Collect all the polygons for each timestep.
-        output_polygons = {}
-        valid = timestep['valid']
-        
-        for feature in timestep['forecast']:
-        
-            polygons = feature['geometry']['coordinates']
-            for coords in polygons:
-            
-                polygon = []
-                for coord in coords:
-                    polygon.append((coord.x(), coord.y()))
-                polygon = tuple(polygon)
-
-                properties = output_polygons.get(polygon, {})
-                properties.update(feature['properties']['parameters'])
-                output_polygons[polygon] = properties
+        polygons = feature['geometry']['coordinates']
+        for ring in polygons:
         
-        # Create a folder for each unique polygon in the KML file.
+            key = ring.tostring()
+            try:
+                properties = output_polygons[key][1]
+            except KeyError:
+                properties = {}
+                output_polygons[key] = (ring, properties)
 
-        for coords, properties in output_polygons.items():
-        
-            folder = SubElement(doc, 'Folder')
-            name = SubElement(folder, 'name')
-            name.text = ''
-            
-            timespan = SubElement(folder, 'TimeSpan')
-            begin = SubElement(timespan, 'begin')
-            begin.text = unicode(valid[0].toString("yyyy-MM-ddThh:mm:ssZ"))
-            end = SubElement(timespan, 'end')
-            end.text = unicode(valid[1].toString("yyyy-MM-ddThh:mm:ssZ"))
-            
-            placemark = SubElement(folder, 'Placemark')
-            SubElement(placemark, 'name').text = ''
-            SubElement(placemark, 'description').text = ''
-            
-            extdata = SubElement(placemark, 'ExtendedData')
-            data = SubElement(extdata, 'Data')
-            data.set('name', u'met:objectType')
-            SubElement(data, 'value').text = 'PolyLine'
-            
-            # Convert the properties associated with this polygon into
-            # extended data values.
-            write_extended_data_values(properties, extdata, "met:info:llf:")
-            # Write the common style properties.
-            write_extended_data_values(style_properties, extdata, "met:style:")
-            
-            polygon = SubElement(placemark, 'Polygon')
-            SubElement(polygon, 'tessellate').text = '1'
-            
-            boundary = SubElement(polygon, 'outerBoundaryIs')
-            ring = SubElement(boundary, 'LinearRing')
-            coordinates = SubElement(ring, 'coordinates')
-            text = u''
-            
-            for coord in coords:
-                line = u"%f,%f,0\n" % coord
-                text += line
-            
-            if coords:
-                line = u"%f,%f,0\n" % coords[0]
-            
-            coordinates.text = text
+            properties.update(feature['properties']['parameters'])
+    
+    # Create a folder for each unique polygon in the KML file.
+
+    begin = valid[0].strftime("%Y-%m-%dT%H:%M:%SZ")
+    end = valid[1].strftime("%Y-%m-%dT%H:%M:%SZ")
+
+    for ring, properties in output_polygons.values():
     
+        with kml.folder('', begin, end):
+            with kml.placemark('', ''):
+            
+                # Convert the properties associated with this polygon into
+                # extended data values, followed by the common style properties.
+                kml.extended_data([(u'met:objectType', 'PolyLine')] +
+                    kmlstream.data_values(properties, "met:info:llf:") +
+                    kmlstream.data_values(style_properties, "met:style:"))
+                
+                if simplifier:
+                    ring = simplifier.simplify(ring)
+
+                kml.polygon(kmlstream.encode_coordinates(ring, precision, 0))
+
+def write_kml(timesteps, f, precision = 6, tolerance = None, profiler = None):
+
+    """Writes a KML document to the file, f, containing folders for each of the
+    timesteps supplied by the timesteps iterable, writing coordinates with the
+    given number of decimal places. The output is flushed after each timestep
+    so that it can be used before all timesteps have been read.
+
+    If a tolerance is given, polygons are simplified to within that number of
+    degrees and the Simplifier object used is returned; otherwise None is
+    returned. If a profiler is given, the time spent writing is recorded by it
+    as the write stage, excluding any stages recorded while reading the
+    timesteps."""
+
+    if profiler is None:
+        profiler = profiling.null_profiler
+
+    if tolerance:
+        simplifier = simplify.Simplifier(tolerance)
+    else:
+        simplifier = None
+
+    with profiler.stage("write"):
+        with kmlstream.writer(f) as kml:
+            for timestep in timesteps:
+                write_folders(timestep, kml, precision, simplifier)
+                kml.flush()
+
+    return simplifier
+
+def convert_file(geojson_file, kml_file, profiler = None, **options):
+
+    """Converts the GeoJSON file with the given geojson_file name to a KML file
+    with the given kml_file name, or to stdout if kml_file is None. Any options
+    are passed to the write_kml function, whose result is returned. If the
+    conversion fails, the incomplete KML file is removed and the exception is
+    raised again. If a profiler is given, each stage of the conversion is
+    recorded by it."""
+
+    timesteps = read_timesteps(geojson_file, profiler)
+
     if not kml_file:
-        f = sys.stdout
+        return write_kml(timesteps, sys.stdout, profiler = profiler, **options)
+
+    f = open(kml_file, 'wb')
+    try:
+        result = write_kml(timesteps, f, profiler = profiler, **options)
+    except:
+        # Remove the incomplete KML file if validation fails.
+        f.close()
+        os.remove(kml_file)
+        raise
+    f.close()
+
+    return result
+
+def convert_job(job):
+
+    """Converts the GeoJSON file in the given (geojson_file, kml_file, options)
+    job, returning a tuple containing the name of the GeoJSON file, a
+    description of the error or None if successful, and a description of any
+    simplification performed or None. This is used by the
+    worker processes in batch mode, which share the schema built when the
+    llf_schema module was imported and reuse it for each file they convert."""
+
+    geojson_file, kml_file, options = job
+
+    try:
+        simplifier = convert_file(geojson_file, kml_file, **options)
+    except Exception, e:
+        return geojson_file, "%s: %s" % (e.__class__.__name__, e), None
+
+    if simplifier:
+        return geojson_file, None, simplifier.report()
     else:
-        f = open(kml_file, 'wb')
+        return geojson_file, None, None
+
+def find_files(paths):
+
+    """Returns a list of the file names in the given list of paths, including
+    any GeoJSON files found in paths that refer to directories. Each file is
+    only included once, even if it is given by more than one path."""
+
+    file_names = []
+    found = set()
+
+    for path in paths:
+        if os.path.isdir(path):
+            names = sorted(glob.glob(os.path.join(path, "*.json")))
+        else:
+            names = [path]
+
+        for file_name in names:
+            real_path = os.path.realpath(file_name)
+            if real_path not in found:
+                found.add(real_path)
+                file_names.append(file_name)
+
+    return file_names
+
+def convert_batch(paths, output_dir, workers = None, **options):
+
+    """Converts the GeoJSON files in the given list of paths to KML files in the
+    output directory, using a pool of the specified number of worker processes.
+    Any options are passed to the write_kml function. Returns a list of the
+    results of the convert_job function in the order in which the files were
+    found. Files with the same stem as an earlier file are not converted, since
+    they would overwrite its KML file, and are reported as failed instead."""
+
+    results = []
+    jobs = []
+    stems = {}
+
+    for geojson_file in find_files(paths):
+
+        stem = os.path.splitext(os.path.basename(geojson_file))[0]
+        if stem in stems:
+            results.append((geojson_file, "Output file '%s.kml' is already written "
+                            "for '%s'." % (stem, stems[stem]), None))
+            continue
+
+        stems[stem] = geojson_file
+        results.append(None)
+        jobs.append((geojson_file, os.path.join(output_dir, stem + ".kml"), options))
+
+    pool = multiprocessing.Pool(workers)
+    try:
+        converted = pool.imap(convert_job, jobs)
+        for i, result in enumerate(results):
+            if result is None:
+                results[i] = converted.next()
+    finally:
+        pool.close()
+        pool.join()
+
+    return results
+
+def usage():
+
+    sys.stderr.write("Usage: %s [--precision=<digits>] [--simplify=<tolerance>]\n"
+                     "                     [--timings] [--profile=<file>]\n"
+                     "                     <LLF GeoJSON file> [KML file for Diana]\n" % sys.argv[0])
+    sys.stderr.write("       %s --batch=<output directory> [--workers=<number>]\n"
+                     "                     [--precision=<digits>] [--simplify=<tolerance>]\n"
+                     "                     <LLF GeoJSON file or directory> ...\n" % sys.argv[0])
+    sys.exit(1)
+
+if __name__ == "__main__":
+
+    try:
+        opts, args = getopt.getopt(sys.argv[1:], "", ["batch=", "workers=",
+                                                      "precision=", "simplify=",
+                                                      "timings", "profile="])
+    except getopt.GetoptError:
+        usage()
+
+    opts = dict(opts)
+
+    try:
+        precision = int(opts.get("--precision", 6))
+        tolerance = float(opts.get("--simplify", 0))
+    except ValueError:
+        usage()
+
+    if precision < 0 or tolerance < 0:
+        usage()
+
+    timed = "--timings" in opts or "--profile" in opts
+    if timed:
+        profiler = profiling.Profiler(opts.get("--profile"))
+    else:
+        profiler = profiling.null_profiler
+
+    if "--batch" in opts:
+
+        output_dir = opts["--batch"]
+
+        try:
+            workers = int(opts.get("--workers", multiprocessing.cpu_count()))
+        except ValueError:
+            usage()
+
+        if not args or workers < 1 or timed:
+            usage()
+
+        if not os.path.isdir(output_dir):
+            try:
+                os.makedirs(output_dir)
+            except OSError:
+                sys.stderr.write("Failed to create output directory '%s'.\n" % output_dir)
+                sys.exit(1)
+
+        results = convert_batch(args, output_dir, workers, precision = precision,
+                                tolerance = tolerance)
+        failed = 0
+
+        for geojson_file, error, report in results:
+            if error:
+                print "FAILED %s (%s)" % (geojson_file, error)
+                failed += 1
+            elif report:
+                print "OK     %s (%s)" % (geojson_file, report)
+            else:
+                print "OK     %s" % geojson_file
+
+        print "Converted %i of %i files." % (len(results) - failed, len(results))
+
+        if failed:
+            sys.exit(1)
+        sys.exit()
+
+    if "--workers" in opts or not 1 <= len(args) <= 2:
+        usage()
+    
+    geojson_file = args[0]
     
-    ElementTree(kml).write(f, encoding='UTF-8', xml_declaration=True, pretty_print=True)
+    if len(args) == 2:
+        kml_file = args[1]
+    else:
+        kml_file = None
+
+    simplifier = convert_file(geojson_file, kml_file, profiler, precision = precision,
+                              tolerance = tolerance)
+
+    # Report the simplification on stderr since the KML may be written to stdout.
+    if simplifier:
+        sys.stderr.write("%s: %s\n" % (geojson_file, simplifier.report()))
+
+    profiler.report(sys.stderr)
+
     sys.exit()
@@ -21,57 +21,100 @@ This module uses functions in the schema module to validate the contents of
 dictionaries obtained from GeoJSON files.
 """
 
+from array import array
+from itertools import chain
+import datetime
 import schema
 
 class LLF_Error(Exception):
     pass
 
-from PyQt4.QtCore import QDateTime, QPointF
-
 class Time:
 
+    """Validates date and time strings in the given strptime format, returning
+    datetime objects. Since files contain many copies of the same few strings,
+    the results of parsing are cached."""
+
+    cache_size = 1024
+
     def __init__(self, format):
         self.format = format
+        self.cache = {}
 
     def validate(self, value):
-    
-        dateTime = QDateTime.fromString(value, self.format)
-        if dateTime.isValid():
-            return dateTime
-        else:
+
+        try:
+            return self.cache[value]
+        except KeyError:
+            pass
+        except TypeError:
+            # Unhashable values cannot be valid times.
+            raise ValueError
+
+        result = self.parse(value)
+
+        if len(self.cache) >= self.cache_size:
+            self.cache.clear()
+        self.cache[value] = result
+
+        return result
+
+    def parse(self, value):
+
+        if not isinstance(value, basestring):
             raise ValueError
 
+        return datetime.datetime.strptime(value, self.format)
+
 class ShortDate(Time):
 
     def __init__(self):
-        Time.__init__(self, "yyMMdd")
+        Time.__init__(self, "%y%m%d")
 
-    def validate(self, value):
+    def parse(self, value):
 
-        dateTime = Time.validate(self, value)
-        return dateTime.addYears(100)
+        # Two digit years are always in the 21st century.
+        dateTime = Time.parse(self, value)
+        return dateTime.replace(year = 2000 + dateTime.year % 100)
 
 class Hour(Time):
 
     def __init__(self):
-        Time.__init__(self, "HH")
+        Time.__init__(self, "%H")
 
-    def validate(self, value):
+    def parse(self, value):
+
+        return Time.parse(self, value).hour
 
-        return Time.validate(self, value).time().hour()
+class LonLatRing:
 
-class LonLat:
+    """Validates a list of [longitude, latitude] pairs, returning the coordinates
+    in a single array of doubles containing alternate longitudes and latitudes."""
 
     def validate(self, value):
     
-        if len(value) != 2:
+        if type(value) != list:
             raise ValueError
-        elif not -180.0 <= value[0] <= 180.0:
-            raise ValueError
-        elif not -90.0 <= value[1] <= 90.0:
+
+        try:
+            for pair in value:
+                if len(pair) != 2:
+                    raise ValueError
+
+            ring = array('d', chain.from_iterable(value))
+        except TypeError:
             raise ValueError
-        else:
-            return QPointF(value[0], value[1])
+
+        # Check the ranges of all the longitudes and latitudes at once.
+        if ring:
+            lon = ring[0::2]
+            lat = ring[1::2]
+            if not (-180.0 <= min(lon) and max(lon) <= 180.0):
+                raise ValueError
+            elif not (-90.0 <= min(lat) and max(lat) <= 90.0):
+                raise ValueError
+
+        return ring
 
 class IntRange:
 
@@ -102,20 +145,22 @@ class AnyEntries:
 
     def __init__(self, expected_dict):
         self.expected_dict = expected_dict
+        self.validator = schema.compile_schema(expected_dict)
     
     def validate(self, value_dict):
     
         for key, value in value_dict.items():
-            schema.validate(value, self.expected_dict)
+            self.validator(value)
         
         return value_dict
 
-ISODate = Time("yyyy-MM-ddTHH:mm:ss.zzzZ")
+ISODate = Time("%Y-%m-%dT%H:%M:%S.%fZ")
 
 class SchemaElement:
 
-    def __init__(self, schema):
-        self.schema = schema
+    def __init__(self, description):
+        self.schema = description
+        self.validator = schema.compile_schema(description)
 
 class Properties(SchemaElement):
 
@@ -231,22 +276,27 @@ class Properties(SchemaElement):
     
     def validate(self, value):
     
-        completed = schema.validate(value, self.schema)
+        completed = self.validator(value)
         
-        paraSchema = Properties.parameterGroups[value["parameterGroup"]]
-        completed["parameters"] = schema.validate(value["parameters"], paraSchema)
+        paraValidator = Properties.parameterValidators[value["parameterGroup"]]
+        completed["parameters"] = paraValidator(value["parameters"])
         
         return LLF_Properties(completed)
 
+# Compile the descriptions of the parameter groups when the module is loaded.
+Properties.parameterValidators = dict(
+    (group, schema.compile_schema(description, ("parameters",)))
+    for group, description in Properties.parameterGroups.items())
+
 class Feature(SchemaElement):
 
     def validate(self, value):
-        return LLF_Feature(schema.validate(value, self.schema))
+        return LLF_Feature(self.validator(value))
 
 class Forecast(SchemaElement):
 
     def validate(self, value):
-        return LLF_Forecast(schema.validate(value, self.schema))
+        return LLF_Forecast(self.validator(value))
 
 class File:
 
@@ -279,7 +329,7 @@ class File:
                 "features": [ Feature( {
                     "geometry": {
                         "type": "Polygon",
-                        "coordinates": [ [LonLat()] ]
+                        "coordinates": [ LonLatRing() ]
                         },
                     "type": "Feature",
                     "properties": Properties( {
@@ -303,9 +353,32 @@ class File:
         successful or raising an exception if not.
         """
 
-        # Note that the schema object here refers to the module, not the
-        # attribute of this class.
-        return LLF_File(schema.validate(value, File.schema))
+        return LLF_File(File.validator(value))
+
+    def validate_header(self, value):
+    
+        """Validates the Python dictionary, value, against the expected contents
+        of the header of an LLF GeoJSON file, returning the validated header if
+        successful or raising an exception if not."""
+
+        return File.header_validator(value)
+
+    def validate_timestep(self, value):
+    
+        """Validates the Python dictionary, value, against the expected contents
+        of a single item in the timesteps list of an LLF GeoJSON file, returning
+        the validated timestep if successful or raising an exception if not.
+        This allows files to be validated incrementally."""
+
+        return File.timestep_validator(value)
+
+# Compile the description of the file when the module is loaded. Note that the
+# schema object here refers to the module, not the attribute of the class.
+File.validator = staticmethod(schema.compile_schema(File.schema))
+File.header_validator = staticmethod(
+    schema.compile_schema(File.schema["header"], ("header",)))
+File.timestep_validator = staticmethod(
+    schema.compile_schema(File.schema["timesteps"][0], ("timesteps",)))
 
 # Containers for validated data
 
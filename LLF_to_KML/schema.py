@@ -19,6 +19,10 @@
 expected contents of data structures. This can be especially useful when
 trying to describe the contents of dictionaries obtained from JSON files
 when the full descriptive power of JSON-Schema is not needed.
+
+Descriptions that are used repeatedly can be compiled into validator functions
+using the compile_schema function. These perform the same checks as the
+validate function without examining the description each time they are used.
 """
 
 class ValidationError(Exception):
@@ -127,3 +131,140 @@ def validate_list(value, expected, path):
         new_list.append(validate_value(item, expected_item, path))
 
     return new_list
+
+# Compiled validators
+
+def compile_schema(expected, path=()):
+    """Compiles the expected description of a data structure into a validator
+    function that can be reused to validate many values without examining the
+    types of the objects in the description each time.
+
+    The returned function accepts a single value and returns the populated
+    value if successful or raises a ValidationError exception if not. The
+    path is the location of the expected description in a larger schema and
+    is only used when reporting errors."""
+
+    return compile_value(expected, path)
+
+def compile_value(expected, path):
+    """Returns a validator function for the expected value at the specified
+    path of the expected value in a larger schema."""
+
+    if type(expected) == dict:
+        return compile_dict(expected, path)
+
+    elif type(expected) == list:
+        return compile_list(expected, path)
+
+    elif type(expected) == unicode or type(expected) == str:
+        return compile_constant(expected, path)
+
+    elif expected == unicode:
+        return compile_type(unicode, "Expected unicode at %s" % (path,))
+
+    elif expected == int:
+        return compile_type(int, "Expected integer at %s" % (path,))
+
+    elif expected == float:
+        return compile_type(float, "Expected float at %s" % (path,))
+
+    else:
+        return compile_object(expected, path)
+
+def compile_dict(expected, path):
+    """Returns a validator function for dictionaries described by the expected
+    dictionary at the specified path of a larger schema.
+
+    Unlike validate_dict, entries described as Optional are simply omitted
+    from the populated dictionary if they are not present in the data."""
+
+    required = []
+    optional = []
+
+    for key, expected_value in expected.items():
+        if isinstance(expected_value, Optional):
+            optional.append((key, compile_value(expected_value.value, path + (key,))))
+        else:
+            required.append((key, compile_value(expected_value, path + (key,))))
+
+    dict_message = "Expected a dictionary at %s" % (path,)
+
+    def validator(data):
+
+        if type(data) != dict:
+            raise ValidationError, dict_message
+
+        new_data = {}
+
+        for key, validate_entry in required:
+            try:
+                value = data[key]
+            except KeyError:
+                raise ValidationError, "Missing '%s' entry in schema at %s" % (key, path)
+
+            new_data[key] = validate_entry(value)
+
+        for key, validate_entry in optional:
+            if key in data:
+                new_data[key] = validate_entry(data[key])
+
+        return new_data
+
+    return validator
+
+def compile_list(expected, path):
+    """Returns a validator function for lists described by the expected list
+    at the specified path of a larger schema."""
+
+    validate_item = compile_value(expected[0], path)
+    list_message = "Expected a list at %s" % (path,)
+
+    def validator(value):
+
+        if type(value) != list:
+            raise ValidationError, list_message
+
+        return map(validate_item, value)
+
+    return validator
+
+def compile_constant(expected, path):
+    """Returns a validator function that checks for the expected string."""
+
+    message = "Expected '%s' at %s" % (expected, path)
+
+    def validator(value):
+
+        if value != expected:
+            raise ValidationError, message
+        return value
+
+    return validator
+
+def compile_type(expected_type, message):
+    """Returns a validator function that checks that values have exactly the
+    expected type, raising a ValidationError with the given message if not."""
+
+    def validator(value):
+
+        if type(value) != expected_type:
+            raise ValidationError, message
+        return value
+
+    return validator
+
+def compile_object(expected, path):
+    """Returns a validator function that calls the validate method of the
+    expected object, converting any ValueError into a ValidationError."""
+
+    validate = expected.validate
+    message = "Failed to validate value at %s" % (path,)
+
+    def validator(value):
+
+        try:
+            return validate(value)
+        except ValueError:
+            raise ValidationError, message
+
+    return validator
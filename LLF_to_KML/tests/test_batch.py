@@ -0,0 +1,51 @@
+"""Tests for the batch mode of the llf2kml module."""
+
+import os, shutil, sys, tempfile, unittest
+
+this_dir = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(1, os.path.join(this_dir, os.pardir))
+import llf2kml
+
+files_dir = os.path.join(this_dir, "files")
+ice_file = os.path.join(files_dir, "EKCH_ice_150902_12.json")
+
+class BatchTest(unittest.TestCase):
+
+    def setUp(self):
+        self.work_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.work_dir, True)
+
+    def test_find_files_removes_duplicates(self):
+
+        link = os.path.join(self.work_dir, "link.json")
+        os.symlink(ice_file, link)
+
+        file_names = llf2kml.find_files([ice_file, files_dir, link,
+                                         os.path.join(files_dir, os.curdir,
+                                                      "EKCH_ice_150902_12.json")])
+
+        self.assertEqual(file_names[0], ice_file)
+        self.assertEqual(len(file_names), len(set(map(os.path.realpath, file_names))))
+        self.assertEqual(len(file_names), 6)
+
+    def test_colliding_stems_are_not_converted(self):
+
+        other_dir = os.path.join(self.work_dir, "other")
+        output_dir = os.path.join(self.work_dir, "output")
+        os.mkdir(other_dir)
+        os.mkdir(output_dir)
+        copy = os.path.join(other_dir, os.path.basename(ice_file))
+        shutil.copyfile(ice_file, copy)
+
+        results = llf2kml.convert_batch([ice_file, copy, ice_file], output_dir, 2)
+
+        self.assertEqual(len(results), 2)
+        self.assertEqual(results[0][:2], (ice_file, None))
+        self.assertEqual(results[1][0], copy)
+        self.assertNotEqual(results[1][1], None)
+        self.assertEqual(os.listdir(output_dir), ["EKCH_ice_150902_12.kml"])
+
+if __name__ == "__main__":
+    unittest.main()
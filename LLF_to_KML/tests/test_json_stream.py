@@ -0,0 +1,73 @@
+"""Tests for the json_stream module."""
+
+import glob, json, os, sys, unittest
+from StringIO import StringIO
+
+this_dir = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(1, os.path.join(this_dir, os.pardir))
+import json_stream
+
+def members(text, streamed = (), chunk_size = 65536):
+
+    """Returns a list of the members of the JSON object in the given text,
+    with the values of streamed members converted to lists."""
+
+    result = []
+    for key, value in json_stream.iter_members(StringIO(text), streamed, chunk_size):
+        if key in streamed:
+            value = list(value)
+        result.append((key, value))
+    return result
+
+class JSONStreamTest(unittest.TestCase):
+
+    def test_members(self):
+
+        text = '{"a": 1, "b": [1, 2, {"c": "d"}], "e": {"f": null}}'
+        self.assertEqual(members(text), [("a", 1), ("b", [1, 2, {"c": "d"}]),
+                                         ("e", {"f": None})])
+
+    def test_streamed_arrays(self):
+
+        text = '{"a": [], "b": [1, [2, 3], "x"], "c": true}'
+        self.assertEqual(members(text, ("a", "b")), [("a", []), ("b", [1, [2, 3], "x"]),
+                                                      ("c", True)])
+
+    def test_small_chunks(self):
+
+        # Values and numbers are split across chunks.
+        text = '{ "name" : "a long string value", "numbers" : [12345, 6.75e3, -0.5] }'
+        for chunk_size in (1, 2, 3, 7):
+            self.assertEqual(members(text, ("numbers",), chunk_size),
+                             [("name", "a long string value"),
+                              ("numbers", [12345, 6750.0, -0.5])])
+
+    def test_unused_items_are_skipped(self):
+
+        stream = json_stream.iter_members(StringIO('{"a": [1, 2, 3], "b": 4}'), ("a",), 2)
+
+        key, items = stream.next()
+        self.assertEqual(items.next(), 1)
+        self.assertEqual(stream.next(), ("b", 4))
+
+    def test_empty_object(self):
+        self.assertEqual(members("  {  }  "), [])
+
+    def test_invalid_text(self):
+
+        for text in ('[1, 2]', '{"a" 1}', '{"a": 1', '{1: 2}', '{"a": 1} x',
+                     '{"a": [1 2]}'):
+            self.assertRaises(ValueError, members, text, ("a",), 4)
+
+    def test_test_files(self):
+
+        # The members of the test files, with their arrays streamed, are the
+        # same as those decoded by the json module.
+        for file_name in glob.glob(os.path.join(this_dir, "files", "*.json")):
+            expected = json.load(open(file_name))
+            streamed = filter(lambda key: isinstance(expected[key], list), expected.keys())
+            found = members(open(file_name).read(), streamed, 1024)
+            self.assertEqual(dict(found), expected)
+
+if __name__ == "__main__":
+    unittest.main()
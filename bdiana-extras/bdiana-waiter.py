@@ -1,25 +1,207 @@
 #!/usr/bin/env python
 
-"""Usage: bdiana-waiter.py <input directory> <period> <bdiana> <setup file>
+"""Usage: bdiana-waiter.py [--workers=<number>] [--timeout=<seconds>]
+                        [--queue=<number>] [--spool] [--spool-keep=<days>]
+                        [--render-cache=<directory>]
+                        [--render-cache-size=<megabytes>]
+                        [--coalesce=<number>] [--metrics=<file>]
+                        [--metrics-port=<port>] [--json-log=<file>]
+                        <input directory> <period> <bdiana> <setup file>
 
-Monitors the given input directory for new input files, waiting for the
-specified period (in seconds) before checking again. When new input files
-are found, runs the specified bdiana executable and setup file for each of
-the files. The input files are deleted after being processed.
+Monitors the given input directory for new input files, waiting for up to the
+specified period (in seconds) before checking again. Where inotify is
+available, the directory is checked as soon as a new input file is written to
+it or moved into it. When new input files are found, runs the specified bdiana
+executable and setup file for each of the files. The input files are deleted
+after being processed.
+
+Up to the number of bdiana processes given by the --workers option are run at
+the same time, one for each input file; by default, only one is run. The
+output of each process is collected and written to the log when it finishes.
+If the --timeout option is given, processes that run for longer than the given
+number of seconds are killed and reported as failed. If bdiana cannot be
+started, the input files are reported as failed and renamed with a .failed
+suffix, or moved into the failed directory when the --spool option is given.
+
+Input files are processed in the order decided by the scheduler module, using
+their priority and deadline parameters, and files that are superseded by newer
+ones with the same output files are discarded. If the --queue option is given,
+at most that number of files are queued and a file called backpressure is
+created in the input directory while more are waiting.
+
+If the --spool option is given, the input directory can be shared with other
+waiters, including ones on other hosts. Each input file is claimed by moving
+it into a processing directory for this waiter before bdiana is run, and it is
+moved into the done or failed directory afterwards instead of being deleted.
+Files claimed by waiters that have stopped are returned to the input
+directory. Files in the done and failed directories are removed after seven
+days, or after the number of days given by the --spool-keep option. See the
+spool module for details.
+
+If the --render-cache option is given, the output of each input file is kept
+in the given directory, and input files that would produce the same output as
+an earlier one are not processed again. Instead, the cached files are linked
+or copied to the output file names. The cache holds up to 1024 megabytes of
+files unless another size is given with the --render-cache-size option. See
+the render_cache module for details.
+
+If the --coalesce option is given, up to the given number of queued input
+files that use the same setup file and set the same parameters are combined
+into a single input file, so that they are processed by one bdiana process
+that only needs to start and read its maps once. Each of the input files is
+considered to have been processed successfully if all of its output files
+were written by the combined process. The input files whose output files
+were not written are processed again on their own, so that a single bad input
+file does not cause the others combined with it to fail.
+
+The waiter records the number of input files processed, cached, failed and
+timed out, the length of the queue, the number of running bdiana processes,
+and histograms of the time each file waited before being processed and the
+time taken by bdiana, labelled with the format of the output files. If the
+--metrics option is given, these are written to the given file in the
+Prometheus text format whenever they change. If the --metrics-port option is
+given, they are served at http://localhost:<port>/metrics. If the --json-log
+option is given, a line of JSON describing each input file and its timings is
+appended to the given file. See the metrics module for details.
 """
 
-import commands, glob, os, sys, time
+import getopt, os, signal, subprocess, sys, tempfile, time
+import metrics, render_cache, scheduler, spool, watcher
+
+# The interval in seconds between checks on running bdiana processes.
+poll_interval = 0.2
 
 def now():
     return time.strftime("%Y-%m-%d %H:%M:%S UTC", time.gmtime())
 
+class Job:
+
+    """Runs bdiana for an input file in a separate process group, collecting
+    its output in a temporary file. The sources are a list of (file name,
+    output file names, render cache key) tuples for the original input files
+    that the input file was created from."""
+
+    def __init__(self, file_name, sources, command):
+
+        self.file_name = file_name
+        self.sources = sources
+        self.output = tempfile.TemporaryFile()
+        self.started = time.time()
+        try:
+            self.process = subprocess.Popen(command, stdin = open(os.devnull),
+                stdout = self.output, stderr = subprocess.STDOUT, close_fds = True,
+                preexec_fn = os.setsid)
+        except OSError:
+            self.output.close()
+            raise
+
+    def poll(self):
+        return self.process.poll()
+
+    def elapsed(self):
+        return time.time() - self.started
+
+    def kill(self):
+
+        """Kills the bdiana process and any processes it started."""
+
+        try:
+            os.killpg(self.process.pid, signal.SIGKILL)
+        except OSError:
+            pass
+        self.process.wait()
+
+    def read_output(self):
+
+        self.output.seek(0)
+        text = self.output.read()
+        self.output.close()
+        return text
+
+def combine(sources):
+
+    """Writes the contents of the input files in the given list of sources to a
+    temporary file, returning its name."""
+
+    fd, file_name = tempfile.mkstemp(".input", "coalesced-")
+    f = os.fdopen(fd, "w")
+
+    for source_name, outputs, cache_key in sources:
+        f.write("\n# %s\n" % source_name)
+        f.write(open(source_name).read())
+        f.write("\n")
+
+    f.close()
+    return file_name
+
+def outputs_written(outputs, started):
+
+    """Returns True if all the given output files were written after the given
+    start time."""
+
+    if not outputs:
+        return False
+
+    for output in outputs:
+        try:
+            # Allow for file systems that only record whole seconds.
+            if os.path.getmtime(output) < int(started):
+                return False
+        except OSError:
+            return False
+
+    return True
+
+def queue_time(file_name, started):
+
+    """Returns the time the input file with the given file_name waited between
+    being written and the given start time."""
+
+    try:
+        return max(0, started - os.path.getmtime(file_name))
+    except OSError:
+        return 0
+
+def dispose(claims, file_name, success):
+
+    """Deletes the input file with the given file_name after it has been
+    processed or, if the claims spool is not None, moves it into the done or
+    failed directory of the spool, depending on whether it was successful."""
+
+    if claims:
+        if not claims.complete(file_name, success):
+            sys.stderr.write("%s: Input file '%s' was recovered by another waiter "
+                             "before it was finished.\n" % (now(), file_name))
+    else:
+        os.remove(file_name)
+
+def report(job, message, stream):
+
+    stream.write("%s: %s '%s' after %.1f seconds.\n" % (now(), message,
+                 job.file_name, job.elapsed()))
+
+    output = job.read_output().rstrip()
+    if output:
+        for line in output.split("\n"):
+            stream.write("    %s\n" % line)
+
 if __name__ == "__main__":
 
-    if len(sys.argv) != 5:
+    try:
+        opts, args = getopt.getopt(sys.argv[1:], "", ["workers=", "timeout=",
+                                                      "queue=", "spool", "spool-keep=",
+            "render-cache=", "render-cache-size=", "coalesce=", "metrics=",
+            "metrics-port=", "json-log="])
+    except getopt.GetoptError:
+        sys.stderr.write(__doc__)
+        sys.exit(1)
+
+    if len(args) != 4:
         sys.stderr.write(__doc__)
         sys.exit(1)
 
-    input_dir, period, bdiana, setup_file = sys.argv[1:]
+    opts = dict(opts)
+    input_dir, period, bdiana, setup_file = args
 
     if not os.path.exists(input_dir):
         try:
@@ -35,24 +217,209 @@ if __name__ == "__main__":
         sys.stderr.write("Please specify an integer period of time in seconds.\n")
         sys.exit(1)
 
+    try:
+        workers = int(opts.get("--workers", 1))
+        if "--timeout" in opts:
+            timeout = float(opts["--timeout"])
+        else:
+            timeout = None
+        if "--queue" in opts:
+            capacity = int(opts["--queue"])
+        else:
+            capacity = None
+        cache_size = int(opts.get("--render-cache-size", 1024)) * 1024 * 1024
+        coalesce = int(opts.get("--coalesce", 1))
+        keep_time = int(opts.get("--spool-keep", 7)) * 24 * 3600
+        if "--metrics-port" in opts:
+            metrics_port = int(opts["--metrics-port"])
+        else:
+            metrics_port = None
+    except ValueError:
+        sys.stderr.write(__doc__)
+        sys.exit(1)
+
+    if workers < 1:
+        sys.stderr.write("Please specify at least one worker.\n")
+        sys.exit(1)
+
+    if capacity is not None and capacity < 1 or coalesce < 1 or keep_time < 0:
+        sys.stderr.write(__doc__)
+        sys.exit(1)
+
+    job_queue = scheduler.Scheduler(capacity, os.path.join(input_dir, "backpressure"))
+
+    if "--render-cache" in opts:
+        renders = render_cache.RenderCache(opts["--render-cache"], cache_size,
+                                           setup_file)
+    else:
+        renders = None
+
+    if "--spool" in opts:
+        claims = spool.Spool(input_dir, keep_time = keep_time)
+        claims.start_heartbeat()
+    else:
+        claims = None
+
+    stats = metrics.Metrics("bdiana_waiter", opts.get("--metrics"),
+                            opts.get("--json-log"))
+    if metrics_port is not None:
+        stats.serve(metrics_port)
+
+    # Start watching before the first scan so that no new files are missed.
+    watch = watcher.watcher(input_dir, "*.input")
+
+    # The jobs that are running, indexed by the input files given to bdiana.
+    running = {}
+
+    # The sources of combined jobs that failed, to be processed on their own.
+    retry = []
+
     while True:
 
-        files = glob.glob(os.path.join(input_dir, "*.input"))
-        if files:
-            print "%s: Found %i files." % (now(), len(files))
+        if claims:
+            for file_name in claims.recover():
+                print "%s: Recovered input file '%s' from a stopped waiter." % (now(), file_name)
+
+        busy = set()
+        for job in running.values():
+            for source_name, outputs, cache_key in job.sources:
+                busy.add(source_name)
+        for source_name, outputs, cache_key in retry:
+            busy.add(source_name)
 
-        for file_name in files:
+        for message in job_queue.scan(input_dir, busy):
+            print "%s: %s" % (now(), message)
 
-            result = os.system(" ".join([commands.mkarg(bdiana), "-s",
-                commands.mkarg(setup_file), "-i", commands.mkarg(file_name)]))
-            
-            if result != 0:
-                sys.stderr.write("%s: Failed to process '%s'.\n" % (now(), file_name))
+        while (retry or job_queue.queue) and len(running) < workers:
+
+            sources = []
+
+            if retry:
+                sources.append(retry.pop(0))
+                queued_group = []
+            else:
+                queued_group = job_queue.pop_group(coalesce)
+
+            for queued in queued_group:
+
+                file_name = queued.file_name
+                if claims:
+                    file_name = claims.claim(file_name)
+                    if file_name is None:
+                        # Another waiter claimed the file first.
+                        continue
+
+                outputs = list(queued.outputs)
+                cache_key = None
+
+                if renders:
+                    started = time.time()
+                    cache_key, outputs, found = renders.lookup(file_name)
+                    if found:
+                        print "%s: Reused cached output for input file '%s'." % (now(), file_name)
+                        stats.record_job(file_name, "cached",
+                            {"queue": queue_time(file_name, started),
+                             "fetch": time.time() - started},
+                            metrics.output_format(outputs))
+                        dispose(claims, file_name, True)
+                        continue
+
+                sources.append((file_name, outputs, cache_key))
+
+            if not sources:
+                continue
+            elif len(sources) == 1:
+                file_name = sources[0][0]
+                print "%s: Started processing '%s'." % (now(), file_name)
+            else:
+                file_name = combine(sources)
+                print "%s: Started processing %i input files combined in '%s'." % (
+                    now(), len(sources), file_name)
+
+            try:
+                running[file_name] = Job(file_name, sources,
+                                         [bdiana, "-s", setup_file, "-i", file_name])
+            except OSError, e:
+                # bdiana could not be started, perhaps because it is missing or
+                # the waiter has run out of file descriptors.
+                sys.stderr.write("%s: Failed to run bdiana for '%s': %s\n" % (
+                                 now(), file_name, e))
+                if len(sources) > 1:
+                    os.remove(file_name)
+
+                for source_name, outputs, cache_key in sources:
+                    stats.record_job(source_name, "failed",
+                        {"queue": queue_time(source_name, time.time())},
+                        metrics.output_format(outputs), error = str(e),
+                        combined = len(sources))
+                    if claims:
+                        dispose(claims, source_name, False)
+                    else:
+                        os.rename(source_name, source_name + ".failed")
+
+        for file_name, job in running.items():
+
+            result = job.poll()
+            failure = "failed"
+
+            if result is None:
+                if timeout is None or job.elapsed() < timeout:
+                    continue
+                job.kill()
+                report(job, "Killed bdiana after it timed out processing",
+                       sys.stderr)
+                failure = "timeout"
+            elif result != 0:
+                report(job, "Failed to process", sys.stderr)
             else:
-                print "%s: Processed input file '%s'." % (now(), file_name)
+                report(job, "Processed input file", sys.stdout)
+
+            del running[file_name]
+
+            if len(job.sources) > 1:
+                os.remove(file_name)
+
+            for source_name, outputs, cache_key in job.sources:
+
+                if len(job.sources) == 1:
+                    success = result == 0
+                else:
+                    # Find out which of the combined input files were
+                    # processed from the output files written.
+                    success = outputs_written(outputs, job.started)
+                    if success:
+                        print "%s: Processed input file '%s'." % (now(), source_name)
+                    else:
+                        # The input file may have failed because of another
+                        # one, so process it again on its own.
+                        print "%s: Retrying input file '%s' on its own." % (now(), source_name)
+                        retry.append((source_name, outputs, cache_key))
+                        continue
+
+                if success:
+                    outcome = "processed"
+                else:
+                    outcome = failure
+                stats.record_job(source_name, outcome,
+                    {"queue": queue_time(source_name, job.started),
+                     "run": job.elapsed()},
+                    metrics.output_format(outputs), status = result,
+                    combined = len(job.sources))
+
+                if success and renders and cache_key:
+                    renders.store(cache_key, outputs)
+
+                dispose(claims, source_name, success)
 
-            os.remove(file_name)
+        stats.set("queue_length", len(job_queue.queue))
+        stats.set("backlog_length", job_queue.backlog)
+        stats.set("running_processes", len(running))
+        stats.flush()
+        sys.stdout.flush()
 
-        time.sleep(period)
+        if running or retry or job_queue.queue:
+            watch.wait(poll_interval)
+        else:
+            watch.wait(period)
 
     sys.exit()
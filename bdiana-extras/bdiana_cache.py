@@ -0,0 +1,187 @@
+"""Provides a cache of BDiana objects for use by python-diana-waiter.py.
+
+Preparing a plot from an input file opens the field files listed in its
+FIELD_FILES sections and loads the map for its MAP and AREA commands. Input
+files that use the same field files, map and area can be plotted with the same
+BDiana object, which still has the field files open, so the BDiana objects are
+kept in a cache keyed on the normalised contents of those sections and on the
+size and modification time of the files matched by the field file patterns,
+so that an object is not reused after its field files have been replaced.
+
+When an input file matches a cached BDiana object, a copy of the input file
+without its FIELD_FILES sections is prepared instead, so that the field files
+are not opened again. The least recently used objects are discarded when the
+cache holds more than the given number of objects or when the resident memory
+of the process exceeds the given limit.
+"""
+
+import collections, gc, glob, os, tempfile
+from metno import bdiana
+import render_cache
+
+def read_sections(file_name):
+
+    """Reads the input file with the given file_name, returning a tuple
+    containing a list of the lines in its FIELD_FILES sections, a list of the
+    MAP and AREA commands in its PLOT sections, both with their whitespace
+    normalised, and the text of the file without the FIELD_FILES sections."""
+
+    field_files = []
+    map_area = []
+    lines = []
+    in_field_files = False
+    in_plot = False
+
+    for line in open(file_name):
+
+        words = line.split()
+        normalised = " ".join(words)
+
+        if normalised.upper() == "<FIELD_FILES>":
+            in_field_files = True
+            continue
+        elif normalised.upper() == "</FIELD_FILES>":
+            in_field_files = False
+            continue
+        elif in_field_files:
+            if normalised and not normalised.startswith("#"):
+                field_files.append(normalised)
+            continue
+
+        lines.append(line)
+
+        if normalised.upper() == "PLOT":
+            in_plot = True
+        elif normalised.upper() == "ENDPLOT":
+            in_plot = False
+        elif in_plot and words and words[0].upper() in ("MAP", "AREA"):
+            map_area.append(normalised)
+
+    return field_files, map_area, "".join(lines)
+
+def field_file_identities(field_files):
+
+    """Returns a tuple containing the identities of the files matched by the
+    file patterns in the given FIELD_FILES lines. Files that cannot be read
+    are left out, since plotting them will fail anyway."""
+
+    identities = []
+
+    for line in field_files:
+        for word in line.split():
+            key, sep, value = word.partition("=")
+            if key.lower() not in ("f", "file"):
+                continue
+            for path in sorted(glob.glob(value)):
+                try:
+                    identities.append(render_cache.file_identity(path))
+                except (IOError, OSError):
+                    pass
+
+    return tuple(identities)
+
+def resident_memory():
+
+    """Returns the resident memory of the current process in bytes, or None if
+    it cannot be determined."""
+
+    try:
+        for line in open("/proc/self/status"):
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1]) * 1024
+    except (IOError, ValueError, IndexError):
+        pass
+
+    return None
+
+class BDianaCache:
+
+    """Keeps up to the given number of BDiana objects, each set up with the
+    given setup file, discarding the least recently used ones if the resident
+    memory of the process exceeds the memory_limit in bytes. If the size is
+    zero, a single BDiana object is used for all input files, as if there was
+    no cache."""
+
+    def __init__(self, setup_file, size = 0, memory_limit = None):
+
+        self.setup_file = setup_file
+        self.size = size
+        self.memory_limit = memory_limit
+        self.entries = collections.OrderedDict()
+        self.spare = None
+
+    def setup(self):
+
+        """Creates the first BDiana object, returning False if the setup file
+        could not be read."""
+
+        b = bdiana.BDiana()
+        if not b.setup(self.setup_file):
+            return False
+
+        self.spare = b
+        return True
+
+    def lookup(self, file_name):
+
+        """Returns a tuple containing the BDiana object to use for the input
+        file with the given file_name and the name of the file to prepare.
+        If the name differs from file_name, it refers to a temporary file that
+        the caller should remove after use. If a new BDiana object is needed
+        but the setup file could not be read, the object returned is None."""
+
+        if self.size == 0:
+            return self.spare, file_name
+
+        field_files, map_area, text = read_sections(file_name)
+        key = (tuple(field_files), tuple(map_area), field_file_identities(field_files))
+
+        b = self.entries.pop(key, None)
+        if b is not None:
+            # Move the object to the end of the cache since it is now the most
+            # recently used.
+            self.entries[key] = b
+
+            if not field_files:
+                return b, file_name
+
+            # Write the copy outside the input directory so that the waiters
+            # do not treat it as a new input file.
+            fd, temp_name = tempfile.mkstemp(".input", "cached-")
+            f = os.fdopen(fd, "w")
+            f.write(text)
+            f.close()
+            return b, temp_name
+
+        if self.spare is not None:
+            b = self.spare
+            self.spare = None
+        else:
+            b = bdiana.BDiana()
+            if not b.setup(self.setup_file):
+                return None, file_name
+
+        self.entries[key] = b
+
+        while len(self.entries) > self.size:
+            self.entries.popitem(last = False)
+
+        return b, file_name
+
+    def trim(self):
+
+        """Discards the least recently used objects until the resident memory
+        is within the memory limit, always keeping the most recently used
+        object."""
+
+        if self.memory_limit is None:
+            return
+
+        while len(self.entries) > 1:
+
+            memory = resident_memory()
+            if memory is None or memory <= self.memory_limit:
+                break
+
+            self.entries.popitem(last = False)
+            gc.collect()
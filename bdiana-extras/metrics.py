@@ -0,0 +1,226 @@
+"""Provides counters, gauges and histograms for recording the activity of the
+waiters.
+
+The values recorded can be written to a file in the Prometheus text format,
+for use with the textfile collector of the Prometheus node exporter, or served
+in the same format by a small HTTP server running in a separate thread. Each
+job can also be described by a line of JSON written to a log file, so that
+the timings of individual plots can be examined later.
+"""
+
+import BaseHTTPServer, json, os, threading, time
+
+# The upper bounds of the histogram buckets, in seconds.
+default_buckets = (0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+def format_labels(labels):
+
+    if not labels:
+        return ""
+
+    pieces = []
+    for name, value in labels:
+        value = str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+        pieces.append('%s="%s"' % (name, value))
+
+    return "{" + ",".join(pieces) + "}"
+
+class Histogram:
+
+    """Counts the values observed that fall within each of the given bucket
+    bounds."""
+
+    def __init__(self, buckets):
+
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+        self.count += 1
+        self.sum += value
+
+class Metrics:
+
+    """Records metrics with names that start with the given prefix. If a file
+    name is given, the metrics are written to it by the flush method. If a
+    log file name is given, the log method writes JSON lines to it."""
+
+    def __init__(self, prefix, file_name = None, log_file = None):
+
+        self.prefix = prefix
+        self.file_name = file_name
+        self.counters = {}
+        self.gauges = {}
+        self.histograms = {}
+        self.lock = threading.Lock()
+        self.changed = False
+
+        if log_file:
+            self.log_stream = open(log_file, "a")
+        else:
+            self.log_stream = None
+
+    def key(self, name, labels):
+        return (self.prefix + "_" + name, tuple(sorted(labels.items())))
+
+    def inc(self, name, labels = {}, value = 1):
+
+        """Increases the counter with the given name and labels."""
+
+        with self.lock:
+            key = self.key(name, labels)
+            self.counters[key] = self.counters.get(key, 0) + value
+            self.changed = True
+
+    def set(self, name, value, labels = {}):
+
+        """Sets the gauge with the given name and labels."""
+
+        with self.lock:
+            key = self.key(name, labels)
+            if self.gauges.get(key) != value:
+                self.gauges[key] = value
+                self.changed = True
+
+    def observe(self, name, value, labels = {}, buckets = default_buckets):
+
+        """Records a value, usually a duration in seconds, in the histogram
+        with the given name and labels."""
+
+        with self.lock:
+            key = self.key(name, labels)
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = Histogram(buckets)
+            histogram.observe(value)
+            self.changed = True
+
+    def record_job(self, file_name, outcome, timings, label, **fields):
+
+        """Counts the input file with the given file_name under the given
+        outcome and adds the times in the timings dictionary, which maps the
+        names of stages to seconds, to histograms labelled with the stage and
+        the given label describing the format of the output files. The time
+        the file waited before being processed is given by the queue stage.
+        A log line describing the file is written with any additional fields
+        given."""
+
+        self.inc("jobs_total", {"outcome": outcome})
+
+        for stage, seconds in timings.items():
+            if stage == "queue":
+                self.observe("queue_seconds", seconds)
+            else:
+                self.observe("stage_seconds", seconds, {"stage": stage, "format": label})
+            fields[stage + "_seconds"] = round(seconds, 4)
+
+        self.log("job", file = file_name, outcome = outcome, format = label, **fields)
+
+    def render(self):
+
+        """Returns the metrics in the Prometheus text format."""
+
+        lines = []
+
+        with self.lock:
+            for values, kind in ((self.counters, "counter"),
+                                 (self.gauges, "gauge")):
+                declared = set()
+                for (name, labels), value in sorted(values.items()):
+                    if name not in declared:
+                        lines.append("# TYPE %s %s" % (name, kind))
+                        declared.add(name)
+                    lines.append("%s%s %r" % (name, format_labels(labels), value))
+
+            declared = set()
+            for (name, labels), histogram in sorted(self.histograms.items()):
+                if name not in declared:
+                    lines.append("# TYPE %s histogram" % name)
+                    declared.add(name)
+                for bound, count in zip(histogram.buckets, histogram.counts):
+                    bucket_labels = labels + (("le", repr(float(bound))),)
+                    lines.append("%s_bucket%s %i" % (name, format_labels(bucket_labels), count))
+                lines.append("%s_bucket%s %i" % (name, format_labels(labels + (("le", "+Inf"),)),
+                                                 histogram.count))
+                lines.append("%s_sum%s %r" % (name, format_labels(labels), histogram.sum))
+                lines.append("%s_count%s %i" % (name, format_labels(labels), histogram.count))
+
+        return "\n".join(lines) + "\n"
+
+    def flush(self):
+
+        """Writes the metrics to the metrics file if they have changed since
+        they were last written."""
+
+        if not self.file_name or not self.changed:
+            return
+
+        self.changed = False
+        temp_name = self.file_name + ".tmp"
+        f = open(temp_name, "w")
+        f.write(self.render())
+        f.close()
+        os.rename(temp_name, self.file_name)
+
+    def log(self, event, **fields):
+
+        """Writes a line of JSON describing an event with the given fields to
+        the log file."""
+
+        if not self.log_stream:
+            return
+
+        record = {"time": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+                  "event": event}
+        record.update(fields)
+        self.log_stream.write(json.dumps(record, sort_keys = True) + "\n")
+        self.log_stream.flush()
+
+    def serve(self, port, host = "localhost"):
+
+        """Starts a thread that serves the metrics over HTTP on the given port
+        and host."""
+
+        metrics = self
+
+        class Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+
+            def do_GET(self):
+
+                if self.path != "/metrics":
+                    self.send_error(404)
+                    return
+
+                text = metrics.render()
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4")
+                self.send_header("Content-Length", str(len(text)))
+                self.end_headers()
+                self.wfile.write(text)
+
+            def log_message(self, format, *args):
+                pass
+
+        server = BaseHTTPServer.HTTPServer((host, port), Handler)
+        thread = threading.Thread(target = server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        return server
+
+def output_format(outputs):
+
+    """Returns a label describing the format of the given output files."""
+
+    suffixes = set(map(lambda output: os.path.splitext(output)[1].lstrip(".").lower(),
+                       outputs))
+    if len(suffixes) == 1:
+        return suffixes.pop() or "none"
+    elif suffixes:
+        return "mixed"
+    return "none"
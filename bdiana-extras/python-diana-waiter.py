@@ -1,26 +1,494 @@
 #!/usr/bin/env python
 
-"""Usage: bdiana-waiter.py <input directory> <period> <setup file>
+"""Usage: python-diana-waiter.py [--workers=<number>] [--cache=<number>]
+                               [--cache-memory=<megabytes>] [--queue=<number>]
+                               [--spool] [--spool-keep=<days>]
+                               [--render-cache=<directory>]
+                               [--render-cache-size=<megabytes>]
+                               [--metrics=<file>] [--metrics-port=<port>]
+                               [--json-log=<file>]
+                               <input directory> <period> <setup file>
 
-Monitors the given input directory for new input files, waiting for the
-specified period (in seconds) before checking again. When new input files
-are found, runs the specified bdiana executable and setup file for each of
-the files. The input files are deleted after being processed.
+Monitors the given input directory for new input files, waiting for up to the
+specified period (in seconds) before checking again. Where inotify is
+available, the directory is checked as soon as a new input file is written to
+it or moved into it. When new input files are found, runs the specified bdiana
+executable and setup file for each of the files. The input files are deleted
+after being processed.
+
+Input files are processed in the order decided by the scheduler module, using
+their priority and deadline parameters, and files that are superseded by newer
+ones with the same output files are discarded. If the --queue option is given,
+at most that number of files are queued and a file called backpressure is
+created in the input directory while more are waiting. The plot time is given
+by the settime parameter if present; otherwise the last available time is
+used.
+
+If the --spool option is given, the input directory can be shared with other
+waiters, including ones on other hosts. Each input file is claimed by moving
+it into a processing directory for this waiter before it is queued, and it is
+moved into the done or failed directory afterwards instead of being deleted.
+Files claimed by waiters that have stopped are returned to the input
+directory. Files in the done and failed directories are removed after seven
+days, or after the number of days given by the --spool-keep option. See the
+spool module for details.
+
+If the --render-cache option is given, the output of each input file is kept
+in the given directory, and input files that would produce the same output as
+an earlier one are not plotted again. Instead, the cached files are linked or
+copied to the output file names. The cache holds up to 1024 megabytes of files
+unless another size is given with the --render-cache-size option. See the
+render_cache module for details.
+
+If an input file contains a times parameter with a comma-separated list of
+times, as written by cap2kml.py with the --frames option, the plot is prepared
+once and an image is plotted for each of the times in turn. The index of each
+frame is inserted before the suffix of the output file name.
+
+If the --workers option is given, the waiter supervises the given number of
+worker processes, each with its own BDiana object that reads the setup file
+once, and the input files are queued for the first available worker. If a
+worker process dies, another is started in its place and the input file it
+was processing is queued again. If the file causes a worker to die a second
+time, it is renamed with a .failed suffix instead.
+
+If the --cache option is given, up to the given number of BDiana objects are
+kept by the waiter, or by each worker, for input files with different field
+files, maps and areas. Input files that share these are plotted with the same
+BDiana object without opening the field files again. The least recently used
+objects are discarded if the resident memory of a process exceeds the number
+of megabytes given by the --cache-memory option.
+
+The waiter records the number of input files processed, cached and failed,
+the length of the queue, and histograms of the time each file waited before
+being processed and the time spent preparing, plotting and saving each plot,
+labelled with the format of the output files. If the --metrics option is
+given, these are written to the given file in the Prometheus text format
+whenever they change. If the --metrics-port option is given, they are served
+at http://localhost:<port>/metrics. If the --json-log option is given, a line
+of JSON describing each input file and its timings is appended to the given
+file. See the metrics module for details.
 """
 
-import commands, datetime, glob, os, sys, time
+import collections, datetime, getopt, multiprocessing, os, sys, time, traceback
+import bdiana_cache, metrics, render_cache, scheduler, spool, watcher
 from metno import bdiana
 
+# The interval in seconds between checks on the worker processes.
+poll_interval = 0.2
+
 def now():
     return time.strftime("%Y-%m-%d %H:%M:%S UTC", time.gmtime())
 
+def parse_times(text):
+
+    """Returns a list of datetime objects for the comma-separated times in the
+    given text."""
+
+    return map(lambda t: datetime.datetime.strptime(t.strip(), "%Y-%m-%dT%H:%M:%SZ"),
+               text.split(","))
+
+def plot_time(settime, times):
+
+    """Returns the plot time given by the settime parameter of an input file,
+    or the last of the available times if settime is None or cannot be read."""
+
+    if settime == "firsttime" and times:
+        return times[0]
+    elif settime == "nowtime":
+        return datetime.datetime.now()
+    elif settime and settime != "lasttime":
+        try:
+            return parse_times(settime)[0]
+        except ValueError:
+            pass
+
+    if times:
+        return times[-1]
+    else:
+        return datetime.datetime.now()
+
+def frame_path(output_path, i):
+
+    """Returns the output file name for the frame with the given index."""
+
+    stem, suffix = os.path.splitext(output_path)
+    return "%s-%i%s" % (stem, i, suffix)
+
+def add_time(timings, stage, started):
+
+    """Adds the time since started to the time spent in the given stage, if
+    the timings dictionary is not None."""
+
+    if timings is not None:
+        timings[stage] = timings.get(stage, 0) + time.time() - started
+
+def plot(b, width, height, output_path, timings = None):
+
+    started = time.time()
+
+    if output_path.endswith(".pdf"):
+        b.plotPDF(width, height, output_path)
+    elif output_path.endswith(".svg"):
+        b.plotSVG(width, height, output_path)
+    else:
+        image = b.plotImage(width, height)
+        add_time(timings, "plot", started)
+        started = time.time()
+        image.save(output_path)
+        add_time(timings, "save", started)
+        return
+
+    # PDF and SVG files are written while plotting.
+    add_time(timings, "plot", started)
+
+def process_file(b, file_name, prepared_name = None, timings = None):
+
+    """Plots the input file with the given file_name using the BDiana object,
+    b, preparing the plot from the file with the prepared_name if one is given.
+    Returns None if successful or a description of the problem if not. If a
+    timings dictionary is given, the times spent preparing, plotting and
+    saving are added to it."""
+
+    started = time.time()
+    input_file = bdiana.InputFile(prepared_name or file_name)
+    b.prepare(input_file)
+    add_time(timings, "prepare", started)
+
+    width, height = input_file.getBufferSize()
+    if "filename" in input_file.parameters:
+        output_path = input_file.parameters["filename"]
+    elif "FILENAME" in input_file.parameters:
+        output_path = input_file.parameters["FILENAME"]
+    else:
+        return "Discarded input file '%s' without an output file name." % file_name
+
+    if "times" in input_file.parameters:
+        # Plot each of the frames using the fields and drawings that were
+        # loaded when the plot was prepared.
+        try:
+            frame_times = parse_times(input_file.parameters["times"])
+        except ValueError:
+            return "Discarded input file '%s' with invalid times." % file_name
+
+        for i, frame_time in enumerate(frame_times):
+            b.setPlotTime(frame_time)
+            plot(b, width, height, frame_path(output_path, i), timings)
+    else:
+        settime = input_file.parameters.get("settime")
+        b.setPlotTime(plot_time(settime, b.getPlotTimes()))
+        plot(b, width, height, output_path, timings)
+
+    return None
+
+def run_job(cache, file_name, renders = None, timings = None):
+
+    """Plots the input file with the given file_name using a BDiana object
+    from the cache, returning the result of the process_file function. If the
+    render cache, renders, is not None, the output files are taken from it if
+    possible and stored in it after plotting. If a timings dictionary is given,
+    the time the file spent waiting since it was written and the times spent
+    in each stage of plotting are recorded in it, with the time spent taking
+    the output files from the render cache recorded as the fetch stage."""
+
+    if timings is not None:
+        timings["queue"] = max(0, time.time() - os.path.getmtime(file_name))
+
+    if renders:
+        started = time.time()
+        key, outputs, found = renders.lookup(file_name)
+        if found:
+            add_time(timings, "fetch", started)
+            return None
+
+    b, prepared_name = cache.lookup(file_name)
+    if b is None:
+        return "Failed to read the setup file '%s' for '%s'." % (cache.setup_file, file_name)
+
+    try:
+        error = process_file(b, file_name, prepared_name, timings)
+    finally:
+        if prepared_name != file_name:
+            os.remove(prepared_name)
+        cache.trim()
+
+    if renders and key and not error:
+        renders.store(key, outputs)
+
+    return error
+
+def record_job(stats, file_name, error, timings, label):
+
+    """Records the outcome and timings of the input file with the given
+    file_name in stats, where label describes the format of its output."""
+
+    if error:
+        outcome = "failed"
+    elif "fetch" in timings:
+        outcome = "cached"
+    else:
+        outcome = "processed"
+
+    stats.record_job(file_name, outcome, timings, label, error = error)
+
+def claim(claims, file_name):
+
+    """Claims the input file with the given file_name using the claims spool,
+    if it is not None, returning the name of the claimed file or None if
+    another waiter claimed it first."""
+
+    if claims:
+        return claims.claim(file_name)
+    return file_name
+
+def recover(claims):
+
+    if claims:
+        for file_name in claims.recover():
+            print "%s: Recovered input file '%s' from a stopped waiter." % (now(), file_name)
+
+def dispose(claims, file_name, success):
+
+    """Deletes the input file with the given file_name after it has been
+    processed or, if the claims spool is not None, moves it into the done or
+    failed directory of the spool, depending on whether it was successful."""
+
+    if claims:
+        if not claims.complete(file_name, success):
+            sys.stderr.write("%s: Input file '%s' was recovered by another waiter "
+                             "before it was finished.\n" % (now(), file_name))
+    else:
+        os.remove(file_name)
+
+# The exit status of a worker process that could not read the setup file.
+setup_failed = 2
+
+def worker(setup_file, connection, cache_size, memory_limit, renders):
+
+    """Reads the setup file, then plots each input file received from the
+    supervisor through the connection, sending back a (file name, error,
+    timings) tuple when each file is finished. The BDiana objects used are
+    held in a cache with the given size and memory limit, and the render cache,
+    renders, is used if it is not None."""
+
+    cache = bdiana_cache.BDianaCache(setup_file, cache_size, memory_limit)
+    if not cache.setup():
+        sys.exit(setup_failed)
+
+    while True:
+
+        try:
+            file_name = connection.recv()
+        except EOFError:
+            break
+
+        timings = {}
+
+        try:
+            error = run_job(cache, file_name, renders, timings)
+        except Exception:
+            error = "Failed to process '%s':\n%s" % (file_name, traceback.format_exc().rstrip())
+
+        connection.send((file_name, error, timings))
+
+class Supervisor:
+
+    """Runs a number of worker processes, sending each input file to an idle
+    worker through a pipe of its own and restarting any workers that die. The
+    outcome of each file is recorded in the stats object."""
+
+    def __init__(self, setup_file, workers, stats, cache_size = 0,
+                 memory_limit = None, claims = None, renders = None):
+
+        self.setup_file = setup_file
+        self.stats = stats
+        self.claims = claims
+        self.cache_size = cache_size
+        self.memory_limit = memory_limit
+        self.renders = renders
+
+        # The worker processes, the connections to them and the files they
+        # are processing, indexed by process ID. A file is recorded as being
+        # processed by a worker before it is sent, so that it is known even if
+        # the worker dies before reporting anything.
+        self.processes = {}
+        self.connections = {}
+        self.current = {}
+
+        # The files that have been queued but not finished, the files waiting
+        # to be sent to a worker, the number of times each file has been
+        # queued and the format of its output.
+        self.queued = set()
+        self.waiting = collections.deque()
+        self.attempts = {}
+        self.formats = {}
+
+        for i in range(workers):
+            self.start_worker()
+
+    def start_worker(self):
+
+        connection, worker_connection = multiprocessing.Pipe()
+        process = multiprocessing.Process(target = worker,
+            args = (self.setup_file, worker_connection, self.cache_size,
+                    self.memory_limit, self.renders))
+        process.daemon = True
+        process.start()
+
+        # Only the worker needs its end of the pipe.
+        worker_connection.close()
+        self.processes[process.pid] = process
+        self.connections[process.pid] = connection
+
+    def submit(self, file_name, label = "none"):
+
+        """Queues the input file with the given file_name unless it is already
+        queued. The label describes the format of its output files."""
+
+        if file_name not in self.queued:
+            self.queued.add(file_name)
+            self.attempts[file_name] = 1
+            self.formats[file_name] = label
+            self.waiting.append(file_name)
+            self.dispatch()
+
+    def dispatch(self):
+
+        """Sends the waiting files to the idle worker processes."""
+
+        for pid, connection in self.connections.items():
+
+            if not self.waiting:
+                break
+            elif pid in self.current:
+                continue
+
+            file_name = self.waiting.popleft()
+            self.current[pid] = file_name
+            try:
+                connection.send(file_name)
+            except (IOError, OSError):
+                # The worker has died, so leave the file for another one.
+                del self.current[pid]
+                self.waiting.appendleft(file_name)
+
+    def busy(self):
+        return len(self.queued) > 0
+
+    def idle(self):
+
+        """Returns the number of worker processes without a queued file."""
+
+        return max(0, len(self.processes) - len(self.queued))
+
+    def collect(self):
+
+        """Handles the results sent by the worker processes so far, then sends
+        waiting files to the workers that are idle."""
+
+        for pid in self.connections.keys():
+            self.receive(pid)
+
+        self.dispatch()
+
+    def receive(self, pid):
+
+        """Handles the results sent by the worker process with the given pid."""
+
+        connection = self.connections[pid]
+
+        while True:
+            try:
+                if not connection.poll():
+                    break
+                file_name, error, timings = connection.recv()
+            except (EOFError, IOError):
+                break
+
+            self.current.pop(pid, None)
+            record_job(self.stats, file_name, error, timings, self.formats[file_name])
+            self.finish(file_name)
+
+            if error:
+                sys.stderr.write("%s: %s\n" % (now(), error))
+            else:
+                print "%s: Processed input file '%s'." % (now(), file_name)
+
+            dispose(self.claims, file_name, not error)
+
+    def finish(self, file_name):
+
+        self.queued.discard(file_name)
+        del self.attempts[file_name]
+        del self.formats[file_name]
+
+    def check_workers(self):
+
+        """Replaces any worker processes that have died, queuing the files
+        they were processing again or recording them as failed."""
+
+        for pid, process in self.processes.items():
+
+            if process.is_alive():
+                continue
+
+            process.join()
+
+            if process.exitcode == setup_failed:
+                sys.stderr.write("Failed to parse the setup file '%s'.\n" % self.setup_file)
+                sys.exit(1)
+
+            sys.stderr.write("%s: Worker process %i exited with status %s.\n" % (
+                now(), pid, process.exitcode))
+            self.stats.inc("worker_restarts_total")
+            self.stats.log("worker_exit", pid = pid, status = process.exitcode)
+
+            # Handle any results the worker sent before it died.
+            self.receive(pid)
+            self.connections.pop(pid).close()
+            del self.processes[pid]
+            self.start_worker()
+
+            file_name = self.current.pop(pid, None)
+            if file_name is None:
+                continue
+
+            if self.attempts[file_name] == 1:
+                sys.stderr.write("%s: Queued input file '%s' again.\n" % (now(), file_name))
+                self.attempts[file_name] += 1
+                self.waiting.appendleft(file_name)
+            else:
+                sys.stderr.write("%s: Failed to process input file '%s'.\n" % (now(), file_name))
+                record_job(self.stats, file_name, "Worker process exited.", {},
+                           self.formats[file_name])
+                self.finish(file_name)
+                if self.claims:
+                    dispose(self.claims, file_name, False)
+                else:
+                    os.rename(file_name, file_name + ".failed")
+
+        self.dispatch()
+
 if __name__ == "__main__":
 
-    if len(sys.argv) != 4:
+    try:
+        opts, args = getopt.getopt(sys.argv[1:], "", ["workers=", "cache=",
+                                                      "cache-memory=", "queue=",
+                                                      "spool", "spool-keep=",
+                                                      "render-cache=",
+                                                      "render-cache-size=",
+                                                      "metrics=", "metrics-port=",
+                                                      "json-log="])
+    except getopt.GetoptError:
+        sys.stderr.write(__doc__)
+        sys.exit(1)
+
+    if len(args) != 3:
         sys.stderr.write(__doc__)
         sys.exit(1)
 
-    input_dir, period, setup_file = sys.argv[1:]
+    opts = dict(opts)
+    input_dir, period, setup_file = args
 
     if not os.path.exists(input_dir):
         try:
@@ -36,49 +504,136 @@ if __name__ == "__main__":
         sys.stderr.write("Please specify an integer period of time in seconds.\n")
         sys.exit(1)
 
-    b = bdiana.BDiana()
-    if not b.setup(setup_file):
+    if "--workers" in opts:
+        try:
+            workers = int(opts["--workers"])
+        except ValueError:
+            workers = 0
+        if workers < 1:
+            sys.stderr.write("Please specify at least one worker.\n")
+            sys.exit(1)
+    else:
+        workers = None
+
+    try:
+        cache_size = int(opts.get("--cache", 0))
+        if "--cache-memory" in opts:
+            memory_limit = int(opts["--cache-memory"]) * 1024 * 1024
+        else:
+            memory_limit = None
+        render_size = int(opts.get("--render-cache-size", 1024)) * 1024 * 1024
+        keep_time = int(opts.get("--spool-keep", 7)) * 24 * 3600
+        if "--metrics-port" in opts:
+            metrics_port = int(opts["--metrics-port"])
+        else:
+            metrics_port = None
+    except ValueError:
+        sys.stderr.write(__doc__)
+        sys.exit(1)
+
+    try:
+        if "--queue" in opts:
+            capacity = int(opts["--queue"])
+        else:
+            capacity = None
+    except ValueError:
+        capacity = 0
+
+    if cache_size < 0 or capacity is not None and capacity < 1 or keep_time < 0:
+        sys.stderr.write(__doc__)
+        sys.exit(1)
+
+    job_queue = scheduler.Scheduler(capacity, os.path.join(input_dir, "backpressure"))
+
+    if "--render-cache" in opts:
+        renders = render_cache.RenderCache(opts["--render-cache"], render_size,
+                                           setup_file)
+    else:
+        renders = None
+
+    if "--spool" in opts:
+        claims = spool.Spool(input_dir, keep_time = keep_time)
+        claims.start_heartbeat()
+    else:
+        claims = None
+
+    stats = metrics.Metrics("python_diana_waiter", opts.get("--metrics"),
+                            opts.get("--json-log"))
+    if metrics_port is not None:
+        stats.serve(metrics_port)
+
+    # Start watching before the first scan so that no new files are missed.
+    watch = watcher.watcher(input_dir, "*.input")
+
+    if workers:
+        supervisor = Supervisor(setup_file, workers, stats, cache_size,
+                                memory_limit, claims, renders)
+
+        while True:
+
+            supervisor.collect()
+            supervisor.check_workers()
+
+            recover(claims)
+            for message in job_queue.scan(input_dir, supervisor.queued):
+                print "%s: %s" % (now(), message)
+
+            # Only queue as many files as there are idle workers so that the
+            # scheduler can still reorder the rest.
+            for i in range(supervisor.idle()):
+                job = job_queue.pop()
+                if job is None:
+                    break
+                file_name = claim(claims, job.file_name)
+                if file_name:
+                    supervisor.submit(file_name, metrics.output_format(job.outputs))
+
+            stats.set("queue_length", len(job_queue.queue))
+            stats.set("backlog_length", job_queue.backlog)
+            stats.set("busy_workers", len(supervisor.current))
+            stats.flush()
+            sys.stdout.flush()
+
+            if supervisor.busy():
+                watch.wait(poll_interval)
+            else:
+                watch.wait(period)
+
+    cache = bdiana_cache.BDianaCache(setup_file, cache_size, memory_limit)
+    if not cache.setup():
         sys.stderr.write("Failed to parse the setup file '%s'.\n" % setup_file)
         sys.exit(1)
 
     while True:
 
-        files = glob.glob(os.path.join(input_dir, "*.input"))
-        if files:
-            print "%s: Found %i files." % (now(), len(files))
+        # Scan the input directory before each file so that new files can
+        # supersede queued ones or take priority over them.
+        recover(claims)
+        for message in job_queue.scan(input_dir):
+            print "%s: %s" % (now(), message)
 
-        for file_name in files:
+        stats.set("queue_length", len(job_queue.queue))
+        stats.set("backlog_length", job_queue.backlog)
+        stats.flush()
 
-            input_file = bdiana.InputFile(file_name)
-            b.prepare(input_file)
-            times = b.getPlotTimes()
-            if times:
-                b.setPlotTime(times[-1])
-            else:
-                b.setPlotTime(datetime.datetime.now())
+        job = job_queue.pop()
+        if job is None:
+            watch.wait(period)
+            continue
 
-            width, height = input_file.getBufferSize()
-            if "filename" in input_file.parameters:
-                output_path = input_file.parameters["filename"]
-            elif "FILENAME" in input_file.parameters:
-                output_path = input_file.parameters["FILENAME"]
-            else:
-                sys.stderr.write("%s: Discarded input file '%s' without an output file name.\n" % (now(), file_name))
-                os.remove(file_name)
-                continue
+        file_name = claim(claims, job.file_name)
+        if not file_name:
+            continue
 
-            if output_path.endswith(".pdf"):
-                b.plotPDF(width, height, output_path)
-            elif output_path.endswith(".svg"):
-                b.plotSVG(width, height, output_path)
-            else:
-                image = b.plotImage(width, height)
-                image.save(output_path)
-    
+        timings = {}
+        error = run_job(cache, file_name, renders, timings)
+        record_job(stats, file_name, error, timings, metrics.output_format(job.outputs))
+        if error:
+            sys.stderr.write("%s: %s\n" % (now(), error))
+        else:
             print "%s: Processed input file '%s'." % (now(), file_name)
 
-            os.remove(file_name)
-
-        time.sleep(period)
+        dispose(claims, file_name, not error)
+        sys.stdout.flush()
 
     sys.exit()
@@ -0,0 +1,402 @@
+"""Provides a cache of the images and documents produced by bdiana, so that the
+waiters do not run bdiana again for input files that would produce the same
+output as an earlier one.
+
+Each input file is identified by a hash of its contents, excluding comments,
+blank lines and the output file names given by its filename parameters, so
+that input files that only differ in the time recorded in a comment by the
+converters share an entry. The hash also includes the contents of the local
+files it refers to, such as the KML files used by DRAWING commands and the
+field files listed in its FIELD_FILES sections, and of the setup file used to
+plot it together with the files the setup file includes. Large files are
+identified by their names, sizes and modification times instead of their
+contents. Input files that refer to remote sources, that plot the current
+time, or that plot fields, observations or other data from sources defined by
+the setup file rather than in their own FIELD_FILES sections, are never cached
+since their output may change without the input file changing.
+
+When a cached entry is found, its files are hard linked to the output file
+names, or copied if a link cannot be made. The least recently used entries are
+removed when the total size of the cache exceeds its limit.
+"""
+
+import glob, hashlib, os, shutil, tempfile
+
+# Files larger than this are identified without reading their contents.
+max_hashed_size = 16 * 1024 * 1024
+
+def output_files(file_name):
+
+    """Returns a list of the output file names given by the filename
+    parameters in the input file with the given file_name. If the file also
+    contains a times parameter, the name of each frame is returned instead, as
+    used by python-diana-waiter.py."""
+
+    outputs = []
+    times = 0
+
+    for line in open(file_name):
+
+        line = line.strip()
+        key, sep, value = line.partition("=")
+        key = key.strip().lower()
+
+        if key == "filename":
+            outputs.append(value.strip())
+        elif key == "times":
+            times = len(value.split(","))
+
+    if times:
+        frames = []
+        for output in outputs:
+            stem, suffix = os.path.splitext(output)
+            for i in range(times):
+                frames.append("%s-%i%s" % (stem, i, suffix))
+        return frames
+
+    return outputs
+
+# Commands that plot data whose sources are always defined by the setup file.
+setup_source_commands = ("OBS", "SAT", "OBJECTS", "EDITFIELD")
+
+def referenced_files(text, setup_file = None):
+
+    """Returns a list of the local files referred to by the given input file
+    text, including the setup file it uses, or None if the text refers to
+    remote sources, to the current time, or to data sources defined by the
+    setup file. The setupfile parameter in the text takes precedence over the
+    given setup_file."""
+
+    files = []
+    in_field_files = False
+    models = set()
+    used_models = set()
+
+    for line in text.split("\n"):
+
+        words = line.split()
+        upper = " ".join(words).upper()
+
+        if upper == "<FIELD_FILES>":
+            in_field_files = True
+            continue
+        elif upper == "</FIELD_FILES>":
+            in_field_files = False
+            continue
+        elif upper.startswith("#"):
+            continue
+
+        command = upper.split(" ", 1)[0]
+        if not in_field_files and command in setup_source_commands:
+            return None
+        elif not in_field_files and command == "FIELD":
+            # Fields from models that are not listed in the FIELD_FILES
+            # sections are read from the sources given by the setup file,
+            # which may change without the input file changing.
+            line_models = []
+            for word in words:
+                key, sep, value = word.partition("=")
+                if key.lower() == "model":
+                    line_models.append(value.strip('"'))
+            if not line_models:
+                return None
+            used_models.update(line_models)
+            continue
+
+        for word in words:
+
+            key, sep, value = word.partition("=")
+            if not sep:
+                continue
+
+            if key.lower() == "settime" and value.lower() == "nowtime":
+                return None
+
+            if key.lower() == "setupfile":
+                setup_file = value.strip('"')
+            elif in_field_files and key.lower() == "m":
+                models.add(value.strip('"'))
+            elif in_field_files or key.lower() == "file":
+                value = value.strip('"')
+                if "://" in value:
+                    return None
+                files += sorted(glob.glob(value))
+
+    if not used_models.issubset(models):
+        return None
+
+    if setup_file:
+        files += setup_files(setup_file)
+
+    return files
+
+def setup_files(path, seen = None):
+
+    """Returns a list containing the name of the setup file with the given path
+    followed by the names of the files it includes."""
+
+    if seen is None:
+        seen = set()
+    elif path in seen:
+        return []
+
+    seen.add(path)
+    files = [path]
+
+    try:
+        lines = open(path).readlines()
+    except IOError:
+        # The missing file is reported when the key is made.
+        return files
+
+    for line in lines:
+        words = line.split()
+        if len(words) == 2 and words[0] == "%include":
+            files += setup_files(words[1].strip('"'), seen)
+
+    return files
+
+def file_identity(path):
+
+    """Returns a string that changes whenever the contents of the file with the
+    given path change."""
+
+    s = os.stat(path)
+    if s.st_size > max_hashed_size:
+        return "%s %i %r" % (path, s.st_size, s.st_mtime)
+
+    h = hashlib.sha1()
+    f = open(path, "rb")
+    while True:
+        data = f.read(65536)
+        if not data:
+            break
+        h.update(data)
+    f.close()
+
+    return "%s %s" % (path, h.hexdigest())
+
+def entry_file(entry, i, output):
+
+    """Returns the name of the file in the cache entry for the output file with
+    the given index and name."""
+
+    return os.path.join(entry, "%i%s" % (i, os.path.splitext(output)[1]))
+
+class RenderCache:
+
+    """Stores output files in the given directory, keeping the total size of
+    the stored files within the given size limit in bytes. The setup_file is
+    the setup file used for input files without a setupfile parameter."""
+
+    def __init__(self, directory, size_limit, setup_file = None):
+
+        self.directory = directory
+        self.size_limit = size_limit
+        self.setup_file = setup_file
+
+        if not os.path.exists(directory):
+            os.makedirs(directory)
+
+        # The devices and inodes of the files in the cache entries, read when
+        # they are first needed.
+        self.inodes = None
+
+    def lookup(self, file_name):
+
+        """Looks up the input file with the given file_name, creating its output
+        files from the cache if possible. Returns a tuple containing the key
+        for the file, or None if its output cannot be cached, its output file
+        names, and True if the output files were created or False if bdiana
+        needs to be run to create them."""
+
+        outputs = output_files(file_name)
+        key = self.key(file_name, outputs)
+
+        if key is not None and self.fetch(key, outputs):
+            return key, outputs, True
+
+        self.break_links(outputs)
+        return key, outputs, False
+
+    def break_links(self, outputs):
+
+        """Removes any of the given output files that are hard links to files
+        in the cache entries, so that writing new output to them does not
+        change the cache. Links to other files are left alone."""
+
+        for output in outputs:
+            try:
+                s = os.stat(output)
+            except OSError:
+                continue
+
+            if s.st_nlink > 1 and self.is_cached(s):
+                try:
+                    os.remove(output)
+                except OSError:
+                    pass
+
+    def is_cached(self, s):
+
+        """Returns True if the file with the given stat result is a file in one
+        of the cache entries."""
+
+        inode = (s.st_dev, s.st_ino)
+
+        # Other waiters may have stored entries since the inodes were read, so
+        # read them again before deciding that the file is not in the cache.
+        if self.inodes is None or inode not in self.inodes:
+            self.inodes = self.cached_inodes()
+
+        return inode in self.inodes
+
+    def cached_inodes(self):
+
+        """Returns a set containing the devices and inodes of the files in the
+        cache entries."""
+
+        inodes = set()
+
+        for name in os.listdir(self.directory):
+
+            path = os.path.join(self.directory, name)
+            if name.endswith(".tmp"):
+                continue
+
+            try:
+                for file_name in os.listdir(path):
+                    s = os.stat(os.path.join(path, file_name))
+                    inodes.add((s.st_dev, s.st_ino))
+            except OSError:
+                continue
+
+        return inodes
+
+    def key(self, file_name, outputs):
+
+        """Returns the key for the input file with the given file_name and
+        output files, or None if the output of the file cannot be cached."""
+
+        text = open(file_name).read()
+
+        files = referenced_files(text, self.setup_file)
+        if files is None:
+            return None
+
+        # The output files are excluded from the key, but their formats depend
+        # on their suffixes.
+        suffixes = map(lambda output: os.path.splitext(output)[1], outputs)
+        h = hashlib.sha1()
+        h.update(" ".join(suffixes) + "\n")
+
+        for line in text.split("\n"):
+            stripped = line.strip()
+            if not stripped or stripped.startswith("#") or \
+               stripped.lower().startswith("filename"):
+                continue
+            h.update(line + "\n")
+
+        for path in files:
+            try:
+                h.update(file_identity(path) + "\n")
+            except (IOError, OSError):
+                return None
+
+        return h.hexdigest()
+
+    def fetch(self, key, outputs):
+
+        """Creates the given output files from the entry with the given key,
+        returning True if the entry was found and False otherwise."""
+
+        entry = os.path.join(self.directory, key)
+        cached = []
+        for i, output in enumerate(outputs):
+            cached.append(entry_file(entry, i, output))
+
+        if not outputs or not all(map(os.path.exists, cached)):
+            return False
+
+        for source, output in zip(cached, outputs):
+
+            # Link or copy each file to a temporary name in the destination
+            # directory, then rename it so that readers never see a partial
+            # file.
+            temp_name = output + ".tmp"
+            try:
+                os.remove(temp_name)
+            except OSError:
+                pass
+
+            try:
+                os.link(source, temp_name)
+            except OSError:
+                try:
+                    shutil.copyfile(source, temp_name)
+                except (IOError, OSError):
+                    return False
+
+            os.rename(temp_name, output)
+
+        # Record the use of the entry for eviction.
+        try:
+            os.utime(entry, None)
+        except OSError:
+            pass
+
+        return True
+
+    def store(self, key, outputs):
+
+        """Stores copies of the given output files in an entry with the given
+        key, then removes old entries if the cache is too large."""
+
+        entry = os.path.join(self.directory, key)
+        if os.path.exists(entry) or not outputs:
+            return
+
+        temp_dir = tempfile.mkdtemp(".tmp", "", self.directory)
+        try:
+            for i, output in enumerate(outputs):
+                shutil.copyfile(output, entry_file(temp_dir, i, output))
+            os.rename(temp_dir, entry)
+        except (IOError, OSError):
+            # Either an output file is missing or another process stored the
+            # same entry first.
+            shutil.rmtree(temp_dir, True)
+            return
+
+        self.evict()
+
+    def evict(self):
+
+        """Removes the least recently used entries until the total size of the
+        cache is within its size limit."""
+
+        entries = []
+        total = 0
+
+        for name in os.listdir(self.directory):
+
+            path = os.path.join(self.directory, name)
+            if name.endswith(".tmp"):
+                continue
+
+            try:
+                size = 0
+                for file_name in os.listdir(path):
+                    size += os.path.getsize(os.path.join(path, file_name))
+                entries.append((os.path.getmtime(path), size, path))
+            except OSError:
+                continue
+
+            total += size
+
+        entries.sort()
+
+        while entries and total > self.size_limit:
+            used, size, path = entries.pop(0)
+            shutil.rmtree(path, True)
+            total -= size
+            self.inodes = None
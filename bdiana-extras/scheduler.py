@@ -0,0 +1,244 @@
+"""Provides a scheduler that decides the order in which the waiters process
+their input files.
+
+Each input file is read to find the output file names given by its filename
+parameters, its plot time given by a settime parameter, and the optional
+priority and deadline parameters. The priority is an integer, with higher
+priorities processed first, and the deadline is a time in the form
+YYYY-MM-DDThh:mm:ssZ. Files with the same priority are processed in order of
+their deadlines, then in the order in which they arrived.
+
+When several queued files produce the same output files, only the newest one
+is kept and the others are reported as superseded so that they can be
+discarded. The queue holds at most the given number of files. Files that do
+not fit in the queue are left in the input directory until there is room, and
+a marker file is created in the directory while this is the case so that the
+programs writing input files can see that the waiter is falling behind. The
+marker file contains the number of files waiting, which is updated whenever it
+changes.
+"""
+
+import calendar, glob, os, time
+
+def read_parameters(file_name):
+
+    """Returns a dictionary mapping the lower case names of the parameters
+    outside the PLOT and FIELD_FILES sections of the given input file to lists
+    of their values."""
+
+    parameters = {}
+    section = None
+
+    for line in open(file_name):
+
+        line = line.strip()
+        upper = line.upper()
+
+        if line.startswith("#"):
+            continue
+        elif section:
+            if upper == section:
+                section = None
+        elif upper == "PLOT":
+            section = "ENDPLOT"
+        elif upper == "<FIELD_FILES>":
+            section = "</FIELD_FILES>"
+        elif "=" in line:
+            key, value = line.split("=", 1)
+            parameters.setdefault(key.strip().lower(), []).append(value.strip())
+
+    return parameters
+
+def parse_time(text):
+
+    """Returns the number of seconds since the epoch for the given time in the
+    form YYYY-MM-DDThh:mm:ssZ, or None if the time cannot be read."""
+
+    try:
+        return calendar.timegm(time.strptime(text, "%Y-%m-%dT%H:%M:%SZ"))
+    except ValueError:
+        return None
+
+class Job:
+
+    """Describes an input file waiting to be processed."""
+
+    def __init__(self, file_name):
+
+        self.file_name = file_name
+        self.mtime = os.stat(file_name).st_mtime
+
+        parameters = read_parameters(file_name)
+        self.outputs = tuple(parameters.get("filename", ()))
+        self.settime = parameters.get("settime", [None])[0]
+
+        try:
+            self.priority = int(parameters.get("priority", [0])[0])
+        except ValueError:
+            self.priority = 0
+
+        self.deadline = parse_time(parameters.get("deadline", [""])[0])
+
+        # Files with the same setup file that set the same parameters can be
+        # processed together without the parameters of one affecting another.
+        self.group = (parameters.get("setupfile", [None])[0],
+                      tuple(sorted(parameters.keys())))
+
+    def order(self):
+
+        """Returns a value used to sort jobs into the order in which they
+        should be processed."""
+
+        return (-self.priority, self.deadline is None, self.deadline,
+                self.mtime, self.file_name)
+
+    def age(self):
+
+        """Returns a value used to find the newest of several jobs."""
+
+        return (self.mtime, self.file_name)
+
+class Scheduler:
+
+    """Maintains a queue of jobs holding up to the given capacity, or with no
+    limit if capacity is None. If a marker file name is given, the file is
+    created while there are more jobs than the queue can hold."""
+
+    def __init__(self, capacity = None, marker = None):
+
+        self.capacity = capacity
+        self.marker = marker
+        self.queue = []
+        self.backlog = 0
+
+        # The backlog last written to the marker file.
+        self.marker_backlog = 0
+
+        # The jobs for all the input files seen in the last update, including
+        # those that did not fit in the queue, indexed by file name, so that
+        # each file is only read again if it is modified.
+        self.jobs = {}
+
+    def update(self, file_names):
+
+        """Updates the queue to hold the jobs for the given input files, which
+        should exclude any that are being processed. Returns a list of
+        (superseded job, newer job) tuples for the jobs that are no longer
+        needed, which the caller should discard."""
+
+        known = self.jobs
+        self.jobs = {}
+
+        jobs = []
+        for file_name in file_names:
+            job = known.get(file_name)
+            try:
+                if job is None or job.mtime != os.stat(file_name).st_mtime:
+                    job = Job(file_name)
+            except (IOError, OSError):
+                # The file was removed before it could be read.
+                continue
+            jobs.append(job)
+            self.jobs[file_name] = job
+
+        # Keep only the newest job for each set of output files.
+        newest = {}
+        for job in jobs:
+            if job.outputs:
+                other = newest.get(job.outputs)
+                if other is None or job.age() > other.age():
+                    newest[job.outputs] = job
+
+        superseded = []
+        queue = []
+        for job in jobs:
+            if job.outputs and newest[job.outputs] is not job:
+                superseded.append((job, newest[job.outputs]))
+            else:
+                queue.append(job)
+
+        queue.sort(key = lambda job: job.order())
+
+        if self.capacity is not None and len(queue) > self.capacity:
+            self.backlog = len(queue) - self.capacity
+            self.queue = queue[:self.capacity]
+        else:
+            self.backlog = 0
+            self.queue = queue
+
+        self.update_marker()
+        return superseded
+
+    def scan(self, input_dir, busy = ()):
+
+        """Updates the queue with the input files in the given input directory,
+        excluding the busy files that are already being processed. Superseded
+        files are removed. Returns a list of messages describing the files
+        removed and any change in the backlog."""
+
+        file_names = glob.glob(os.path.join(input_dir, "*.input"))
+        file_names = filter(lambda file_name: file_name not in busy, file_names)
+
+        had_backlog = self.backlog
+        messages = []
+
+        for job, newer in self.update(file_names):
+            messages.append("Discarded input file '%s' superseded by '%s'." % (
+                            job.file_name, newer.file_name))
+            try:
+                os.remove(job.file_name)
+            except OSError:
+                pass
+
+        if self.backlog and not had_backlog:
+            messages.append("Queue is full with %i more input files waiting." % self.backlog)
+        elif had_backlog and not self.backlog:
+            messages.append("Queue has room for all input files again.")
+
+        return messages
+
+    def update_marker(self):
+
+        if not self.marker:
+            return
+
+        if self.backlog:
+            if self.backlog != self.marker_backlog or not os.path.exists(self.marker):
+                # Replace the file in one step so that readers never see it
+                # empty.
+                temp_name = self.marker + ".tmp"
+                open(temp_name, "w").write("%i\n" % self.backlog)
+                os.rename(temp_name, self.marker)
+                self.marker_backlog = self.backlog
+        else:
+            self.marker_backlog = 0
+            if os.path.exists(self.marker):
+                os.remove(self.marker)
+
+    def pop_group(self, size):
+
+        """Removes the first job from the queue together with up to size - 1
+        other jobs in the same group, returning a list of the jobs removed."""
+
+        jobs = []
+        if not self.queue:
+            return jobs
+
+        group = self.queue[0].group
+        for job in self.queue[:]:
+            if len(jobs) == size:
+                break
+            if job.group == group:
+                self.queue.remove(job)
+                jobs.append(job)
+
+        return jobs
+
+    def pop(self):
+
+        """Removes the first job from the queue and returns it, or returns None
+        if the queue is empty."""
+
+        if self.queue:
+            return self.queue.pop(0)
+        return None
@@ -0,0 +1,208 @@
+"""Provides a way for several waiters, possibly on different hosts, to share an
+input directory without processing the same input file twice.
+
+Before processing an input file, a waiter claims it by renaming it into its
+own directory inside the processing directory of the spool, which is named
+after the host and process ID of the waiter. Renaming is atomic, so only one
+waiter can claim each file. Once processed, the file is moved into the done
+or failed directory of the spool.
+
+Each waiter updates a heartbeat file next to its processing directory while it
+runs. If the heartbeat of another waiter is older than the lease time, or if
+the other waiter ran on the same host and its process no longer exists, the
+files it claimed are moved back into the input directory to be processed
+again. The hosts sharing a spool should have synchronised clocks. If a waiter
+is only slow rather than stopped, the files it claimed may be recovered while
+it is still processing them, in which case the other waiter processes them
+again and the slow waiter is told that it no longer holds them when it tries
+to complete them.
+
+Files in the done and failed directories are removed once they are older than
+the keep time, which defaults to a week, by any waiter sharing the spool.
+"""
+
+import errno, os, socket, threading, time
+
+class Spool:
+
+    """Claims input files in the given input directory on behalf of the
+    current process, recovering the files claimed by processes whose leases
+    have expired after the given lease time in seconds. Completed files are
+    kept for the given keep time in seconds, or indefinitely if it is None."""
+
+    def __init__(self, input_dir, lease_time = 300, keep_time = 7 * 24 * 3600):
+
+        self.input_dir = input_dir
+        self.lease_time = lease_time
+        self.keep_time = keep_time
+        self.host = socket.gethostname()
+        self.name = "%s-%i" % (self.host, os.getpid())
+
+        self.processing_root = os.path.join(input_dir, "processing")
+        self.processing_dir = os.path.join(self.processing_root, self.name)
+        self.heartbeat_file = self.processing_dir + ".heartbeat"
+        self.done_dir = os.path.join(input_dir, "done")
+        self.failed_dir = os.path.join(input_dir, "failed")
+
+        # Create the heartbeat file before the processing directory so that
+        # other processes never see the directory without a heartbeat.
+        make_directory(self.processing_root)
+        self.heartbeat()
+
+        for path in (self.processing_dir, self.done_dir, self.failed_dir):
+            make_directory(path)
+
+        self.last_recovery = 0
+
+    def heartbeat(self):
+
+        """Updates the heartbeat file to show that this process is alive."""
+
+        open(self.heartbeat_file, "a").close()
+        os.utime(self.heartbeat_file, None)
+
+    def start_heartbeat(self):
+
+        """Starts a thread that updates the heartbeat file regularly, even while
+        a long job is being processed."""
+
+        def beat():
+            while True:
+                time.sleep(self.lease_time / 4.0)
+                try:
+                    self.heartbeat()
+                except (IOError, OSError):
+                    pass
+
+        thread = threading.Thread(target = beat)
+        thread.daemon = True
+        thread.start()
+
+    def claim(self, file_name):
+
+        """Claims the input file with the given file_name, returning the name of
+        the claimed file, or None if another process claimed it first."""
+
+        claimed = os.path.join(self.processing_dir, os.path.basename(file_name))
+        try:
+            os.rename(file_name, claimed)
+        except OSError, e:
+            if e.errno != errno.ENOENT:
+                raise
+            if os.path.isdir(self.processing_dir):
+                return None
+
+            # Another process decided that this one had stopped and removed
+            # its processing directory, so create it again.
+            self.heartbeat()
+            make_directory(self.processing_dir)
+            return self.claim(file_name)
+
+        return claimed
+
+    def complete(self, claimed, success = True):
+
+        """Moves the claimed file into the done directory if success is True,
+        or into the failed directory if not. Returns True if the file was
+        moved, or False if it was no longer claimed by this process because
+        another process recovered it."""
+
+        if success:
+            directory = self.done_dir
+        else:
+            directory = self.failed_dir
+
+        try:
+            os.rename(claimed, os.path.join(directory, os.path.basename(claimed)))
+        except OSError, e:
+            if e.errno != errno.ENOENT:
+                raise
+            return False
+
+        return True
+
+    def stale(self, name):
+
+        """Returns True if the lease of the process with the given processing
+        directory name has expired."""
+
+        host, pid = name.rsplit("-", 1)
+        if host == self.host:
+            try:
+                os.kill(int(pid), 0)
+            except ValueError:
+                pass
+            except OSError, e:
+                if e.errno == errno.ESRCH:
+                    return True
+
+        heartbeat_file = os.path.join(self.processing_root, name + ".heartbeat")
+        try:
+            return os.stat(heartbeat_file).st_mtime < time.time() - self.lease_time
+        except OSError:
+            return True
+
+    def recover(self):
+
+        """Moves the files claimed by processes with expired leases back into
+        the input directory, returning a list of their names, and removes old
+        completed files. Checks for expired leases at most four times in each
+        lease time."""
+
+        if time.time() - self.last_recovery < self.lease_time / 4.0:
+            return []
+
+        self.last_recovery = time.time()
+        recovered = []
+
+        for name in os.listdir(self.processing_root):
+
+            path = os.path.join(self.processing_root, name)
+            if name == self.name or not os.path.isdir(path) or not self.stale(name):
+                continue
+
+            for file_name in os.listdir(path):
+                destination = os.path.join(self.input_dir, file_name)
+                try:
+                    os.rename(os.path.join(path, file_name), destination)
+                except OSError:
+                    # Another process recovered the file first.
+                    continue
+                recovered.append(destination)
+
+            try:
+                os.rmdir(path)
+                os.remove(path + ".heartbeat")
+            except OSError:
+                pass
+
+        self.prune()
+        return recovered
+
+    def prune(self):
+
+        """Removes the files in the done and failed directories that are older
+        than the keep time."""
+
+        if self.keep_time is None:
+            return
+
+        oldest = time.time() - self.keep_time
+
+        for directory in (self.done_dir, self.failed_dir):
+            for name in os.listdir(directory):
+                path = os.path.join(directory, name)
+                try:
+                    if os.path.getmtime(path) < oldest:
+                        os.remove(path)
+                except OSError:
+                    # Another process removed the file first.
+                    pass
+
+def make_directory(path):
+
+    try:
+        os.makedirs(path)
+    except OSError, e:
+        if e.errno != errno.EEXIST:
+            raise
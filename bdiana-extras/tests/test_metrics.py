@@ -0,0 +1,83 @@
+"""Tests for the metrics module."""
+
+import json, os, shutil, sys, tempfile, unittest
+
+sys.path.insert(1, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+import metrics
+
+class MetricsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.work_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.work_dir, True)
+
+    def test_counters_and_gauges(self):
+
+        stats = metrics.Metrics("test")
+        stats.inc("jobs_total", {"outcome": "processed"})
+        stats.inc("jobs_total", {"outcome": "processed"})
+        stats.inc("jobs_total", {"outcome": "failed"})
+        stats.set("busy_workers", 3)
+        stats.set("queue_length", 0, {"name": 'a "quoted"\nname'})
+
+        self.assertEqual(stats.render(),
+            '# TYPE test_jobs_total counter\n'
+            'test_jobs_total{outcome="failed"} 1\n'
+            'test_jobs_total{outcome="processed"} 2\n'
+            '# TYPE test_busy_workers gauge\n'
+            'test_busy_workers 3\n'
+            '# TYPE test_queue_length gauge\n'
+            'test_queue_length{name="a \\"quoted\\"\\nname"} 0\n')
+
+    def test_histogram_buckets_are_cumulative(self):
+
+        stats = metrics.Metrics("test")
+        for value in (0.5, 1.5, 2, 7):
+            stats.observe("run_seconds", value, {"format": "png"}, (1, 2, 5))
+
+        self.assertEqual(stats.render(),
+            '# TYPE test_run_seconds histogram\n'
+            'test_run_seconds_bucket{format="png",le="1.0"} 1\n'
+            'test_run_seconds_bucket{format="png",le="2.0"} 3\n'
+            'test_run_seconds_bucket{format="png",le="5.0"} 3\n'
+            'test_run_seconds_bucket{format="png",le="+Inf"} 4\n'
+            'test_run_seconds_sum{format="png"} 11.0\n'
+            'test_run_seconds_count{format="png"} 4\n')
+
+    def test_record_job(self):
+
+        log_file = os.path.join(self.work_dir, "jobs.log")
+        stats = metrics.Metrics("test", log_file = log_file)
+        stats.record_job("a.input", "processed", {"queue": 0.02, "run": 3.0}, "png",
+                         status = 0)
+
+        lines = stats.render().split("\n")
+        self.assertTrue('test_jobs_total{outcome="processed"} 1' in lines)
+        self.assertTrue('test_queue_seconds_bucket{le="0.05"} 1' in lines)
+        self.assertTrue('test_queue_seconds_count 1' in lines)
+        self.assertTrue('test_stage_seconds_bucket{format="png",stage="run",le="2.5"} 0' in lines)
+        self.assertTrue('test_stage_seconds_bucket{format="png",stage="run",le="5.0"} 1' in lines)
+
+        record = json.loads(open(log_file).read())
+        self.assertEqual(record["event"], "job")
+        self.assertEqual(record["file"], "a.input")
+        self.assertEqual(record["outcome"], "processed")
+        self.assertEqual(record["format"], "png")
+        self.assertEqual(record["run_seconds"], 3.0)
+        self.assertEqual(record["status"], 0)
+
+    def test_flush_writes_changed_metrics(self):
+
+        file_name = os.path.join(self.work_dir, "waiter.prom")
+        stats = metrics.Metrics("test", file_name)
+        stats.flush()
+        self.assertFalse(os.path.exists(file_name))
+
+        stats.set("busy_workers", 1)
+        stats.flush()
+        self.assertEqual(open(file_name).read(), stats.render())
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,164 @@
+"""Tests for the render_cache module."""
+
+import os, shutil, sys, tempfile, unittest
+
+sys.path.insert(1, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+import render_cache
+
+input_text = """\
+# Created by cap2kml.py at %s
+PLOTTYPE=fixed
+filename=%s
+
+AREA proj4string="+proj=longlat" rectangle=0:10:50:60
+DRAWING file=%s
+PLOT
+"""
+
+class RenderCacheTest(unittest.TestCase):
+
+    def setUp(self):
+
+        self.work_dir = tempfile.mkdtemp()
+        self.setup_file = self.write_file("diana.setup", "[COLOURS]\nred=255:0:0\n")
+        self.cache = render_cache.RenderCache(os.path.join(self.work_dir, "cache"),
+                                              1024 * 1024, self.setup_file)
+        self.kml_file = self.write_file("drawing.kml", "<kml/>")
+
+    def tearDown(self):
+        shutil.rmtree(self.work_dir, True)
+
+    def write_file(self, name, text):
+
+        path = os.path.join(self.work_dir, name)
+        f = open(path, "w")
+        f.write(text)
+        f.close()
+        return path
+
+    def write_input(self, name, created, output):
+
+        return self.write_file(name, input_text % (created, output, self.kml_file))
+
+    def key(self, file_name):
+        return self.cache.key(file_name, render_cache.output_files(file_name))
+
+    def test_key_ignores_comments_and_output_names(self):
+
+        first = self.write_input("first.input", "2015-01-01 12:00:00",
+                                 os.path.join(self.work_dir, "first.png"))
+        second = self.write_input("second.input", "2015-01-02 13:30:00",
+                                  os.path.join(self.work_dir, "second.png"))
+
+        self.assertNotEqual(self.key(first), None)
+        self.assertEqual(self.key(first), self.key(second))
+
+    def test_key_depends_on_output_format(self):
+
+        first = self.write_input("first.input", "2015-01-01 12:00:00",
+                                 os.path.join(self.work_dir, "first.png"))
+        second = self.write_input("second.input", "2015-01-01 12:00:00",
+                                  os.path.join(self.work_dir, "second.svg"))
+
+        self.assertNotEqual(self.key(first), self.key(second))
+
+    def test_key_depends_on_referenced_files(self):
+
+        file_name = self.write_input("first.input", "2015-01-01 12:00:00",
+                                     os.path.join(self.work_dir, "first.png"))
+        before = self.key(file_name)
+        self.write_file("drawing.kml", "<kml><Document/></kml>")
+
+        self.assertNotEqual(self.key(file_name), before)
+
+    def test_key_depends_on_setup_file(self):
+
+        file_name = self.write_input("first.input", "2015-01-01 12:00:00",
+                                     os.path.join(self.work_dir, "first.png"))
+        before = self.key(file_name)
+
+        self.write_file("diana.setup", "[COLOURS]\nred=250:0:0\n")
+        changed = self.key(file_name)
+        self.assertNotEqual(changed, before)
+
+        # Files included by the setup file are also part of the key.
+        self.write_file("maps.setup", "[MAP_TYPE]\n")
+        self.write_file("diana.setup", "[COLOURS]\nred=250:0:0\n%%include %s\n" %
+                        os.path.join(self.work_dir, "maps.setup"))
+        included = self.key(file_name)
+        self.write_file("maps.setup", "[MAP_TYPE]\nmap=Gshhs-Auto\n")
+        self.assertNotEqual(self.key(file_name), included)
+
+    def test_setupfile_parameter_replaces_setup_file(self):
+
+        other = self.write_file("other.setup", "[COLOURS]\n")
+        file_name = self.write_file("setup.input",
+            "setupfile=%s\nfilename=out.png\nDRAWING file=%s\nPLOT\n" % (other, self.kml_file))
+        before = self.key(file_name)
+
+        self.write_file("diana.setup", "[COLOURS]\nblue=0:0:255\n")
+        self.assertEqual(self.key(file_name), before)
+        self.write_file("other.setup", "[COLOURS]\nblue=0:0:255\n")
+        self.assertNotEqual(self.key(file_name), before)
+
+    def test_fields_from_setup_sources_are_not_cached(self):
+
+        field_file = self.write_file("model.nc", "data")
+        field = "FIELD model=MODEL plot=T.2M colour=black\n"
+
+        file_name = self.write_file("setup-source.input",
+            "filename=out.png\nPLOT\n%sENDPLOT\n" % field)
+        self.assertEqual(self.key(file_name), None)
+
+        file_name = self.write_file("field-files.input",
+            "filename=out.png\n<FIELD_FILES>\nm=MODEL f=%s format=netcdf\n"
+            "</FIELD_FILES>\nPLOT\n%sENDPLOT\n" % (field_file, field))
+        self.assertNotEqual(self.key(file_name), None)
+
+        file_name = self.write_file("obs.input",
+            "filename=out.png\nPLOT\nOBS plot=Synop data=Synop\nENDPLOT\n")
+        self.assertEqual(self.key(file_name), None)
+
+    def test_remote_sources_are_not_cached(self):
+
+        file_name = self.write_file("remote.input",
+            "filename=out.png\nDRAWING file=http://example.com/a.kml\nPLOT\n")
+        self.assertEqual(self.key(file_name), None)
+
+    def test_lookup_links_cached_outputs(self):
+
+        output = os.path.join(self.work_dir, "first.png")
+        file_name = self.write_input("first.input", "2015-01-01 12:00:00", output)
+
+        key, outputs, found = self.cache.lookup(file_name)
+        self.assertFalse(found)
+
+        self.write_file("first.png", "image")
+        self.cache.store(key, outputs)
+        os.remove(output)
+
+        key, outputs, found = self.cache.lookup(file_name)
+        self.assertTrue(found)
+        self.assertEqual(open(output).read(), "image")
+
+    def test_break_links_only_removes_cached_files(self):
+
+        output = os.path.join(self.work_dir, "first.png")
+        file_name = self.write_input("first.input", "2015-01-01 12:00:00", output)
+        key, outputs, found = self.cache.lookup(file_name)
+        self.write_file("first.png", "image")
+        self.cache.store(key, outputs)
+        os.remove(output)
+        self.cache.lookup(file_name)
+
+        # A link to a file outside the cache is kept.
+        other = self.write_file("other.png", "other")
+        linked = os.path.join(self.work_dir, "linked.png")
+        os.link(other, linked)
+        self.cache.break_links([output, linked])
+
+        self.assertFalse(os.path.exists(output))
+        self.assertTrue(os.path.exists(linked))
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,137 @@
+"""Tests for the scheduler module."""
+
+import os, shutil, sys, tempfile, unittest
+
+sys.path.insert(1, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+import scheduler
+
+class SchedulerTest(unittest.TestCase):
+
+    def setUp(self):
+
+        self.input_dir = tempfile.mkdtemp()
+        self.reads = []
+        self.read_parameters = scheduler.read_parameters
+
+        def read_parameters(file_name):
+            self.reads.append(os.path.basename(file_name))
+            return self.read_parameters(file_name)
+
+        scheduler.read_parameters = read_parameters
+
+    def tearDown(self):
+
+        scheduler.read_parameters = self.read_parameters
+        shutil.rmtree(self.input_dir, True)
+
+    def write_input(self, name, mtime, **parameters):
+
+        path = os.path.join(self.input_dir, name)
+        f = open(path, "w")
+        for key, value in sorted(parameters.items()):
+            f.write("%s=%s\n" % (key, value))
+        f.write("PLOT\nfilename=ignored.png\nENDPLOT\n")
+        f.close()
+        os.utime(path, (mtime, mtime))
+        return path
+
+    def names(self, jobs):
+        return map(lambda job: os.path.basename(job.file_name), jobs)
+
+    def test_order(self):
+
+        self.write_input("a.input", 1000, filename="a.png")
+        self.write_input("b.input", 1001, filename="b.png", priority=1)
+        self.write_input("c.input", 1002, filename="c.png",
+                         deadline="2015-01-01T00:00:00Z")
+        self.write_input("d.input", 999, filename="d.png")
+
+        s = scheduler.Scheduler()
+        s.scan(self.input_dir)
+
+        self.assertEqual(self.names(s.queue), ["b.input", "c.input", "d.input", "a.input"])
+
+    def test_superseded_files_are_removed(self):
+
+        old = self.write_input("old.input", 1000, filename="same.png")
+        new = self.write_input("new.input", 1001, filename="same.png")
+
+        s = scheduler.Scheduler()
+        messages = s.scan(self.input_dir)
+
+        self.assertEqual(self.names(s.queue), ["new.input"])
+        self.assertEqual(len(messages), 1)
+        self.assertFalse(os.path.exists(old))
+        self.assertTrue(os.path.exists(new))
+
+    def test_backlog_and_marker(self):
+
+        marker = os.path.join(self.input_dir, "backpressure")
+        for i in range(5):
+            self.write_input("%i.input" % i, 1000 + i, filename="%i.png" % i)
+
+        s = scheduler.Scheduler(2, marker)
+        s.scan(self.input_dir)
+
+        self.assertEqual(self.names(s.queue), ["0.input", "1.input"])
+        self.assertEqual(s.backlog, 3)
+        self.assertEqual(open(marker).read(), "3\n")
+
+        # The count in the marker follows the backlog.
+        self.write_input("5.input", 1005, filename="5.png")
+        s.scan(self.input_dir)
+        self.assertEqual(open(marker).read(), "4\n")
+
+        os.remove(os.path.join(self.input_dir, "5.input"))
+        for i in range(3):
+            os.remove(os.path.join(self.input_dir, "%i.input" % i))
+        s.scan(self.input_dir)
+
+        self.assertEqual(s.backlog, 0)
+        self.assertFalse(os.path.exists(marker))
+
+    def test_files_are_only_read_when_modified(self):
+
+        for i in range(5):
+            self.write_input("%i.input" % i, 1000 + i, filename="%i.png" % i)
+
+        s = scheduler.Scheduler(2)
+        s.scan(self.input_dir)
+        self.assertEqual(len(self.reads), 5)
+
+        # Files in the backlog are not read again on the next scan.
+        s.scan(self.input_dir)
+        self.assertEqual(len(self.reads), 5)
+
+        self.write_input("4.input", 2000, filename="4.png", priority=1)
+        s.scan(self.input_dir)
+        self.assertEqual(self.reads[5:], ["4.input"])
+        self.assertEqual(self.names(s.queue), ["4.input", "0.input"])
+
+    def test_removed_files_are_forgotten(self):
+
+        for i in range(3):
+            self.write_input("%i.input" % i, 1000 + i, filename="%i.png" % i)
+
+        s = scheduler.Scheduler(1)
+        s.scan(self.input_dir)
+        os.remove(os.path.join(self.input_dir, "2.input"))
+        s.scan(self.input_dir)
+
+        self.assertEqual(sorted(map(os.path.basename, s.jobs.keys())),
+                         ["0.input", "1.input"])
+
+    def test_pop_group(self):
+
+        self.write_input("a.input", 1000, filename="a.png", setupfile="x.setup")
+        self.write_input("b.input", 1001, filename="b.png", setupfile="y.setup")
+        self.write_input("c.input", 1002, filename="c.png", setupfile="x.setup")
+
+        s = scheduler.Scheduler()
+        s.scan(self.input_dir)
+
+        self.assertEqual(self.names(s.pop_group(2)), ["a.input", "c.input"])
+        self.assertEqual(self.names(s.queue), ["b.input"])
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,106 @@
+"""Tests for the spool module."""
+
+import os, shutil, sys, tempfile, time, unittest
+
+sys.path.insert(1, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+import spool
+
+class SpoolTest(unittest.TestCase):
+
+    def setUp(self):
+        self.input_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.input_dir, True)
+
+    def write_input(self, name):
+
+        path = os.path.join(self.input_dir, name)
+        open(path, "w").write("PLOT\n")
+        return path
+
+    def in_child(self, function):
+
+        """Calls the function in a child process, acting as another waiter, and
+        returns its exit status."""
+
+        pid = os.fork()
+        if pid == 0:
+            status = 1
+            try:
+                status = function()
+            finally:
+                os._exit(status)
+
+        return os.WEXITSTATUS(os.waitpid(pid, 0)[1])
+
+    def test_claim_and_complete(self):
+
+        claims = spool.Spool(self.input_dir)
+        file_name = self.write_input("a.input")
+
+        claimed = claims.claim(file_name)
+        self.assertFalse(os.path.exists(file_name))
+        self.assertTrue(os.path.exists(claimed))
+
+        # A file can only be claimed once.
+        self.assertEqual(claims.claim(file_name), None)
+
+        self.assertTrue(claims.complete(claimed))
+        self.assertTrue(os.path.exists(os.path.join(claims.done_dir, "a.input")))
+
+        claimed = claims.claim(self.write_input("b.input"))
+        self.assertTrue(claims.complete(claimed, False))
+        self.assertTrue(os.path.exists(os.path.join(claims.failed_dir, "b.input")))
+
+    def test_complete_after_recovery(self):
+
+        claims = spool.Spool(self.input_dir)
+        file_name = self.write_input("a.input")
+        claimed = claims.claim(file_name)
+
+        # Another waiter moves the file back into the input directory.
+        os.rename(claimed, file_name)
+
+        self.assertFalse(claims.complete(claimed))
+        self.assertEqual(os.listdir(claims.done_dir), [])
+
+    def test_recover_claims_of_stopped_waiters(self):
+
+        def claim():
+            spool.Spool(self.input_dir).claim(self.write_input("a.input"))
+            return 0
+
+        self.in_child(claim)
+
+        claims = spool.Spool(self.input_dir)
+        self.assertEqual(claims.recover(), [os.path.join(self.input_dir, "a.input")])
+        self.assertEqual(sorted(os.listdir(claims.processing_root)),
+                         [claims.name, claims.name + ".heartbeat"])
+
+    def test_claims_of_running_waiters_are_kept(self):
+
+        claims = spool.Spool(self.input_dir)
+        claims.claim(self.write_input("a.input"))
+
+        def recover():
+            return len(spool.Spool(self.input_dir).recover())
+
+        self.assertEqual(self.in_child(recover), 0)
+        self.assertEqual(os.listdir(claims.processing_dir), ["a.input"])
+
+    def test_prune(self):
+
+        claims = spool.Spool(self.input_dir, keep_time = 3600)
+
+        for name in ("old.input", "new.input"):
+            claims.complete(claims.claim(self.write_input(name)))
+
+        old = time.time() - 7200
+        os.utime(os.path.join(claims.done_dir, "old.input"), (old, old))
+        claims.prune()
+
+        self.assertEqual(os.listdir(claims.done_dir), ["new.input"])
+
+if __name__ == "__main__":
+    unittest.main()
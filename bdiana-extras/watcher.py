@@ -0,0 +1,135 @@
+"""Provides classes that wait for files to appear in the input directories
+used by the waiters.
+
+On Linux, the InotifyWatcher class uses inotify to wake up as soon as a file
+matching a pattern is closed after writing or moved into the directory. On
+other systems, or if inotify cannot be used, the PollingWatcher class simply
+sleeps for the period given. The watcher function returns whichever of these
+is available.
+
+The waiters scan the input directory after each call to the wait method, so
+the period is also the longest time between scans if events are missed.
+"""
+
+import ctypes, ctypes.util, errno, fnmatch, os, select, struct, time
+
+class PollingWatcher:
+
+    """Waits for the period given to the wait method without checking for
+    changes to the directory."""
+
+    def __init__(self, directory, pattern):
+
+        self.directory = directory
+        self.pattern = pattern
+
+    def wait(self, period):
+
+        """Waits for the given period in seconds. Always returns False since
+        changes to the directory are not detected."""
+
+        time.sleep(period)
+        return False
+
+    def close(self):
+        pass
+
+# Values from <sys/inotify.h>.
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_Q_OVERFLOW = 0x00004000
+IN_NONBLOCK = os.O_NONBLOCK
+IN_CLOEXEC = 0o2000000
+
+event_header = struct.Struct("iIII")
+
+class InotifyWatcher:
+
+    """Waits for files matching the pattern to be written to the directory or
+    moved into it using the Linux inotify interface."""
+
+    def __init__(self, directory, pattern):
+
+        self.directory = directory
+        self.pattern = pattern
+
+        libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6",
+                           use_errno = True)
+
+        self.fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "Failed to initialise inotify")
+
+        if libc.inotify_add_watch(self.fd, os.path.abspath(directory),
+                                  IN_CLOSE_WRITE | IN_MOVED_TO) < 0:
+            error = ctypes.get_errno()
+            os.close(self.fd)
+            raise OSError(error, "Failed to watch directory '%s'" % directory)
+
+    def wait(self, period):
+
+        """Waits for up to the given period in seconds for a file matching the
+        pattern to be written or moved into the directory. Returns True if one
+        was found or if events may have been lost, and False otherwise."""
+
+        deadline = time.time() + period
+
+        while True:
+
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                return False
+
+            try:
+                readable = select.select([self.fd], [], [], remaining)[0]
+            except select.error, e:
+                if e.args[0] == errno.EINTR:
+                    continue
+                raise
+
+            if not readable:
+                return False
+
+            if self.read_events():
+                return True
+
+    def read_events(self):
+
+        """Reads the pending events, returning True if any of them refer to a
+        file matching the pattern or if the event queue overflowed."""
+
+        try:
+            data = os.read(self.fd, 65536)
+        except OSError, e:
+            if e.errno == errno.EAGAIN:
+                return False
+            raise
+
+        found = False
+        offset = 0
+
+        while offset + event_header.size <= len(data):
+
+            wd, mask, cookie, length = event_header.unpack_from(data, offset)
+            offset += event_header.size
+            name = data[offset:offset + length].rstrip("\0")
+            offset += length
+
+            if mask & IN_Q_OVERFLOW or fnmatch.fnmatch(name, self.pattern):
+                found = True
+
+        return found
+
+    def close(self):
+
+        os.close(self.fd)
+
+def watcher(directory, pattern):
+
+    """Returns an InotifyWatcher for files matching the pattern in the given
+    directory if inotify is available, or a PollingWatcher if not."""
+
+    try:
+        return InotifyWatcher(directory, pattern)
+    except (OSError, AttributeError):
+        return PollingWatcher(directory, pattern)
@@ -0,0 +1,395 @@
+#!/usr/bin/env python
+
+# Copyright (C) 2015 MET Norway
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+
+"""Generates synthetic input files of any size for benchmarking the converters.
+
+  Usage: generate.py cap [--infos=<number>] [--areas=<number>]
+                         [--polygons=<number>] [--vertices=<number>]
+                         [--seed=<number>] <CAP file>
+         generate.py llf [--timesteps=<number>] [--features=<number>]
+                         [--vertices=<number>] [--group=<name>]
+                         [--seed=<number>] <LLF GeoJSON file>
+         generate.py woml [--members=<number>] [--segments=<number>]
+                          [--seed=<number>] <WOML file>
+
+CAP files contain a single alert with the given number of info elements, each
+with the given number of areas. Each area contains the given number of
+polygons with the given number of vertices.
+
+LLF files contain the given number of timesteps. Each timestep contains the
+given number of features for every parameter group described by the llf_schema
+module, or only for the group given by the --group option, and each feature
+has a polygon with the given number of vertices. The parameters of each
+feature are generated from the description of its group so that the files are
+always valid.
+
+WOML files contain a weather forecast with the given number of members, each
+of which is a cold or warm front made from the given number of Bezier curve
+segments.
+
+The same files are generated each time unless a different seed is given with
+the --seed option.
+"""
+
+import datetime, getopt, json, math, os, random, sys
+from xml.sax.saxutils import escape
+
+this_dir = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(1, os.path.join(this_dir, os.pardir, "LLF_to_KML"))
+
+import llf_schema, schema
+
+# The defaults used for each kind of file.
+cap_defaults = {"infos": 1, "areas": 1, "polygons": 1, "vertices": 20}
+llf_defaults = {"timesteps": 1, "features": 1, "vertices": 20}
+woml_defaults = {"members": 2, "segments": 4}
+
+# The region that polygons are placed in, given as (minimum, maximum) ranges
+# of longitudes and latitudes.
+region = ((4.0, 30.0), (57.0, 71.0))
+
+start_time = datetime.datetime(2015, 9, 2, 12)
+
+def ring(rng, vertices, radius = 1.0):
+
+    """Returns a list of (longitude, latitude) points for a closed ring with
+    the given number of vertices, not including the repeated last point, placed
+    at random within the region."""
+
+    (lon0, lon1), (lat0, lat1) = region
+    lon = rng.uniform(lon0 + radius, lon1 - radius)
+    lat = rng.uniform(lat0 + radius, lat1 - radius)
+
+    points = []
+    for i in range(vertices):
+        angle = 2 * math.pi * i / vertices
+        r = radius * rng.uniform(0.5, 1.0)
+        points.append((round(lon + r * math.cos(angle), 6),
+                       round(lat + r * math.sin(angle), 6)))
+
+    return points
+
+def write_cap(f, rng, infos, areas, polygons, vertices):
+
+    """Writes a CAP alert to the file, f, with the given numbers of info
+    elements, areas in each info element, polygons in each area and vertices
+    in each polygon, using the random number generator, rng."""
+
+    sent = start_time.strftime("%Y-%m-%dT%H:%M:%S-00:00")
+
+    f.write("<?xml version='1.0' encoding='UTF-8'?>\n"
+            '<alert xmlns="urn:oasis:names:tc:emergency:cap:1.2">\n'
+            "  <identifier>benchmark-%i</identifier>\n"
+            "  <sender>benchmark@example.com</sender>\n"
+            "  <sent>%s</sent>\n"
+            "  <status>Actual</status>\n"
+            "  <msgType>Alert</msgType>\n"
+            "  <scope>Public</scope>\n" % (rng.randint(0, 999999), sent))
+
+    for i in range(infos):
+
+        effective = start_time + datetime.timedelta(hours = 6 * i)
+        expires = effective + datetime.timedelta(hours = 6)
+
+        f.write("  <info>\n"
+                "    <category>Met</category>\n"
+                "    <event>Event %i</event>\n"
+                "    <urgency>Future</urgency>\n"
+                "    <severity>%s</severity>\n"
+                "    <certainty>Likely</certainty>\n"
+                "    <effective>%s</effective>\n"
+                "    <expires>%s</expires>\n"
+                "    <headline>Synthetic alert %i</headline>\n"
+                "    <description>Generated for benchmarking.</description>\n" % (
+                i, rng.choice(("Minor", "Moderate", "Severe", "Extreme")),
+                effective.strftime("%Y-%m-%dT%H:%M:%S-00:00"),
+                expires.strftime("%Y-%m-%dT%H:%M:%S-00:00"), i))
+
+        for j in range(areas):
+
+            f.write("    <area>\n"
+                    "      <areaDesc>%s</areaDesc>\n" % escape("Area %i.%i" % (i, j)))
+
+            for k in range(polygons):
+                points = ring(rng, vertices)
+                points.append(points[0])
+                f.write("      <polygon>%s</polygon>\n" % " ".join(
+                    map(lambda (lon, lat): "%s,%s" % (lat, lon), points)))
+
+            f.write("    </area>\n")
+
+        f.write("  </info>\n")
+
+    f.write("</alert>\n")
+
+def sample_value(rng, description):
+
+    """Returns a value that is valid for the given description from an LLF
+    schema, using the random number generator, rng."""
+
+    if type(description) == dict:
+        value = {}
+        for key, item in description.items():
+            value[key] = sample_value(rng, item)
+        return value
+
+    elif type(description) == list:
+        return [sample_value(rng, description[0])]
+
+    elif description == unicode:
+        return u"synthetic"
+
+    elif isinstance(description, llf_schema.IntRange):
+        return rng.randint(description.minimum, description.maximum)
+
+    elif isinstance(description, llf_schema.OneOf):
+        return rng.choice(description.choices)
+
+    elif isinstance(description, llf_schema.AnyEntries):
+        return {u"level": sample_value(rng, description.expected_dict)}
+
+    elif isinstance(description, schema.Optional):
+        return sample_value(rng, description.value)
+
+    raise ValueError, "Cannot generate a value for %r." % description
+
+def iso_time(t):
+    return t.strftime("%Y-%m-%dT%H:%M:%S.000Z")
+
+def write_llf(f, rng, timesteps, features, vertices, groups = None):
+
+    """Writes an LLF GeoJSON file to the file, f, with the given numbers of
+    timesteps, features for each parameter group in each timestep and vertices
+    in each polygon, using the random number generator, rng. If a list of
+    groups is given, only features for those groups are written."""
+
+    if groups is None:
+        groups = sorted(llf_schema.Properties.parameterGroups.keys())
+
+    end_time = start_time + datetime.timedelta(hours = timesteps)
+
+    llf = {
+        "header": {
+            "status": "NEW",
+            "group": groups[0],
+            "locale": "UTF-8",
+            "ref": start_time.strftime("%H"),
+            "start": start_time.strftime("%H"),
+            "date": start_time.strftime("%y%m%d"),
+            "end": end_time.strftime("%H"),
+            "type": "llfo",
+            "areas": ["EKCH"]
+            },
+        "timesteps": []
+        }
+
+    for i in range(timesteps):
+
+        begin = start_time + datetime.timedelta(hours = i)
+        end = begin + datetime.timedelta(hours = 1)
+        items = []
+
+        for group in groups:
+            description = llf_schema.Properties.parameterGroups[group]
+            for j in range(features):
+                points = ring(rng, vertices)
+                points.append(points[0])
+                items.append({
+                    "geometry": {
+                        "type": "Polygon",
+                        "coordinates": [map(list, points)]
+                        },
+                    "type": "Feature",
+                    "properties": {
+                        "timeStep": iso_time(end),
+                        "refTime": iso_time(start_time),
+                        "parameterGroup": group,
+                        "valid": {"from": iso_time(begin), "to": iso_time(end)},
+                        "parameters": sample_value(rng, description)
+                        }
+                    })
+
+        llf["timesteps"].append({
+            "range": [i, i + 1],
+            "valid": [iso_time(begin), iso_time(end)],
+            "forecast": {"type": "FeatureCollection", "features": items}
+            })
+
+    json.dump(llf, f, indent = 2)
+    f.write("\n")
+
+woml_header = """<?xml version="1.0" encoding="UTF-8"?>
+<womlcore:WeatherForecast
+    xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance"
+    xmlns:gml="http://www.opengis.net/gml/3.2"
+    xmlns:womlcore="http://xml.fmi.fi/namespace/woml/core/2011/11/15"
+    xmlns:womlswo="http://xml.fmi.fi/namespace/woml/swo/2011/11/15"
+    xmlns:xlink="http://www.w3.org/1999/xlink"
+    gml:id="fct-1">
+"""
+
+woml_member_start = """    <womlcore:member>
+        <womlswo:%(kind)s gml:id="front-%(id)i">
+            <gml:validTime>
+                <gml:TimePeriod gml:id="time-%(id)i">
+                    <gml:beginPosition>%(begin)s</gml:beginPosition>
+                    <gml:endPosition>%(end)s</gml:endPosition>
+                </gml:TimePeriod>
+            </gml:validTime>
+            <womlcore:creationTime>%(begin)s</womlcore:creationTime>
+            <womlcore:controlCurve>
+                <gml:Curve gml:id="curve-%(id)i">
+                    <gml:segments>
+"""
+
+woml_segment = """                        <gml:Bezier interpolation="polynomialSpline" isPolynomial="true">
+                            <gml:posList>%s</gml:posList>
+                            <gml:degree>3</gml:degree>
+                        </gml:Bezier>
+"""
+
+woml_member_end = """                    </gml:segments>
+                </gml:Curve>
+            </womlcore:controlCurve>
+        </womlswo:%(kind)s>
+    </womlcore:member>
+"""
+
+woml_footer = """    <gml:validTime>
+        <gml:TimePeriod gml:id="time-forecast">
+            <gml:beginPosition>%(begin)s</gml:beginPosition>
+            <gml:endPosition>%(end)s</gml:endPosition>
+        </gml:TimePeriod>
+    </gml:validTime>
+</womlcore:WeatherForecast>
+"""
+
+def write_woml(f, rng, members, segments):
+
+    """Writes a WOML weather forecast to the file, f, with the given number of
+    members, each a front made from the given number of Bezier curve segments,
+    using the random number generator, rng."""
+
+    times = {"begin": start_time.strftime("%Y-%m-%dT%H:%M:%SZ"),
+             "end": (start_time + datetime.timedelta(days = 1)).strftime("%Y-%m-%dT%H:%M:%SZ")}
+    (lon0, lon1), (lat0, lat1) = region
+
+    f.write(woml_header)
+
+    for i in range(members):
+
+        values = {"kind": ("ColdFront", "WarmFront")[i % 2], "id": i}
+        values.update(times)
+        f.write(woml_member_start % values)
+
+        # Each segment starts where the previous one ended. Coordinates are
+        # given as latitude, longitude pairs.
+        lat = rng.uniform(lat0, lat1)
+        lon = rng.uniform(lon0, lon1)
+        for j in range(segments):
+            points = ["%.4f %.4f" % (lat, lon)]
+            for k in range(3):
+                lat = min(max(lat + rng.uniform(-0.2, 0.2), lat0), lat1)
+                lon = min(max(lon + rng.uniform(-0.1, 0.4), lon0), lon1)
+                points.append("%.4f %.4f" % (lat, lon))
+            f.write(woml_segment % " ".join(points))
+
+        f.write(woml_member_end % values)
+
+    f.write(woml_footer % times)
+
+def generate(kind, file_name, seed = 0, **parameters):
+
+    """Writes a file of the given kind ("cap", "llf" or "woml") with the given
+    file_name, passing the parameters to the corresponding function. The
+    parameters not given take their default values."""
+
+    rng = random.Random(seed)
+    f = open(file_name, "wb")
+
+    try:
+        if kind == "cap":
+            values = dict(cap_defaults)
+            values.update(parameters)
+            write_cap(f, rng, **values)
+        elif kind == "llf":
+            values = dict(llf_defaults)
+            values.update(parameters)
+            write_llf(f, rng, **values)
+        elif kind == "woml":
+            values = dict(woml_defaults)
+            values.update(parameters)
+            write_woml(f, rng, **values)
+        else:
+            raise ValueError, "Unknown kind of file '%s'." % kind
+    finally:
+        f.close()
+
+def usage():
+
+    sys.stderr.write(__doc__)
+    sys.exit(1)
+
+if __name__ == "__main__":
+
+    if len(sys.argv) < 2:
+        usage()
+
+    kind = sys.argv[1]
+    if kind == "cap":
+        names = cap_defaults.keys()
+    elif kind == "llf":
+        names = llf_defaults.keys() + ["group"]
+    elif kind == "woml":
+        names = woml_defaults.keys()
+    else:
+        usage()
+
+    try:
+        opts, args = getopt.getopt(sys.argv[2:], "",
+                                   map(lambda name: name + "=", names + ["seed"]))
+    except getopt.GetoptError:
+        usage()
+
+    if len(args) != 1:
+        usage()
+
+    parameters = {}
+    seed = 0
+
+    for option, value in opts:
+        name = option[2:]
+        if name == "group":
+            if value not in llf_schema.Properties.parameterGroups:
+                sys.stderr.write("Unknown parameter group '%s'.\n" % value)
+                sys.exit(1)
+            parameters["groups"] = [value]
+            continue
+        try:
+            value = int(value)
+        except ValueError:
+            usage()
+        if name == "seed":
+            seed = value
+        elif value < 1 or name == "vertices" and value < 3:
+            usage()
+        else:
+            parameters[name] = value
+
+    generate(kind, args[0], seed, **parameters)
+    sys.exit()
@@ -0,0 +1,376 @@
+#!/usr/bin/env python
+
+# Copyright (C) 2015 MET Norway
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+
+"""Runs the converters on synthetic input files and records their performance.
+
+  Usage: run.py [--sizes=<size>,...] [--repeat=<number>] [--warmup=<number>]
+                [--output=<results file>] [<converter> ...]
+         run.py --compare=<baseline results file> [--threshold=<percent>]
+                <results file>
+
+The converters are cap, llf and woml, and all of them are run unless some are
+given. For each converter and each of the sizes given by the --sizes option,
+an input file is written by the generate module, then the converter is run on
+it the number of times given by the --repeat option, defaulting to 5, after a
+number of warm-up runs that are not recorded, defaulting to 1. The sizes are
+small, medium and large, and only the small and medium sizes are used by
+default.
+
+Each converter is run in a separate process, and the wall time, peak resident
+memory and exit status of each run are recorded. On Linux, the peak memory of
+each process includes the few megabytes used by this script when the process
+was started. The results for each converter and size include the minimum,
+mean, median, 90th and 99th percentile and maximum latencies in seconds, the
+throughput in files, megabytes and items (polygons, features or members) per
+second, based on the mean latency, and the peak resident memory in megabytes.
+A summary is written to stderr and the results are written as JSON to the
+given results file, or to stdout if none is given.
+
+In compare mode, the results in the given file are compared with those in the
+baseline file. The median and 90th percentile latencies and the peak memory of
+each converter and size are reported with their relative changes, and changes
+greater than the percentage given by the --threshold option, defaulting to 10,
+are reported as regressions. The exit status is 1 if there are any
+regressions.
+
+The woml2kml.py tool only parses its input and lists the objects it finds, so
+its results measure parsing rather than conversion.
+"""
+
+import getopt, json, os, platform, shutil, subprocess, sys, tempfile, time
+import generate
+
+this_dir = os.path.dirname(os.path.abspath(__file__))
+top_dir = os.path.join(this_dir, os.pardir)
+
+converters = {
+    "cap": (os.path.join(top_dir, "CAP_to_KML", "cap2kml.py"), ".cap"),
+    "llf": (os.path.join(top_dir, "LLF_to_KML", "llf2kml.py"), ".json"),
+    "woml": (os.path.join(top_dir, "WOML_to_KML", "woml2kml.py"), ".xml")
+    }
+
+# The parameters passed to the generate module for each size of input file.
+sizes = {
+    "small": {
+        "cap": {"infos": 1, "areas": 2, "polygons": 1, "vertices": 50},
+        "llf": {"timesteps": 2, "features": 1, "vertices": 50},
+        "woml": {"members": 10, "segments": 4}
+        },
+    "medium": {
+        "cap": {"infos": 4, "areas": 10, "polygons": 2, "vertices": 500},
+        "llf": {"timesteps": 12, "features": 5, "vertices": 200},
+        "woml": {"members": 200, "segments": 10}
+        },
+    "large": {
+        "cap": {"infos": 10, "areas": 50, "polygons": 4, "vertices": 2000},
+        "llf": {"timesteps": 48, "features": 20, "vertices": 500},
+        "woml": {"members": 2000, "segments": 20}
+        }
+    }
+
+size_order = ("small", "medium", "large")
+
+def item_count(converter, parameters):
+
+    """Returns the number of polygons, features or members in an input file
+    generated with the given parameters for the given converter."""
+
+    if converter == "cap":
+        return parameters["infos"] * parameters["areas"] * parameters["polygons"]
+    elif converter == "llf":
+        groups = len(generate.llf_schema.Properties.parameterGroups)
+        return parameters["timesteps"] * parameters["features"] * groups
+    else:
+        return parameters["members"]
+
+def maximum_memory(usage):
+
+    """Returns the maximum resident memory in bytes given by the resource usage
+    of a process."""
+
+    # The maximum is given in kilobytes on Linux but in bytes on Mac OS X.
+    if sys.platform == "darwin":
+        return usage.ru_maxrss
+    return usage.ru_maxrss * 1024
+
+def run_once(command):
+
+    """Runs the given command, returning a tuple containing the wall time it
+    took, its peak resident memory in bytes, its exit status and the text it
+    wrote to stderr."""
+
+    errors = tempfile.TemporaryFile()
+    started = time.time()
+    process = subprocess.Popen(command, stdin = open(os.devnull),
+                               stdout = open(os.devnull, "w"), stderr = errors)
+
+    # Wait for the process directly to obtain its resource usage.
+    pid, status, usage = os.wait4(process.pid, 0)
+    elapsed = time.time() - started
+
+    if os.WIFEXITED(status):
+        status = os.WEXITSTATUS(status)
+    else:
+        status = -os.WTERMSIG(status)
+
+    # The process has already been reaped, so record its status for the
+    # Popen object.
+    process.returncode = status
+
+    errors.seek(0)
+    text = errors.read()
+    errors.close()
+
+    return elapsed, maximum_memory(usage), status, text
+
+def percentile(values, fraction):
+
+    """Returns the value at the given fraction of the sorted list of values,
+    using the nearest rank."""
+
+    index = int(round(fraction * (len(values) - 1)))
+    return values[index]
+
+def summarise(latencies):
+
+    latencies = sorted(latencies)
+    return {"min": latencies[0],
+            "mean": sum(latencies) / len(latencies),
+            "p50": percentile(latencies, 0.5),
+            "p90": percentile(latencies, 0.9),
+            "p99": percentile(latencies, 0.99),
+            "max": latencies[-1]}
+
+def benchmark(converter, size, work_dir, repeat, warmup):
+
+    """Generates an input file of the given size for the given converter in the
+    work directory, then runs the converter on it, returning a dictionary
+    describing the results."""
+
+    script, suffix = converters[converter]
+    parameters = sizes[size][converter]
+
+    input_file = os.path.join(work_dir, converter + "-" + size + suffix)
+    output_file = os.path.join(work_dir, converter + "-" + size + ".kml")
+
+    # Generate the input file in a separate process. The peak memory reported
+    # for a child process on Linux includes the memory used by this process
+    # when the child was started, so this process needs to stay small.
+    command = [sys.executable, os.path.join(this_dir, "generate.py"), converter]
+    for name, value in sorted(parameters.items()):
+        command.append("--%s=%s" % (name, value))
+    subprocess.check_call(command + [input_file])
+
+    command = [sys.executable, script, input_file, output_file]
+    input_size = os.path.getsize(input_file)
+    items = item_count(converter, parameters)
+
+    result = {"converter": converter, "size": size, "parameters": parameters,
+              "input_bytes": input_size, "items": items}
+
+    latencies = []
+    peak = 0
+
+    for i in range(warmup + repeat):
+
+        elapsed, memory, status, text = run_once(command)
+
+        if status != 0:
+            result["error"] = "Exit status %i: %s" % (status, text.strip())
+            return result
+
+        if i >= warmup:
+            latencies.append(elapsed)
+            peak = max(peak, memory)
+
+    latency = summarise(latencies)
+
+    result["runs"] = repeat
+    result["latency"] = latency
+    result["throughput"] = {
+        "files_per_second": 1 / latency["mean"],
+        "megabytes_per_second": input_size / (1024.0 * 1024.0) / latency["mean"],
+        "items_per_second": items / latency["mean"]
+        }
+    result["peak_rss_mb"] = peak / (1024.0 * 1024.0)
+
+    return result
+
+def revision():
+
+    """Returns the Git revision of the repository, or None if it cannot be
+    found."""
+
+    try:
+        process = subprocess.Popen(["git", "rev-parse", "HEAD"], cwd = top_dir,
+                                   stdout = subprocess.PIPE,
+                                   stderr = open(os.devnull, "w"))
+        output = process.communicate()[0].strip()
+    except OSError:
+        return None
+
+    if process.returncode != 0:
+        return None
+    return output
+
+def compare(baseline, results, threshold):
+
+    """Writes a comparison of the results with the baseline results to stdout,
+    returning the number of regressions found, where a regression is an
+    increase of more than the threshold percentage."""
+
+    regressions = 0
+
+    print "%-14s %-8s %10s %10s %9s" % ("Benchmark", "Measure", "Baseline", "Current", "Change")
+
+    for key in sorted(results["results"].keys()):
+
+        current = results["results"][key]
+        previous = baseline["results"].get(key)
+
+        if previous is None:
+            print "%-14s (not in baseline)" % key
+            continue
+        elif "error" in current or "error" in previous:
+            print "%-14s (failed)" % key
+            continue
+
+        for name, old, new in (
+            ("p50", previous["latency"]["p50"], current["latency"]["p50"]),
+            ("p90", previous["latency"]["p90"], current["latency"]["p90"]),
+            ("peak MB", previous["peak_rss_mb"], current["peak_rss_mb"])):
+
+            if old > 0:
+                change = 100.0 * (new - old) / old
+            else:
+                change = 0.0
+
+            if change > threshold:
+                marker = " REGRESSION"
+                regressions += 1
+            else:
+                marker = ""
+
+            print "%-14s %-8s %10.3f %10.3f %+8.1f%%%s" % (key, name, old, new,
+                                                          change, marker)
+
+    return regressions
+
+def usage():
+
+    sys.stderr.write(__doc__)
+    sys.exit(1)
+
+if __name__ == "__main__":
+
+    try:
+        opts, args = getopt.getopt(sys.argv[1:], "", ["sizes=", "repeat=",
+            "warmup=", "output=", "compare=", "threshold="])
+    except getopt.GetoptError:
+        usage()
+
+    opts = dict(opts)
+
+    if "--compare" in opts:
+
+        try:
+            threshold = float(opts.get("--threshold", 10))
+        except ValueError:
+            usage()
+
+        if len(args) != 1:
+            usage()
+
+        baseline = json.load(open(opts["--compare"]))
+        results = json.load(open(args[0]))
+
+        if compare(baseline, results, threshold):
+            sys.exit(1)
+        sys.exit()
+
+    try:
+        repeat = int(opts.get("--repeat", 5))
+        warmup = int(opts.get("--warmup", 1))
+    except ValueError:
+        usage()
+
+    selected_sizes = opts.get("--sizes", "small,medium").split(",")
+    selected = args or sorted(converters.keys())
+
+    if repeat < 1 or warmup < 0:
+        usage()
+
+    for name in selected_sizes:
+        if name not in sizes:
+            sys.stderr.write("Unknown size '%s'.\n" % name)
+            sys.exit(1)
+
+    for name in selected:
+        if name not in converters:
+            sys.stderr.write("Unknown converter '%s'.\n" % name)
+            sys.exit(1)
+
+    results = {"created": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+               "host": platform.node(),
+               "platform": platform.platform(),
+               "python": platform.python_version(),
+               "revision": revision(),
+               "repeat": repeat,
+               "warmup": warmup,
+               "results": {}}
+
+    work_dir = tempfile.mkdtemp("", "benchmark-")
+    failed = 0
+
+    sys.stderr.write("%-14s %10s %10s %10s %10s %10s\n" % ("Benchmark", "p50 s",
+                     "p90 s", "files/s", "items/s", "peak MB"))
+
+    try:
+        for converter in selected:
+            for size in size_order:
+                if size not in selected_sizes:
+                    continue
+
+                key = converter + "/" + size
+                result = benchmark(converter, size, work_dir, repeat, warmup)
+                results["results"][key] = result
+
+                if "error" in result:
+                    sys.stderr.write("%-14s %s\n" % (key, result["error"]))
+                    failed += 1
+                    continue
+
+                sys.stderr.write("%-14s %10.3f %10.3f %10.2f %10.1f %10.1f\n" % (key,
+                    result["latency"]["p50"], result["latency"]["p90"],
+                    result["throughput"]["files_per_second"],
+                    result["throughput"]["items_per_second"], result["peak_rss_mb"]))
+    finally:
+        shutil.rmtree(work_dir, True)
+
+    if "--output" in opts:
+        f = open(opts["--output"], "w")
+    else:
+        f = sys.stdout
+
+    json.dump(results, f, indent = 2, sort_keys = True)
+    f.write("\n")
+    f.close()
+
+    if failed:
+        sys.exit(1)
+    sys.exit()
@@ -0,0 +1,191 @@
+# Copyright (C) 2015 MET Norway
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+
+"""Provides a writer for KML files that can be used by the tools that convert
+other formats to KML for Diana (http://diana.met.no).
+
+The writer uses lxml's incremental XML file support to write each element of
+the document as soon as it is produced, so the whole document is never held
+in memory. Documents are written in the following way:
+
+  with kmlstream.writer(f) as kml:
+      with kml.folder(name, begin, end):
+          with kml.placemark(name, description):
+              kml.extended_data(values)
+              kml.polygon(coordinates)
+"""
+
+import decimal
+from contextlib import contextmanager
+from lxml.etree import Element, SubElement, xmlfile
+
+KML_NAMESPACE = "http://www.opengis.net/kml/2.2"
+
+def data_values(properties, prefix):
+
+    """Returns a list of (name, value) pairs for the contents of the properties
+    dictionary, giving each name the specified prefix string. The contents of
+    dictionaries within the dictionary are included with names made from the
+    prefix and the keys of the enclosing dictionaries, separated by colons."""
+
+    values = []
+
+    for key, value in properties.items():
+        if type(value) == dict:
+            values += data_values(value, prefix + key + ":")
+        else:
+            values.append((prefix + key, value))
+
+    return values
+
+def plain_number(value):
+
+    """Returns the shortest text that represents the given number exactly,
+    written without an exponent and without a fractional part if the number
+    is a whole number."""
+
+    text = repr(float(value))
+    if "e" in text:
+        text = format(decimal.Decimal(text), "f")
+    if text.endswith(".0"):
+        text = text[:-2]
+    return text
+
+def encode_coordinates(points, precision = 6, altitude = None):
+
+    """Returns the text used in a KML coordinates element for the sequence of
+    points, which contains alternate longitudes and latitudes, with each point
+    on a separate line.
+
+    Each value is written with the given number of decimal places or, if
+    precision is None, as plain decimal text with the fewest digits needed to
+    represent it exactly, as returned by the plain_number function. If an
+    altitude is given, it is appended to every point.
+
+    The text is produced with a single formatting operation for the whole
+    sequence instead of concatenating the text for each point in turn."""
+
+    if precision is None:
+        points = map(plain_number, points)
+        number = "%s"
+    else:
+        number = "%%.%if" % precision
+
+    line = number + "," + number
+    if altitude is not None:
+        line += ",%s" % altitude
+    line += "\n"
+
+    return (line * (len(points) // 2)) % tuple(points)
+
+class Writer:
+
+    """Writes the contents of a KML document to an incremental XML file."""
+
+    def __init__(self, xf):
+
+        self.xf = xf
+
+    @contextmanager
+    def folder(self, name, begin = None, end = None):
+
+        """Writes a Folder element with the given name, enclosing the elements
+        written within the context. If begin and end times are given, a
+        TimeSpan element is also written for the folder."""
+
+        with self.xf.element('Folder'):
+            self.xf.write('\n')
+            self.write_text('name', name)
+
+            if begin is not None and end is not None:
+                timespan = Element('TimeSpan')
+                SubElement(timespan, 'begin').text = begin
+                SubElement(timespan, 'end').text = end
+                self.xf.write(timespan, pretty_print=True)
+
+            yield
+
+        self.xf.write('\n')
+
+    @contextmanager
+    def placemark(self, name, description):
+
+        """Writes a Placemark element with the given name and description,
+        enclosing the elements written within the context."""
+
+        with self.xf.element('Placemark'):
+            self.xf.write('\n')
+            self.write_text('name', name)
+            self.write_text('description', description)
+
+            yield
+
+        self.xf.write('\n')
+
+    def write_text(self, tag, text):
+
+        element = Element(tag)
+        element.text = text
+        self.xf.write(element, pretty_print=True)
+
+    def extended_data(self, values):
+
+        """Writes an ExtendedData element containing a Data element for each of
+        the (name, value) pairs in the values sequence."""
+
+        extdata = Element('ExtendedData')
+
+        for name, value in values:
+            data = SubElement(extdata, 'Data')
+            data.set('name', name)
+            SubElement(data, 'value').text = unicode(value)
+
+        self.xf.write(extdata, pretty_print=True)
+
+    def polygon(self, coordinates):
+
+        """Writes a Polygon element whose outer boundary is described by the
+        given coordinates text."""
+
+        polygon = Element('Polygon')
+        SubElement(polygon, 'tessellate').text = '1'
+
+        boundary = SubElement(polygon, 'outerBoundaryIs')
+        ring = SubElement(boundary, 'LinearRing')
+        SubElement(ring, 'coordinates').text = coordinates
+
+        self.xf.write(polygon, pretty_print=True)
+
+    def flush(self):
+
+        """Writes any buffered output to the underlying file."""
+
+        self.xf.flush()
+
+@contextmanager
+def writer(f):
+
+    """Writes a KML document to the file, f, returning a Writer object for use
+    within the context that is used to write the contents of the document."""
+
+    with xmlfile(f, encoding='UTF-8') as xf:
+        xf.write_declaration()
+        with xf.element('kml', xmlns=KML_NAMESPACE):
+            xf.write('\n')
+            with xf.element('Document'):
+                xf.write('\n')
+                yield Writer(xf)
+            xf.write('\n')
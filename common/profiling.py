@@ -0,0 +1,233 @@
+# Copyright (C) 2015 MET Norway
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+
+"""Provides a way to measure the time and memory used by each stage of a
+conversion, such as loading a schema, parsing, validation and writing.
+
+Stages are recorded by the converters using the stage method of a Profiler
+object as a context manager:
+
+    profiler = profiling.Profiler()
+    with profiler.stage("parse"):
+        ...
+    profiler.report(sys.stderr)
+
+Stages can be nested, in which case the time spent in the inner stage is not
+counted as part of the outer one, so the times for all the stages add up to
+the total time spent in them. This allows a stage that consumes the items
+supplied by a generator to be measured separately from the stages in the
+generator itself, using the iterate method to record the time spent fetching
+each item.
+
+The peak memory reported for each stage is the maximum resident memory of the
+process at the end of the stage, and the increase is the amount by which the
+maximum grew during the stage. If a profile file name is given, the code run
+in each stage is also profiled with cProfile and the statistics are written
+to the file for use with the pstats module.
+"""
+
+import resource, sys, time
+
+try:
+    import cProfile
+except ImportError:
+    import profile as cProfile
+
+def peak_memory():
+
+    """Returns the maximum resident memory used by the process so far in
+    bytes."""
+
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    # The maximum is given in kilobytes on Linux but in bytes on Mac OS X.
+    if sys.platform == "darwin":
+        return peak
+    return peak * 1024
+
+class Stage:
+
+    """Records the code run in its context as part of the stage with the given
+    name."""
+
+    def __init__(self, profiler, name):
+
+        self.profiler = profiler
+        self.name = name
+
+    def __enter__(self):
+        self.profiler.start(self.name)
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.profiler.stop()
+        return False
+
+class Profiler:
+
+    """Records the time and memory used by named stages, profiling them with
+    cProfile if a profile_file name is given."""
+
+    def __init__(self, profile_file = None):
+
+        self.profile_file = profile_file
+        if profile_file:
+            self.profile = cProfile.Profile()
+        else:
+            self.profile = None
+
+        # The names of the stages in the order in which they were first seen
+        # and the times, calls, peak memory and increases in peak memory
+        # recorded for each of them.
+        self.names = []
+        self.times = {}
+        self.calls = {}
+        self.peaks = {}
+        self.increases = {}
+
+        # The stages that are running, with the innermost last.
+        self.stack = []
+        self.resumed = None
+        self.resumed_peak = None
+
+    def stage(self, name):
+
+        """Returns a context manager that records the code run in its context
+        as part of the stage with the given name."""
+
+        return Stage(self, name)
+
+    def iterate(self, iterable, name):
+
+        """Yields the items from the given iterable, recording the time spent
+        fetching each item as part of the stage with the given name."""
+
+        iterator = iter(iterable)
+        while True:
+            self.start(name)
+            try:
+                item = iterator.next()
+            finally:
+                self.stop()
+            yield item
+
+    def start(self, name):
+
+        if name not in self.times:
+            self.names.append(name)
+            self.times[name] = 0.0
+            self.calls[name] = 0
+            self.peaks[name] = 0
+            self.increases[name] = 0
+
+        self.calls[name] += 1
+
+        if self.stack:
+            # Pause the enclosing stage.
+            self.record(self.stack[-1])
+        elif self.profile:
+            self.profile.enable()
+
+        self.stack.append(name)
+        self.resumed = time.time()
+        self.resumed_peak = peak_memory()
+
+    def stop(self):
+
+        name = self.stack.pop()
+        self.record(name)
+
+        if self.stack:
+            # Resume the enclosing stage.
+            self.resumed = time.time()
+            self.resumed_peak = peak_memory()
+        elif self.profile:
+            self.profile.disable()
+
+    def record(self, name):
+
+        peak = peak_memory()
+        self.times[name] += time.time() - self.resumed
+        self.peaks[name] = max(self.peaks[name], peak)
+        self.increases[name] += peak - self.resumed_peak
+
+    def timings(self):
+
+        """Returns a list of (name, seconds, calls, peak memory, increase in
+        peak memory) tuples for the stages, with memory given in bytes."""
+
+        timings = []
+        for name in self.names:
+            timings.append((name, self.times[name], self.calls[name],
+                            self.peaks[name], self.increases[name]))
+
+        return timings
+
+    def summary(self):
+
+        """Returns a single line describing the time spent in each stage, for
+        use in logs."""
+
+        pieces = []
+        for name, seconds, calls, peak, increase in self.timings():
+            pieces.append("%s %.3f s" % (name, seconds))
+
+        return ", ".join(pieces)
+
+    def report(self, stream):
+
+        """Writes a table of the timings for the stages to the given stream and
+        writes the profile statistics to the profile file if there is one."""
+
+        megabyte = 1024.0 * 1024.0
+        total = 0.0
+
+        stream.write("%-20s %8s %10s %12s %12s\n" % ("Stage", "Calls", "Seconds",
+                     "Peak MB", "Increase MB"))
+
+        for name, seconds, calls, peak, increase in self.timings():
+            stream.write("%-20s %8i %10.3f %12.1f %12.1f\n" % (name, calls, seconds,
+                         peak / megabyte, increase / megabyte))
+            total += seconds
+
+        stream.write("%-20s %8s %10.3f %12.1f\n" % ("Total", "", total,
+                     peak_memory() / megabyte))
+
+        if self.profile:
+            self.profile.dump_stats(self.profile_file)
+
+class NullProfiler:
+
+    """Provides the same methods as Profiler without recording anything, for
+    use when no timings are required."""
+
+    def stage(self, name):
+        return NullStage()
+
+    def iterate(self, iterable, name):
+        return iterable
+
+    def report(self, stream):
+        pass
+
+class NullStage:
+
+    def __enter__(self):
+        pass
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+null_profiler = NullProfiler()
@@ -0,0 +1,263 @@
+# Copyright (C) 2015 MET Norway
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+
+"""Provides functions for simplifying the polygons written by the converters.
+
+Polygons are supplied as sequences of alternate longitudes and latitudes, as
+used by the kmlstream.encode_coordinates function, and are simplified using
+the Douglas-Peucker algorithm with a tolerance given in degrees.
+
+The algorithm does not preserve topology, so each simplified ring is checked
+for edges that cross each other and simplified again with a smaller tolerance
+if necessary. Each ring is simplified separately, so rings that are close to
+each other, such as the holes of a polygon or neighbouring areas, may still
+overlap after simplification.
+"""
+
+from array import array
+
+def segment_distance2(x, y, x1, y1, x2, y2):
+
+    """Returns the square of the distance between the point (x, y) and the
+    line segment from (x1, y1) to (x2, y2)."""
+
+    dx = x2 - x1
+    dy = y2 - y1
+    length2 = dx*dx + dy*dy
+
+    if length2 > 0:
+        t = ((x - x1)*dx + (y - y1)*dy) / length2
+        if t > 1:
+            x1, y1 = x2, y2
+        elif t > 0:
+            x1 += t*dx
+            y1 += t*dy
+
+    return (x - x1)*(x - x1) + (y - y1)*(y - y1)
+
+def orientation(ax, ay, bx, by, cx, cy):
+
+    """Returns 1 if the point (cx, cy) lies to the left of the line through
+    (ax, ay) and (bx, by), -1 if it lies to the right and 0 if it lies on the
+    line."""
+
+    d = (bx - ax)*(cy - ay) - (by - ay)*(cx - ax)
+    return (d > 0) - (d < 0)
+
+def within_bounds(ax, ay, bx, by, cx, cy):
+
+    """Returns True if the point (cx, cy) lies within the bounding box of the
+    line segment from (ax, ay) to (bx, by)."""
+
+    return min(ax, bx) <= cx <= max(ax, bx) and min(ay, by) <= cy <= max(ay, by)
+
+def segments_intersect(ax, ay, bx, by, cx, cy, dx, dy):
+
+    """Returns True if the line segment from (ax, ay) to (bx, by) intersects or
+    touches the line segment from (cx, cy) to (dx, dy)."""
+
+    o1 = orientation(ax, ay, bx, by, cx, cy)
+    o2 = orientation(ax, ay, bx, by, dx, dy)
+    o3 = orientation(cx, cy, dx, dy, ax, ay)
+    o4 = orientation(cx, cy, dx, dy, bx, by)
+
+    if o1 != o2 and o3 != o4:
+        return True
+
+    # Handle the cases where an end of one segment lies on the other.
+    return (o1 == 0 and within_bounds(ax, ay, bx, by, cx, cy)) or \
+           (o2 == 0 and within_bounds(ax, ay, bx, by, dx, dy)) or \
+           (o3 == 0 and within_bounds(cx, cy, dx, dy, ax, ay)) or \
+           (o4 == 0 and within_bounds(cx, cy, dx, dy, bx, by))
+
+def self_intersects(x, y):
+
+    """Returns True if any two non-adjacent edges of the ring with the given
+    sequences of x and y coordinates intersect or touch."""
+
+    n = len(x)
+    if n < 4:
+        return False
+
+    closed = x[0] == x[n - 1] and y[0] == y[n - 1]
+
+    # Place the edges in the cells of a grid covering the ring, with cells
+    # about the size of an average edge, so that each edge is only compared
+    # with the edges near it.
+    size = 0
+    for i in xrange(n - 1):
+        size += max(abs(x[i + 1] - x[i]), abs(y[i + 1] - y[i]))
+    size = size / (n - 1) or 1.0
+
+    bounds = []
+    cells = {}
+    for i in xrange(n - 1):
+        x1, x2 = min(x[i], x[i + 1]), max(x[i], x[i + 1])
+        y1, y2 = min(y[i], y[i + 1]), max(y[i], y[i + 1])
+        bounds.append((x1, y1, x2, y2))
+        for column in xrange(int(x1 // size), int(x2 // size) + 1):
+            for row in xrange(int(y1 // size), int(y2 // size) + 1):
+                cells.setdefault((column, row), []).append(i)
+
+    for edges in cells.itervalues():
+        for k, i in enumerate(edges):
+            x1, y1, x2, y2 = bounds[i]
+            for j in edges[k + 1:]:
+
+                # Adjacent edges share an end point.
+                if j - i == 1 or (closed and j - i == n - 2):
+                    continue
+
+                # Skip edges whose bounding boxes do not overlap.
+                other = bounds[j]
+                if other[0] > x2 or other[2] < x1 or other[1] > y2 or other[3] < y1:
+                    continue
+
+                if segments_intersect(x[i], y[i], x[i + 1], y[i + 1],
+                                      x[j], y[j], x[j + 1], y[j + 1]):
+                    return True
+
+    return False
+
+def douglas_peucker(x, y, tolerance, closed):
+
+    """Returns a list of flags indicating which of the points with the given
+    sequences of x and y coordinates are kept when the line through them is
+    simplified to within the given tolerance."""
+
+    n = len(x)
+    tolerance2 = tolerance * tolerance
+
+    keep = [False] * n
+    keep[0] = keep[n - 1] = True
+
+    if closed:
+        # Split the ring at the point furthest from the first point.
+        furthest = 0
+        furthest_distance = -1
+        for i in xrange(1, n - 1):
+            d = (x[i] - x[0])*(x[i] - x[0]) + (y[i] - y[0])*(y[i] - y[0])
+            if d > furthest_distance:
+                furthest = i
+                furthest_distance = d
+
+        keep[furthest] = True
+        stack = [(0, furthest), (furthest, n - 1)]
+    else:
+        stack = [(0, n - 1)]
+
+    while stack:
+
+        first, last = stack.pop()
+        if last - first < 2:
+            continue
+
+        x1, y1, x2, y2 = x[first], y[first], x[last], y[last]
+        index = first
+        max_distance = -1
+
+        for i in xrange(first + 1, last):
+            d = segment_distance2(x[i], y[i], x1, y1, x2, y2)
+            if d > max_distance:
+                index = i
+                max_distance = d
+
+        if max_distance > tolerance2:
+            keep[index] = True
+            stack.append((first, index))
+            stack.append((index, last))
+
+    return keep
+
+# The number of times the tolerance is halved for a ring whose simplified
+# version intersects itself before the original ring is used instead.
+max_refinements = 8
+
+def simplify_ring(points, tolerance):
+
+    """Returns an array containing the points in the given ring that are needed
+    to describe it to within the given tolerance.
+
+    For closed rings, where the first and last points are the same, the point
+    furthest from the first point is always kept so that the ring does not
+    collapse into a line. If fewer than four points would remain, the original
+    points are returned instead.
+
+    If the simplified ring intersects itself, the ring is simplified again
+    with half the tolerance, keeping more of its points, until it does not.
+    If it still intersects itself after a number of attempts, the original
+    points are returned. Only intersections within the ring are checked, so
+    a simplified ring may still cross a neighbouring ring if the tolerance is
+    large compared with the distance between them."""
+
+    n = len(points) // 2
+    if n <= 4 or tolerance <= 0:
+        return points
+
+    x = points[0::2]
+    y = points[1::2]
+    closed = x[0] == x[n - 1] and y[0] == y[n - 1]
+
+    for attempt in xrange(max_refinements + 1):
+
+        keep = douglas_peucker(x, y, tolerance, closed)
+
+        if closed and keep.count(True) < 4:
+            return points
+
+        indices = filter(lambda i: keep[i], xrange(n))
+        kept_x = map(lambda i: x[i], indices)
+        kept_y = map(lambda i: y[i], indices)
+
+        if not self_intersects(kept_x, kept_y):
+            simplified = array('d')
+            for i in indices:
+                simplified.append(x[i])
+                simplified.append(y[i])
+            return simplified
+
+        tolerance /= 2.0
+
+    return points
+
+class Simplifier:
+
+    """Simplifies rings using a given tolerance, keeping a count of the number
+    of rings simplified and the numbers of vertices before and after."""
+
+    def __init__(self, tolerance):
+
+        self.tolerance = tolerance
+        self.rings = 0
+        self.before = 0
+        self.after = 0
+
+    def simplify(self, points):
+
+        simplified = simplify_ring(points, self.tolerance)
+
+        self.rings += 1
+        self.before += len(points) // 2
+        self.after += len(simplified) // 2
+
+        return simplified
+
+    def report(self):
+
+        """Returns a description of the number of vertices removed."""
+
+        return "simplified %i rings from %i to %i vertices" % (
+            self.rings, self.before, self.after)
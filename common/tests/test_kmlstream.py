@@ -0,0 +1,36 @@
+"""Tests for the kmlstream module."""
+
+import os, sys, unittest
+from array import array
+
+sys.path.insert(1, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+import kmlstream
+
+class EncodeCoordinatesTest(unittest.TestCase):
+
+    def test_fixed_precision(self):
+
+        text = kmlstream.encode_coordinates(array("d", [10.5, 60, -1.25, 59.123456789]), 3)
+        self.assertEqual(text, "10.500,60.000\n-1.250,59.123\n")
+
+    def test_altitude(self):
+
+        text = kmlstream.encode_coordinates([10.5, 60], 1, 0)
+        self.assertEqual(text, "10.5,60.0,0\n")
+
+    def test_exact_values_are_plain_decimals(self):
+
+        text = kmlstream.encode_coordinates(array("d", [60, 1e-05, 68.533167, -0.1,
+                                                        1.5e20, 12.25]), None)
+        self.assertEqual(text, "60,0.00001\n68.533167,-0.1\n150000000000000000000,12.25\n")
+
+    def test_exact_values_round_trip(self):
+
+        values = [0.1 + 0.2, 1.0 / 3, 123456.789e-10]
+        for value in values:
+            text = kmlstream.plain_number(value)
+            self.assertEqual(float(text), value)
+            self.assertFalse("e" in text)
+
+if __name__ == "__main__":
+    unittest.main()
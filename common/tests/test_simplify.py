@@ -0,0 +1,72 @@
+"""Tests for the simplify module."""
+
+import os, sys, unittest
+from array import array
+
+sys.path.insert(1, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+import simplify
+
+# A closed ring that intersects itself when simplified with a tolerance of 3
+# without checking the result.
+folded_ring = [-2.5, 0.6, -8.1, -2.2, -0.8, -1.4, -0.8, -3.6, 1.5, -8.4,
+               1.7, -3.5, -2.5, 0.6]
+
+class SimplifyTest(unittest.TestCase):
+
+    def test_collinear_points_are_removed(self):
+
+        points = array("d", [0, 0, 1, 0.001, 2, 0, 3, 0.001, 4, 0, 4, 4, 0, 4, 0, 0])
+        simplified = simplify.simplify_ring(points, 0.01)
+
+        self.assertEqual(list(simplified), [0, 0, 4, 0, 4, 4, 0, 4, 0, 0])
+
+    def test_small_rings_are_unchanged(self):
+
+        points = array("d", [0, 0, 1, 0, 1, 1, 0, 0])
+        self.assertEqual(simplify.simplify_ring(points, 10), points)
+
+    def test_rings_do_not_collapse(self):
+
+        points = array("d", [0, 0, 1, 0.1, 2, 0, 1, -0.1, 0.5, 0, 0, 0])
+        self.assertEqual(simplify.simplify_ring(points, 10), points)
+
+    def test_segments_intersect(self):
+
+        self.assertTrue(simplify.segments_intersect(0, 0, 2, 2, 0, 2, 2, 0))
+        self.assertTrue(simplify.segments_intersect(0, 0, 2, 0, 1, 0, 1, 1))
+        self.assertFalse(simplify.segments_intersect(0, 0, 1, 0, 2, 0, 3, 0))
+        self.assertFalse(simplify.segments_intersect(0, 0, 1, 1, 0, 1, 0.4, 0.6))
+
+    def test_self_intersects(self):
+
+        square = ([0, 1, 1, 0, 0], [0, 0, 1, 1, 0])
+        bow_tie = ([0, 1, 0, 1, 0], [0, 1, 1, 0, 0])
+
+        self.assertFalse(simplify.self_intersects(*square))
+        self.assertTrue(simplify.self_intersects(*bow_tie))
+
+    def test_simplified_rings_do_not_intersect_themselves(self):
+
+        points = array("d", folded_ring)
+        x = points[0::2]
+        y = points[1::2]
+
+        # The ring intersects itself if the result is not checked.
+        keep = simplify.douglas_peucker(x, y, 3, True)
+        self.assertTrue(simplify.self_intersects(
+            [x[i] for i in range(len(x)) if keep[i]],
+            [y[i] for i in range(len(y)) if keep[i]]))
+
+        simplified = simplify.simplify_ring(points, 3)
+        self.assertTrue(4 <= len(simplified) // 2 < len(points) // 2)
+        self.assertFalse(simplify.self_intersects(simplified[0::2], simplified[1::2]))
+
+    def test_simplifier_report(self):
+
+        simplifier = simplify.Simplifier(0.01)
+        simplifier.simplify(array("d", [0, 0, 1, 0.001, 2, 0, 2, 2, 0, 2, 0, 0]))
+
+        self.assertEqual(simplifier.report(), "simplified 1 rings from 6 to 5 vertices")
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,225 @@
+#!/usr/bin/env python
+
+# Copyright (C) 2015 MET Norway
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+
+"""Usage: converter-waiter.py [--precision=<digits>] [--simplify=<tolerance>]
+                           [--timings] <spool directory> <period> <output directory>
+                           [<bdiana input directory>]
+
+Monitors the given spool directory for new CAP files (ending in .cap or .xml)
+and LLF GeoJSON files (ending in .json), waiting for the specified period (in
+seconds) before checking again. Each file found is converted to a KML file
+with the same stem in the output directory. Files should be moved into the
+spool directory once they are complete so that they are not read while they
+are being written.
+
+If a bdiana input directory is given, the bdiana input file for each CAP file
+is written to it, so that it can be used as the input directory of one of the
+bdiana waiters.
+
+The CAP schema and the LLF schema are only loaded once, when the waiter is
+started. The files in the spool directory are deleted after being converted.
+Files that cannot be converted are renamed with a .failed suffix.
+
+If the --timings option is given, the time spent in each stage of the
+conversion of each file, such as parsing, validation and writing, is included
+in the message written when the file has been converted.
+"""
+
+import getopt, glob, os, sys, time, traceback
+
+this_dir = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(1, os.path.join(this_dir, os.pardir, "CAP_to_KML"))
+sys.path.insert(1, os.path.join(this_dir, os.pardir, "LLF_to_KML"))
+sys.path.insert(1, os.path.join(this_dir, os.pardir, "common"))
+
+import cap2kml, llf2kml, profiling, simplify
+
+cap_suffixes = (".cap", ".xml")
+llf_suffixes = (".json",)
+
+def now():
+    return time.strftime("%Y-%m-%d %H:%M:%S UTC", time.gmtime())
+
+class Converter:
+
+    """Converts CAP and LLF files using schemas that are loaded only once."""
+
+    def __init__(self, output_dir, input_dir = None, precision = None, tolerance = 0):
+
+        self.output_dir = output_dir
+        self.input_dir = input_dir
+        self.precision = precision
+        self.tolerance = tolerance
+
+        # The LLF schema is compiled when the llf_schema module is imported.
+        self.cap_schema = cap2kml.load_schema()
+
+    def convert(self, file_name, profiler = None):
+
+        """Converts the file with the given file_name, returning the name of the
+        KML file written. Raises an exception if the conversion fails. If a
+        profiler is given, each stage of the conversion is recorded by it."""
+
+        if profiler is None:
+            profiler = profiling.null_profiler
+
+        stem = os.path.splitext(os.path.basename(file_name))[0]
+        kml_file = os.path.join(self.output_dir, stem + ".kml")
+        temp_file = kml_file + ".tmp"
+
+        if file_name.endswith(cap_suffixes):
+            self.convert_cap(file_name, kml_file, temp_file, stem, profiler)
+        else:
+            if self.precision is None:
+                precision = 6
+            else:
+                precision = self.precision
+            llf2kml.convert_file(file_name, temp_file, profiler, precision = precision,
+                                 tolerance = self.tolerance)
+            os.rename(temp_file, kml_file)
+
+        return kml_file
+
+    def convert_cap(self, file_name, kml_file, temp_file, stem, profiler):
+
+        root = cap2kml.read_file(file_name, self.cap_schema, profiler)
+        with profiler.stage("read"):
+            alerts = cap2kml.read_alerts(root)
+
+        if self.tolerance:
+            simplifier = simplify.Simplifier(self.tolerance)
+        else:
+            simplifier = None
+
+        f = open(temp_file, "wb")
+        try:
+            with profiler.stage("write"):
+                times = cap2kml.write_kml(alerts, f, self.precision, simplifier)
+        except:
+            f.close()
+            os.remove(temp_file)
+            raise
+        f.close()
+
+        # Rename the complete file so that other processes never see an
+        # incomplete KML file.
+        os.rename(temp_file, kml_file)
+
+        if self.input_dir:
+            # Write the input file with a name that the bdiana waiters ignore
+            # until it is complete.
+            input_file = os.path.join(self.input_dir, stem + ".input")
+            cap2kml.write_bdiana_input(input_file + ".tmp", kml_file, times)
+            os.rename(input_file + ".tmp", input_file)
+
+def find_jobs(spool_dir):
+
+    files = []
+    for suffix in cap_suffixes + llf_suffixes:
+        files += glob.glob(os.path.join(spool_dir, "*" + suffix))
+
+    files.sort()
+    return files
+
+def make_directory(path, description):
+
+    if not os.path.exists(path):
+        try:
+            os.makedirs(path)
+        except OSError:
+            sys.stderr.write("Failed to create %s '%s'.\n" % (description, path))
+            sys.exit(1)
+        print "%s: Created %s '%s'." % (now(), description, path)
+
+if __name__ == "__main__":
+
+    try:
+        opts, args = getopt.getopt(sys.argv[1:], "", ["precision=", "simplify=",
+                                                      "timings"])
+    except getopt.GetoptError:
+        sys.stderr.write(__doc__)
+        sys.exit(1)
+
+    if not 3 <= len(args) <= 4:
+        sys.stderr.write(__doc__)
+        sys.exit(1)
+
+    opts = dict(opts)
+
+    try:
+        period = int(args[1])
+    except ValueError:
+        sys.stderr.write("Please specify an integer period of time in seconds.\n")
+        sys.exit(1)
+
+    try:
+        if "--precision" in opts:
+            precision = int(opts["--precision"])
+        else:
+            precision = None
+        tolerance = float(opts.get("--simplify", 0))
+    except ValueError:
+        sys.stderr.write(__doc__)
+        sys.exit(1)
+
+    spool_dir = args[0]
+    output_dir = args[2]
+    if len(args) == 4:
+        input_dir = args[3]
+    else:
+        input_dir = None
+
+    make_directory(spool_dir, "spool directory")
+    make_directory(output_dir, "output directory")
+    if input_dir:
+        make_directory(input_dir, "bdiana input directory")
+
+    converter = Converter(output_dir, input_dir, precision, tolerance)
+    print "%s: Loaded schemas." % now()
+
+    while True:
+
+        files = find_jobs(spool_dir)
+        if files:
+            print "%s: Found %i files." % (now(), len(files))
+
+        for file_name in files:
+
+            if "--timings" in opts:
+                profiler = profiling.Profiler()
+            else:
+                profiler = None
+
+            try:
+                kml_file = converter.convert(file_name, profiler)
+            except Exception:
+                sys.stderr.write("%s: Failed to convert '%s'.\n" % (now(), file_name))
+                traceback.print_exc()
+                os.rename(file_name, file_name + ".failed")
+                continue
+
+            if profiler:
+                print "%s: Converted '%s' to '%s' (%s)." % (now(), file_name, kml_file,
+                                                          profiler.summary())
+            else:
+                print "%s: Converted '%s' to '%s'." % (now(), file_name, kml_file)
+            os.remove(file_name)
+
+        time.sleep(period)
+
+    sys.exit()